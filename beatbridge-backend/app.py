@@ -1,40 +1,69 @@
-from flask import Flask, request, session, jsonify, make_response, send_from_directory, url_for, redirect
+from flask import Flask, Request, request, session, g, jsonify, send_from_directory, url_for, redirect
 from flask_session import Session
 from flask_sqlalchemy import SQLAlchemy
-from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 import os
 #Only for local development on http://localhost
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 from flask_login import LoginManager, login_required, current_user, login_user, logout_user
 from datetime import datetime, timedelta
 from tempfile import mkdtemp
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, cached_property
 from flask_mail import Mail, Message
 import jwt
 import random
 import requests
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from oauthlib.oauth2 import WebApplicationClient
 from dotenv import load_dotenv
-from functools import lru_cache
+from functools import lru_cache, partial
 import time
 import json
+import logging
+from cache import caches, TTLCache, RefreshingCache
+from shared_cache import SharedCache
+from concurrent.futures import ThreadPoolExecutor
+from passwords import hash_password, verify_password, needs_rehash, HashingPoolSaturated
+from otp_store import create_otp_store
+import outbox
+from google_oidc import GoogleOIDC, OIDCUnavailable
+from usernames import next_free_username, USERNAME_ALLOCATION_ATTEMPTS
+from shared_loops import owned_jam_ids, taken_titles, copy_titles
+from db_errors import unique_violation_field
+from lastfm import fetch_genre_pool, fetch_track_info, breaker as lastfm_breaker
+from resilience import latency_budget, remaining_budget, budget_exhausted, mark_degraded, is_degraded, OutboundSkipped
+import fanout
+from enrichment import EnrichmentCache
+from recommendations import spread_picks
+from track_slots import SlotPool
+import catalog
+import metrics
+import query_monitor
+from http_cache import cache_policy, apply_policy
+from log_config import configure_logging
+from cors_preflight import CORSPolicy, CORSMiddleware
+from sqlalchemy.engine import make_url
+import click
 
 # Load environment variables from .env file
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
+# Per-request debug events, sampled (see log_config.py)
+request_logger = logging.getLogger(f"{__name__}.requests")
 
 # Global configurations
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-jwt-secret-key')  # In production, use environment variable
 JWT_EXPIRATION_DELTA = timedelta(hours=24)  # Token expires in 24 hours
+# Tokens carry the user's verification state and token version so verified requests skip the DB
+JWT_VERIFIED_CLAIMS = os.environ.get('JWT_VERIFIED_CLAIMS', 'True').lower() == 'true'
+# How long a worker trusts its cached token version before re-reading it (bounds cross-worker revocation lag)
+TOKEN_VERSION_CACHE_TTL = int(os.environ.get('TOKEN_VERSION_CACHE_TTL', 60))
 
 # Google OAuth config
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
 
 # Add this after loading environment variables
 ALLOWED_ORIGINS = [
@@ -45,18 +74,36 @@ ALLOWED_ORIGINS = [
     "https://beatbridge2.netlify.app",  # Add your Netlify domain
     # Add any other Netlify preview/production URLs here
 ]
+# Preview deploys get a URL per commit/branch
+ALLOWED_ORIGIN_PATTERNS = [
+    r"https://beat-bridge-[a-z0-9-]+-jianweis-projects-e43daaa5\.vercel\.app",
+    r"https://[a-z0-9-]+--beatbridge2\.netlify\.app",
+]
+
+class BeatBridgeRequest(Request):
+    @cached_property
+    def identity(self):
+        """The authenticated user (with customization), loaded at most once per request"""
+        user_id = getattr(self, 'user_id', None)
+        return load_identity(user_id) if user_id else None
 
 # Configure application
 app = Flask(__name__)
+app.request_class = BeatBridgeRequest
 app.config['SESSION_COOKIE_NAME'] = 'session'
 app.config['SESSION_COOKIE_SAMESITE'] = 'None'
 is_local = os.environ.get("FLASK_ENV") == "development" or os.environ.get("LOCAL_DEV") == "1"
 app.config['SESSION_COOKIE_SECURE'] = not is_local
 # Trust one layer of proxy for the X-Forwarded headers
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# CORS outermost, so preflights are answered before Flask, sessions or the DB get involved
+app.wsgi_app = CORSMiddleware(app.wsgi_app, CORSPolicy(ALLOWED_ORIGINS, ALLOWED_ORIGIN_PATTERNS))
 # ensure external URLs are built with https://
 app.config['PREFERRED_URL_SCHEME'] = 'https'
-CORS(app, origins=ALLOWED_ORIGINS, supports_credentials=True)
+# Per-route request, SQL and latency metrics, served at /metrics
+metrics.init_app(app)
+# Log N+1 query patterns and slow statements (QUERY_MONITOR=raise fails the request instead; tests only)
+query_monitor.init_app(app)
 
 # Database configuration
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -74,7 +121,7 @@ else:
     DB_NAME = os.environ.get('DB_NAME', 'beatbridge')
     app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-print(f"DEBUG: Connecting to database: {app.config.get('SQLALCHEMY_DATABASE_URI')}")
+logger.debug("Connecting to database %r", make_url(app.config['SQLALCHEMY_DATABASE_URI']))  # repr hides the password
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
@@ -97,9 +144,37 @@ app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
 # Initialize Flask-Mail
 mail = Mail(app)
 
+# 'outbox' queues mail in email_outbox for a background sender so requests only pay for an INSERT;
+# 'inline' sends synchronously inside the request
+EMAIL_DELIVERY = os.environ.get('EMAIL_DELIVERY', 'outbox')
+if EMAIL_DELIVERY == 'outbox':
+    with app.app_context():
+        outbox.ensure_schema(db.engine)
+        outbox_worker = outbox.OutboxWorker(app, mail, db.engine).start()
+
+def deliver_email(msg):
+    """Queue msg to go out once the caller commits; call flush_outbox() after the commit"""
+    if EMAIL_DELIVERY == 'outbox':
+        outbox.enqueue(db.session, msg)
+    else:
+        g.setdefault('pending_email', []).append(msg)
+
+def flush_outbox():
+    # Call after committing: wakes the outbox worker, or sends inline mail now that its data is saved
+    if EMAIL_DELIVERY == 'outbox':
+        outbox_worker.wake()
+    else:
+        while g.get('pending_email'):
+            mail.send(g.pending_email.pop(0))
+
 # Initialize OAuth client
 client = WebApplicationClient(GOOGLE_CLIENT_ID) if GOOGLE_CLIENT_ID else None
 
+# Google discovery document and signing certs, cached per their HTTP caching headers
+google_oidc = GoogleOIDC(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET)
+if GOOGLE_CLIENT_ID:
+    google_oidc.warm()
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -112,6 +187,36 @@ def unauthorized():
         return jsonify({"error": "Unauthorized", "message": "Please log in"}), 401
     return jsonify({"error": "Unauthorized"}), 401
 
+@app.errorhandler(HashingPoolSaturated)
+def hashing_pool_saturated(e):
+    # Too many password hashes in flight on this worker; shed load instead of queueing
+    response = jsonify({"error": "Server is busy, please try again shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Per-worker cache of user_id -> token_version, used to reject revoked tokens without a DB call
+TOKEN_VERSION_CACHE = caches.namespace('token_versions', ttl=TOKEN_VERSION_CACHE_TTL, max_size=50000)
+
+def current_token_version(user_id):
+    """Return the user's token version (None if the user no longer exists), cached per worker"""
+    version = TOKEN_VERSION_CACHE.get(user_id)
+    if version is None:
+        version = db.session.query(User.token_version).filter(User.id == user_id).scalar()
+        if version is None:
+            return None
+        TOKEN_VERSION_CACHE.set(user_id, version)
+    return version
+
+def invalidate_token_version(user_id):
+    # Call after committing a change that affects issued tokens
+    TOKEN_VERSION_CACHE.pop(user_id)
+
+def token_revoked(payload):
+    # Tokens issued before versioning carry no 'tv' claim and are only bounded by their expiry
+    if 'tv' not in payload:
+        return False
+    return payload['tv'] != current_token_version(payload['user_id'])
+
 # JWT Authentication decorator
 def jwt_required(f):
     def decorated_function(*args, **kwargs):
@@ -125,6 +230,9 @@ def jwt_required(f):
             user_id = payload.get('user_id')
             if not user_id:
                 return jsonify({"error": "Invalid token"}), 401
+
+            if token_revoked(payload):
+                return jsonify({"error": "Token has been revoked"}), 401
             
             # Add user_id to request context for use in route handlers
             request.user_id = user_id
@@ -151,13 +259,25 @@ def jwt_verified_required(f):
             if not user_id:
                 return jsonify({"error": "Invalid token"}), 401
             
-            # Check if user is verified
-            user = User.query.get(user_id)
-            if not user:
-                return jsonify({"error": "User not found"}), 404
-            
-            if not user.is_verified:
-                return jsonify({"error": "Email verification required"}), 403
+            if JWT_VERIFIED_CLAIMS and payload.get('verified') is True and 'tv' in payload:
+                # Verified-claim token: only the (cached) token version needs checking
+                version = current_token_version(user_id)
+                if version is None:
+                    return jsonify({"error": "User not found"}), 404
+                if payload['tv'] != version:
+                    return jsonify({"error": "Token has been revoked"}), 401
+            else:
+                # Legacy or unverified token: check the user row directly
+                request.user_id = user_id
+                user = request.identity
+                if not user:
+                    return jsonify({"error": "User not found"}), 404
+
+                if 'tv' in payload and payload['tv'] != user.token_version:
+                    return jsonify({"error": "Token has been revoked"}), 401
+
+                if not user.is_verified:
+                    return jsonify({"error": "Email verification required"}), 403
             
             # Add user_id to request context for use in route handlers
             request.user_id = user_id
@@ -182,6 +302,12 @@ class User(db.Model):
     is_verified = db.Column(db.Boolean, default=False)  # Track email verification status
     verification_code = db.Column(db.String(6))  # Store temporary verification code
     google_id = db.Column(db.String(100), unique=True)  # For Google OAuth users
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped to revoke issued JWTs
+    __table_args__ = (
+        # Usernames and emails are unique regardless of case
+        db.Index('ux_users_username_lower', db.func.lower(username), unique=True),
+        db.Index('ux_users_email_lower', db.func.lower(email), unique=True),
+    )
 
     def get_id(self):
         return str(self.id)
@@ -207,12 +333,19 @@ class User(db.Model):
         # Generates a JWT token for the user
         payload = {
             'user_id': self.id,
+            'verified': bool(self.is_verified),
+            'tv': self.token_version or 0,
             'exp': datetime.utcnow() + JWT_EXPIRATION_DELTA
         }
         return jwt.encode(payload, JWT_SECRET_KEY, algorithm='HS256')
 
+    def revoke_tokens(self):
+        # Invalidates every JWT issued so far; callers must commit and then invalidate_token_version
+        self.token_version = (self.token_version or 0) + 1
+
     def set_password(self, password):
-        self.hash = generate_password_hash(password, method='pbkdf2:sha256')
+        self.hash = hash_password(password)
+        self.revoke_tokens()
 
 class UserCustomization(db.Model):
     __tablename__ = 'user_customizations'
@@ -243,14 +376,21 @@ class SharedLoopNotification(db.Model):
     status = db.Column(db.String(20), nullable=False)  # 'accepted' or 'rejected'
     created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.current_timestamp())
 
+def load_identity(user_id):
+    """Load a user and their customization with one joined query"""
+    return (User.query
+            .options(db.joinedload(User.customization))
+            .filter(User.id == user_id)
+            .first())
+
 # Create tables
 def init_db():
     try:
         with app.app_context():
             db.create_all()
-            print("Database tables created successfully!")
+            logger.info("Database tables created successfully")
     except Exception as e:
-        print(f"Error creating database tables: {e}")
+        logger.error("Error creating database tables: %s", e)
         raise e
 
 # Initialize database tables
@@ -258,36 +398,21 @@ init_db()
 
 @login_manager.user_loader
 def load_user(user_id):
+    # Reuse the request's identity when it belongs to the same user
+    if getattr(request, 'user_id', None) == int(user_id):
+        return request.identity
     return User.query.get(int(user_id))
 
 @app.route('/')
 def index():
     return jsonify({"message": "Backend server is running"}), 200
 
-@app.before_request
-def before_request_func():
-    if request.method == 'OPTIONS':
-        response = make_response()
-        origin = request.headers.get('Origin')
-        print(f"OPTIONS request from origin: {origin}")  # Debug log
-        if origin in ALLOWED_ORIGINS:
-            response.headers.add('Access-Control-Allow-Origin', origin)
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Accept')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
-
 @app.after_request
 def after_request(response):
-    """Ensure responses aren't cached and CORS headers are set"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
-    origin = request.headers.get('Origin')
-    print(f"After request from origin: {origin}")  # Debug log
-    if origin in ALLOWED_ORIGINS:
-        response.headers["Access-Control-Allow-Origin"] = origin
-    response.headers["Access-Control-Allow-Credentials"] = "true"
+    """Apply the route's cache policy (no-store by default); CORS headers come from CORSMiddleware"""
+    apply_policy(response)
+    request_logger.debug("Request served", extra={'origin': request.headers.get('Origin'), 'path': request.path,
+                                                  'status': response.status_code})
     return response
 
 @app.route("/api/register", methods=["POST", "OPTIONS"])
@@ -316,48 +441,52 @@ def register():
     if errors:
         return jsonify({"errors": errors}), 400
     
-    # Check if username already exists
-    if User.query.filter_by(username=username).first():
-        errors['username'] = "Username already exists"
-        return jsonify({"errors": errors}), 400
-    
-    # Check if email already exists
-    if User.query.filter_by(email=email).first():
-        errors['email'] = "Email already exists"
-        return jsonify({"errors": errors}), 400
-    
     try:
-        # Create new user (always unverified initially)
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+        # If email is not configured, the user is verified straight away
+        requires_verification = bool(app.config['MAIL_USERNAME'] and app.config['MAIL_PASSWORD'])
+        hashed_password = hash_password(password)
         new_user = User(
             username=username,
             email=email,
             hash=hashed_password,
-            is_verified=False  # Always start as unverified
+            is_verified=not requires_verification
         )
         db.session.add(new_user)
-        db.session.commit()
-        
-        verification_message = "Please check your email for verification code."
-        requires_verification = True
+        if requires_verification:
+            # Code and (queued) email are saved in the same transaction as the user
+            new_user.generate_verification_code()
+            deliver_email(verification_email(new_user))
         
-        # Try to send verification email
+        # One INSERT; the unique indexes (case-insensitive) report a taken username or email
         try:
-            if app.config['MAIL_USERNAME'] and app.config['MAIL_PASSWORD']:
-                send_verification_email(new_user)
-            else:
-                # If email is not configured, auto-verify the user
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            field = unique_violation_field(e, ('username', 'email'))
+            if not field:
+                raise
+            errors[field] = "Username already exists" if field == 'username' else "Email already exists"
+            return jsonify({"errors": errors}), 400
+        
+        if requires_verification:
+            verification_message = "Please check your email for verification code."
+        else:
+            verification_message = "Email verification is not configured."
+        
+        if EMAIL_DELIVERY == 'outbox':
+            # Queued with the user; the outbox worker retries failed sends
+            flush_outbox()
+        else:
+            # Try to send verification email
+            try:
+                flush_outbox()
+            except Exception as e:
+                logger.error("Email sending error: %s", e)
+                # If email sending fails, auto-verify the user
                 new_user.is_verified = True
                 db.session.commit()
-                verification_message = "Email verification is not configured."
+                verification_message = "Email verification is not available."
                 requires_verification = False
-        except Exception as e:
-            print(f"Email sending error: {str(e)}")
-            # If email sending fails, auto-verify the user
-            new_user.is_verified = True
-            db.session.commit()
-            verification_message = "Email verification is not available."
-            requires_verification = False
         
         # Only log in and provide token if user is verified
         if new_user.is_verified:
@@ -373,9 +502,11 @@ def register():
             "requires_verification": requires_verification,
             "token": token
         }), 201
+    except HashingPoolSaturated:
+        raise
     except Exception as e:
         db.session.rollback()
-        print(f"Registration error: {str(e)}")
+        logger.error("Registration error: %s", e)
         return jsonify({"error": "An error occurred during registration"}), 500
 
 @app.route("/api/login", methods=["GET", "POST"])
@@ -401,13 +532,18 @@ def login():
         user = User.query.filter((User.username == username) | (User.email == username)).first()
 
         # If user exists and is a Google user, block password login only if hash is the placeholder
-        if user and user.google_id and check_password_hash(user.hash, 'google-oauth-user'):
+        if user and user.google_id and verify_password(user.hash, 'google-oauth-user'):
             return jsonify({"errors": {"general": "This account was created with Google. Please use 'Sign in with Google' to log in or set a password."}}), 403
 
         # Ensure username exists and password is correct
-        if user is None or not check_password_hash(user.hash, password):
+        if user is None or not verify_password(user.hash, password):
             return jsonify({"errors": {"general": "Invalid username and/or password"}}), 401
 
+        # Upgrade hashes made under an older cost policy while we have the plaintext
+        if needs_rehash(user.hash):
+            user.hash = hash_password(password)
+            db.session.commit()
+
         # Check if user is verified
         if not user.is_verified:
             return jsonify({"errors": {"general": "Please verify your email before logging in. Check your email for the verification code."}}), 403
@@ -421,8 +557,10 @@ def login():
             "token": user.generate_jwt_token()
         }), 200
 
+    except HashingPoolSaturated:
+        raise
     except Exception as e:
-        print(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         return jsonify({"errors": {"general": "An error occurred during login"}}), 500
 
 @app.route("/api/logout", methods=["POST"])
@@ -433,13 +571,13 @@ def logout():
         # The client should remove the token
         return jsonify({"message": "Logged out successfully"}), 200
     except Exception as e:
-        print(f"Logout error: {str(e)}")
+        logger.error("Logout error: %s", e)
         return jsonify({"error": "An error occurred during logout"}), 500
 
 @app.route('/api/user', methods=["GET"])
 @jwt_required
 def get_user():
-    user = User.query.get(request.user_id)
+    user = request.identity
     if not user:
         return jsonify({"error": "User not found"}), 404
 
@@ -455,14 +593,10 @@ def get_user():
 @jwt_required
 def get_customization():
     try:
-        user_id = request.user_id
-        
-        customization = UserCustomization.query.filter_by(user_id=user_id).first()
+        customization = request.identity.customization if request.identity else None
         if not customization:
             return jsonify({"error": "No customization found"}), 404
         
-        print(f"User ID: {user_id}, Customization: {customization}")
-        
         return jsonify({
             "skill_level": customization.skill_level,
             "practice_frequency": customization.practice_frequency,
@@ -470,7 +604,7 @@ def get_customization():
         }), 200
         
     except Exception as e:
-        print(f"Error fetching customization: {str(e)}")
+        logger.error("Error fetching customization: %s", e)
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route("/api/save-customization", methods=["POST"])
@@ -497,9 +631,12 @@ def save_customization():
             
         # Get current user's ID from JWT token
         user_id = request.user_id
+        identity = request.identity
+        if identity is None:
+            return jsonify({"error": "User not found"}), 404
         
         # Update or create customization
-        customization = UserCustomization.query.filter_by(user_id=user_id).first()
+        customization = identity.customization
         if customization:
             customization.skill_level = data["skill_level"]
             customization.practice_frequency = data["practice_frequency"]
@@ -518,7 +655,7 @@ def save_customization():
         
     except Exception as e:
         db.session.rollback()
-        print(f"Error saving customization: {str(e)}")
+        logger.error("Error saving customization: %s", e)
         return jsonify({"error": "Internal server error"}), 500
 
 # Update user profile
@@ -530,37 +667,37 @@ def update_user():
     new_username = data.get("username")
     new_email = data.get("email")
     new_password = data.get("password")
-    user_id = request.user_id
     errors = {}
 
-    user = User.query.get(user_id)
+    user = request.identity
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    # Check if username is taken by another user
-    if new_username and new_username != user.username:
-        if User.query.filter(User.username == new_username, User.id != user_id).first():
-            errors["username"] = "Username already exists"
-    # Check if email is taken by another user
-    if new_email and new_email != user.email:
-        if User.query.filter(User.email == new_email, User.id != user_id).first():
-            errors["email"] = "Email already exists"
-
-    if errors:
-        return jsonify({"errors": errors}), 400
-
     # Update username if changed and not taken
     if new_username:
         user.username = new_username
     # Update email if changed and not taken
-    if new_email:
+    if new_email and new_email != user.email:
         user.email = new_email
-    # If a new password is provided, hash and update it
+        user.revoke_tokens()
+    # If a new password is provided, hash and update it (this also revokes existing tokens)
     if new_password:
-        user.hash = generate_password_hash(new_password, method='pbkdf2:sha256')
-    # Update the user in the database with the new information
-    db.session.commit()
-    return jsonify({"message": "User updated successfully"}), 200
+        user.set_password(new_password)
+    # Update the user in the database; the unique indexes reject a username/email taken by another user
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        field = unique_violation_field(e, ('username', 'email'))
+        if not field:
+            raise
+        errors[field] = "Username already exists" if field == 'username' else "Email already exists"
+        return jsonify({"errors": errors}), 400
+    invalidate_token_version(user.id)
+    return jsonify({
+        "message": "User updated successfully",
+        "token": user.generate_jwt_token()
+    }), 200
 
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads', 'profile_pics')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -585,7 +722,7 @@ def upload_profile_pic():
         filename = f"user_{user_id}.{ext}"
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(file_path)
-        user = User.query.get(user_id)
+        user = request.identity
         user.profile_pic_url = f"/uploads/profile_pics/{filename}"
         db.session.commit()
         return jsonify({'profile_pic_url': user.profile_pic_url}), 200
@@ -593,6 +730,7 @@ def upload_profile_pic():
         return jsonify({'error': 'Invalid file type'}), 400
 
 @app.route('/uploads/profile_pics/<filename>')
+@cache_policy(public=True, max_age=300)  # Re-uploads keep the filename, so keep this short
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
@@ -609,6 +747,7 @@ def verify_email():
     user.is_verified = True
     user.verification_code = None
     db.session.commit()
+    invalidate_token_version(user.id)
     login_user(user)
     session["user_id"] = user.id
 
@@ -636,9 +775,9 @@ def check_verification_status():
 
 
 
-def send_verification_email(user):
-    verification_code = user.generate_verification_code() #Generate a verification code for the user
-    db.session.commit() #Commit the changes to the database
+def verification_email(user):
+    """Build the verification email for the user's current code"""
+    verification_code = user.verification_code
     
     msg = Message('Verify your BeatBridge account', #Create a message object with the verification code
                   sender=app.config['MAIL_USERNAME'],
@@ -652,13 +791,19 @@ Please enter this code to verify your email address.
 
 If you did not create a BeatBridge account, please ignore this email. 
 '''
-    mail.send(msg) #Send the email
+    return msg
+
+def send_verification_email(user):
+    user.generate_verification_code() #Generate a verification code for the user
+    deliver_email(verification_email(user)) #Queue the email
+    db.session.commit() #Commit the code together with the queued email
+    flush_outbox()
 
 FRONTEND_BASE_URL = os.environ.get('FRONTEND_BASE_URL', 'http://localhost:3000')
 
 @app.route('/api/google-login')
 def google_login():
-    google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+    google_provider_cfg = google_oidc.provider_config()
     authorization_endpoint = google_provider_cfg["authorization_endpoint"]
     redirect_uri = url_for('google_callback', _external=True)
     request_uri = client.prepare_request_uri(
@@ -671,22 +816,15 @@ def google_login():
 def make_unique_username(desired_name):
     """
     Turn "Sherman Tan" → "ShermanTan", then if that already exists
-    try "ShermanTan1", "ShermanTan2", … until it's unique.
+    take the first free of "ShermanTan1", "ShermanTan2", … (one query).
     """
     base = desired_name.replace(" ", "")
-    candidate = base
-    suffix = 1
-
-    while User.query.filter_by(username=candidate).first():
-        candidate = f"{base}{suffix}"
-        suffix += 1
-
-    return candidate
+    return next_free_username(db.session, User.username, base)
 
 @app.route('/api/google-login/callback')
 def google_callback():
     code = request.args.get("code")
-    google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+    google_provider_cfg = google_oidc.provider_config()
     token_endpoint = google_provider_cfg["token_endpoint"]
     redirect_uri = url_for('google_callback', _external=True)
     token_url, headers, body = client.prepare_token_request(
@@ -695,17 +833,13 @@ def google_callback():
         redirect_url=redirect_uri,
         code=code
     )
-    token_response = requests.post(
-        token_url,
-        headers=headers,
-        data=body,
-        auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
-    ).json()
+    token_response = google_oidc.exchange_code(token_url, headers, body)
     id_token_jwt = token_response['id_token']
     try:
-        idinfo = id_token.verify_oauth2_token(
-            id_token_jwt, google_requests.Request(), GOOGLE_CLIENT_ID
-        )
+        idinfo = google_oidc.verify_id_token(id_token_jwt)
+    except OIDCUnavailable as e:
+        logger.warning("Google sign-in could not be verified: %s", e)
+        return redirect(f"{FRONTEND_BASE_URL}/login?error=google_auth_failed")
     except ValueError:
         return redirect(f"{FRONTEND_BASE_URL}/login?error=google_auth_failed")
     
@@ -725,16 +859,29 @@ def google_callback():
             user.google_id = google_id
     else:
         # Brand new user, pick a unique username from their name
-        unique_username = make_unique_username(name or email.split('@')[0])
-        user = User(
-            username=unique_username,
-            email=email,
-            google_id=google_id,
-            profile_pic_url=picture,
-            is_verified=True,
-            hash=generate_password_hash('google-oauth-user')
-        )
-        db.session.add(user)
+        placeholder_hash = hash_password('google-oauth-user')
+        for attempt in range(USERNAME_ALLOCATION_ATTEMPTS):
+            unique_username = make_unique_username(name or email.split('@')[0])
+            user = User(
+                username=unique_username,
+                email=email,
+                google_id=google_id,
+                profile_pic_url=picture,
+                is_verified=True,
+                hash=placeholder_hash
+            )
+            db.session.add(user)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # A concurrent sign-up took the name (or this same account was just created); try again
+                db.session.rollback()
+                user = User.query.filter((User.google_id == google_id) | (User.email == email)).first()
+                if user:
+                    break
+        else:
+            return redirect(f"{FRONTEND_BASE_URL}/login?error=google_auth_failed")
     db.session.commit()
     login_user(user)
     token = user.generate_jwt_token()
@@ -742,9 +889,7 @@ def google_callback():
 
 # --- Song Recommendation System (Last.fm Integration) ---
 
-# Last.fm API configuration
-LASTFM_API_KEY = os.environ.get('LASTFM_API_KEY', 'your-lastfm-api-key')  # Get from environment variable
-LASTFM_BASE_URL = 'http://ws.audioscrobbler.com/2.0/'
+# Last.fm API configuration and page fetching live in lastfm.py
 
 # List of popular genres for the frontend genre selection
 POPULAR_GENRES = [
@@ -752,26 +897,216 @@ POPULAR_GENRES = [
     "reggae", "folk", "punk", "soul", "funk", "disco", "house", "techno", "trance", "k-pop"
 ]
 
-GENRE_CACHE = {}
+# Genre pools are refreshed in the background after CACHE_DURATION and served stale meanwhile (for up to
+# GENRE_POOL_STALE_DURATION more); any genre string can be requested, so they're bounded too
 CACHE_DURATION = timedelta(hours=1)
-TRACKS_PER_PAGE = 50  # Increased from 20
-MAX_PAGES = 3  # Number of pages to cache per genre
-
-def fetch_genre_tracks(genre, page=1):
-    """Fetch tracks for a genre from Last.fm with pagination"""
-    params = {
-        'method': 'tag.gettoptracks',
-        'tag': genre,
-        'api_key': LASTFM_API_KEY,
-        'format': 'json',
-        'limit': TRACKS_PER_PAGE,
-        'page': page
+GENRE_POOL_STALE_DURATION = timedelta(hours=24)
+GENRE_POOL_CACHE_SIZE = 200
+GENRE_POOL_WARMUP = os.environ.get('GENRE_POOL_WARMUP', 'True').lower() == 'true'
+# Optional SQLite file shared by all workers on the host, so each pool is fetched once per host, not per worker
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH')
+shared_cache = caches.add('shared', SharedCache(SHARED_CACHE_PATH)) if SHARED_CACHE_PATH else None
+
+# track.getInfo details cached in the track_enrichment table (shared by all workers). `flask ingest-tracks`
+# prefills them once; prefilling every freshly fetched pool runs in each worker, so it's opt-in
+ENRICHMENT_PREFILL = os.environ.get('ENRICHMENT_PREFILL', 'False').lower() == 'true'
+with app.app_context():
+    # Prefill skips the breaker, so its failures never fail users' lookups fast
+    TRACK_ENRICHMENT = caches.add('track_enrichment', EnrichmentCache(
+        db.engine, fetch_track_info, prefill_fetch_info=partial(fetch_track_info, use_breaker=False)))
+    TRACK_ENRICHMENT.ensure_schema()
+
+# Where genre pools come from: 'lastfm' (fetched on demand) or 'catalog' (the tracks tables, filled by
+# `flask ingest-tracks`), which keeps Last.fm off the request path entirely
+RECOMMENDATION_SOURCE = os.environ.get('RECOMMENDATION_SOURCE', 'lastfm').lower()
+CATALOG_POOL_SIZE = int(os.environ.get('CATALOG_POOL_SIZE', 500))
+with app.app_context():
+    catalog_engine = db.engine  # Pools are loaded on background refresh threads, outside any app context
+    catalog.ensure_schema(catalog_engine)
+
+def fetch_and_enrich_pool(genre):
+    """Fetch a genre pool from Last.fm and queue a background prefill of its track details"""
+    pool = fetch_genre_pool(genre)
+    if pool and ENRICHMENT_PREFILL:
+        TRACK_ENRICHMENT.prefill_async(pool)
+    return pool
+
+def load_genre_pool(genre):
+    """Genre pool from the catalog, or from the shared tier if another worker fetched it recently, else from Last.fm (and shared)"""
+    if RECOMMENDATION_SOURCE == 'catalog':
+        return catalog.catalog_pool(catalog_engine, genre, CATALOG_POOL_SIZE)
+    if shared_cache is None:
+        return fetch_and_enrich_pool(genre)
+    return shared_cache.read_through('genre_pools', genre, fetch_and_enrich_pool, ttl=CACHE_DURATION.total_seconds())
+
+GENRE_POOLS = caches.add('genre_pools', RefreshingCache(
+    load_genre_pool,
+    ttl=CACHE_DURATION.total_seconds(),
+    stale_ttl=GENRE_POOL_STALE_DURATION.total_seconds(),
+    cache=TTLCache((CACHE_DURATION + GENRE_POOL_STALE_DURATION).total_seconds(), max_size=GENRE_POOL_CACHE_SIZE),
+    # Separate from lastfm's page-fetch pool, which each refresh waits on
+    executor=ThreadPoolExecutor(max_workers=4, thread_name_prefix='genre-refresh'),
+))
+if GENRE_POOL_WARMUP:
+    # Fetch every listed genre in the background so users never wait for these pools
+    GENRE_POOLS.warm(POPULAR_GENRES)
+# Slot layout of each genre's current pool, carried over (and remapped) across refreshes
+GENRE_SLOTS = caches.namespace('genre_slots', ttl=(CACHE_DURATION + GENRE_POOL_STALE_DURATION).total_seconds(),
+                               max_size=GENRE_POOL_CACHE_SIZE)
+# Tracks recently recommended to each user for each genre, as a (pool version, slot bitset) pair
+# (least recently used user×genre pairs are dropped)
+RECENT_TRACKS_TTL = timedelta(hours=12)
+RECENT_TRACKS_CACHE_SIZE = int(os.environ.get('RECENT_TRACKS_CACHE_SIZE', 20000))
+RECENT_TRACKS = caches.namespace('recent_tracks', ttl=RECENT_TRACKS_TTL.total_seconds(), max_size=RECENT_TRACKS_CACHE_SIZE)
+
+def slotted_pool(genre, available_tracks):
+    """The SlotPool for a genre's current pool list, built (from the previous layout) when the list changes"""
+    def layout(current):
+        if current is not None and current.source is available_tracks:
+            return current
+        return SlotPool(available_tracks, previous=current)
+    return GENRE_SLOTS.update(genre, layout)
+
+def pick_fresh_tracks(user_id, genre, available_tracks, count=1, exclude=()):
+    """
+    Pick up to `count` random tracks the user hasn't been recommended lately
+    (never one whose URL is in `exclude`) and record them.
+    Returns an empty list if the pool has nothing left to pick.
+    """
+    pool = slotted_pool(genre, available_tracks)
+    candidates = pool.full & ~pool.mask(exclude)
+    picked = []
+
+    def pick(entry):
+        recent = pool.carry(entry)
+        # Filter out recently recommended tracks
+        fresh = candidates & ~recent
+        # If we've recommended most tracks, clear the recent tracks
+        if fresh.bit_count() < max(5, count):
+            fresh = candidates
+            recent = 0
+        chosen = pool.sample(fresh, count)
+        picked.extend(pool.tracks[slot] for slot in chosen)
+        # Update recent tracks
+        chosen_bits = sum(1 << slot for slot in chosen)
+        recent |= chosen_bits
+        if recent.bit_count() > pool.size * 0.7:  # Clear if we've used 70% of tracks
+            recent = chosen_bits
+        return (pool.version, recent)
+
+    # Atomic per key, so concurrent requests from the same user don't lose updates
+    RECENT_TRACKS.update((user_id, genre), pick)
+    return picked
+
+def forget_recent(user_id, genre, available_tracks, tracks):
+    """Un-record picks the user was never shown (e.g. backups that weren't needed)"""
+    if not tracks:
+        return
+    pool = slotted_pool(genre, available_tracks)
+    unused = pool.mask(track['url'] for track in tracks)
+    RECENT_TRACKS.update((user_id, genre), lambda entry: (pool.version, pool.carry(entry) & ~unused))
+
+def track_details(track):
+    """A pool track's Last.fm details, or None if Last.fm has none or is unavailable"""
+    # Cached, including "not found" and recent failures
+    try:
+        return TRACK_ENRICHMENT.lookup(track['artist']['name'], track['name'])
+    except Exception as e:
+        logger.error("Error fetching track details: %s", e)
+        return None
+
+def enrich_track(track):
+    """Copy of a pool track with its Last.fm details merged in (the pool is shared between requests)"""
+    track = dict(track)
+    if RECOMMENDATION_SOURCE == 'catalog':
+        return track  # Catalog tracks were stored with their details
+    track_info = track_details(track)
+    if track_info:
+        track.update(track_info)
+    return track
+
+def track_summary(track):
+    """The fields of an (enriched) track that we send to the client"""
+    # Build the recommendation with only verified data
+    album_images = track.get('album', {}).get('image', [])
+    album_image = next((img['#text'] for img in reversed(album_images) if img['#text']), None)
+    if not album_image:
+        album_image = track.get('image', [{'#text': None}])[-1].get('#text')
+
+    return {
+        'name': track.get('name', 'Unknown'),
+        'artist': track.get('artist', {}).get('name', 'Unknown'),
+        'url': track.get('url', ''),
+        'listeners': track.get('listeners', 0),
+        'album': track.get('album', {}).get('title', 'Unknown Album'),
+        'album_image': album_image,
+        'duration': track.get('duration', '180000'),  # Default to 3 minutes if not available
+        'tags': track.get('toptags', {}).get('tag', []) or track.get('tags', {}).get('tag', [])
     }
-    response = requests.get(LASTFM_BASE_URL, params=params, timeout=5)
-    response.raise_for_status()
-    return response.json()
+
+# Rhythm complexity and tempo ratings based on skill level and genre
+RHYTHM_COMPLEXITY = {
+    'First-timer': 1,
+    'Beginner': 2,
+    'Intermediate': 3,
+    'Advanced': 4
+}
+FAST_GENRES = {'metal', 'punk', 'rock', 'electronic', 'techno', 'house'}
+SLOW_GENRES = {'blues', 'jazz', 'classical', 'folk'}
+SKILL_CONTEXT = {
+    'First-timer': 'Perfect for beginners to practice basic rhythms!',
+    'Beginner': 'Great for developing your fundamental skills.',
+    'Intermediate': 'This song will help you build more advanced techniques.',
+    'Advanced': 'A challenging piece to test your drumming mastery!'
+}
+
+def tempo_rating(skill_level, genre):
+    """Skill level's base tempo, adjusted by genre"""
+    base_tempo = RHYTHM_COMPLEXITY[skill_level]
+    if genre in FAST_GENRES:
+        return min(4, base_tempo + 1)
+    if genre in SLOW_GENRES:
+        return max(1, base_tempo - 1)
+    return base_tempo
+
+# Batch recommendations: default and maximum number of tracks, and threads for pool loads and enrichment
+RECOMMEND_BATCH_DEFAULT = 5
+RECOMMEND_BATCH_MAX = 20
+RECOMMEND_BATCH_WORKERS = int(os.environ.get('RECOMMEND_BATCH_WORKERS', 16))
+_recommend_pool = ThreadPoolExecutor(max_workers=RECOMMEND_BATCH_WORKERS, thread_name_prefix='recommend')
+# Seconds a recommendation request may spend waiting on Last.fm, across all its calls
+RECOMMEND_LATENCY_BUDGET = float(os.environ.get('RECOMMEND_LATENCY_BUDGET', 1.5))
+RECOMMENDATIONS_UNAVAILABLE = 'Recommendations are temporarily unavailable. Please try again shortly.'
+# Backup tracks looked up alongside each single recommendation, standing in if Last.fm has no details for the pick
+RECOMMEND_BACKUP_CANDIDATES = int(os.environ.get('RECOMMEND_BACKUP_CANDIDATES', 1))
+
+def budgeted_pool(genre):
+    """
+    A genre's pool within the request's latency budget. Cached pools (stale or
+    not) return at once; a cold one raises BudgetExhausted if it can't load in time.
+    """
+    try:
+        pool = GENRE_POOLS.get(genre, timeout=remaining_budget())
+    except TimeoutError:
+        raise budget_exhausted(f"Latency budget exhausted loading the {genre} pool")
+    if RECOMMENDATION_SOURCE == 'lastfm' and lastfm_breaker.state != 'closed':
+        mark_degraded()  # Served from cache while Last.fm is unavailable, so it may be stale
+    return pool
+
+async def resolve_recommendation(candidates):
+    """
+    Look up the pick and its backups at once and return (track, enriched copy)
+    for the first one Last.fm has details for, or for the pick as charted if
+    none has. A missing pick costs the slowest lookup, not a second round trip.
+    """
+    if RECOMMENDATION_SOURCE == 'catalog':
+        return candidates[0], dict(candidates[0])  # Catalog tracks were stored with their details
+    track, track_info = await fanout.first_result(_recommend_pool, track_details, candidates,
+                                                  lambda info: info is not None)
+    return track, {**track, **(track_info or {})}
 
 @app.route('/api/genres', methods=['GET'])
+@cache_policy(public=True, max_age=86400)
 def get_genres():
     """
     Returns a static list of popular genres for the frontend genre selection
@@ -781,6 +1116,7 @@ def get_genres():
 
 @app.route('/api/recommend-song', methods=['POST'])
 @jwt_verified_required
+@latency_budget(RECOMMEND_LATENCY_BUDGET)
 def recommend_song():
     """Get song recommendations based on genre preferences and user's skill level"""
     try:
@@ -792,135 +1128,140 @@ def recommend_song():
 
         # Get user's skill level
         user_id = request.user_id
-        customization = UserCustomization.query.filter_by(user_id=user_id).first()
+        customization = request.identity and request.identity.customization
         skill_level = customization.skill_level if customization else 'First-timer'
         selected_genre = genres[0]
         
         # Get tracks from cache
-        cache_key = f"genre_tracks_{selected_genre}"
         try:
-            if cache_key not in GENRE_CACHE:
-                # If not in cache, fetch first page
-                GENRE_CACHE[cache_key] = fetch_genre_tracks(selected_genre)
-            
-            tracks_data = GENRE_CACHE[cache_key]
-            if 'tracks' not in tracks_data or 'track' not in tracks_data['tracks']:
+            # Served from cache (stale while a refresh runs); only a never-fetched genre waits for Last.fm
+            available_tracks = budgeted_pool(selected_genre)
+            if not available_tracks:
                 return jsonify({'error': f'No tracks found for genre: {selected_genre}'}), 404
 
-            # Get all available tracks
-            available_tracks = tracks_data['tracks']['track']
-            
-            # Get recently recommended tracks for this user and genre
-            recent_tracks_key = f"recent_tracks_{user_id}_{selected_genre}"
-            recent_tracks = GENRE_CACHE.get(recent_tracks_key, set())
-            
-            # Filter out recently recommended tracks
-            fresh_tracks = [t for t in available_tracks if t['url'] not in recent_tracks]
-            
-            # If we've recommended most tracks, clear the recent tracks
-            if len(fresh_tracks) < 5:
-                fresh_tracks = available_tracks
-                recent_tracks = set()
-
-            # ADD THIS CHECK:
-            if not fresh_tracks:
+            # Get a random track the user hasn't seen lately, plus backups in case Last.fm has no details for it
+            backups = 0 if RECOMMENDATION_SOURCE == 'catalog' else RECOMMEND_BACKUP_CANDIDATES
+            candidates = pick_fresh_tracks(user_id, selected_genre, available_tracks, count=1 + backups)
+            if not candidates:
                 return jsonify({'error': f'No tracks found for genre: {selected_genre}. Please try another genre or try again later.'}), 404
-
-            # Get a random track from the fresh tracks
-            track = random.choice(fresh_tracks)
-            
-            # Update recent tracks
-            recent_tracks.add(track['url'])
-            if len(recent_tracks) > len(available_tracks) * 0.7:  # Clear if we've used 70% of tracks
-                recent_tracks = {track['url']}
-            GENRE_CACHE[recent_tracks_key] = recent_tracks
-
-            # Get additional track info
-            try:
-                params = {
-                    'method': 'track.getInfo',
-                    'artist': track['artist']['name'],
-                    'track': track['name'],
-                    'api_key': LASTFM_API_KEY,
-                    'format': 'json'
-                }
-                track_info = requests.get(LASTFM_BASE_URL, params=params, timeout=2).json()
-                if 'track' in track_info:
-                    track.update(track_info['track'])
-            except Exception as e:
-                print(f"Error fetching track details: {str(e)}")
-
-            # Build the recommendation with only verified data
-            album_images = track.get('album', {}).get('image', [])
-            album_image = next((img['#text'] for img in reversed(album_images) if img['#text']), None)
-            if not album_image:
-                album_image = track.get('image', [{'#text': None}])[-1].get('#text')
-
-            recommended_track = {
-                'name': track.get('name', 'Unknown'),
-                'artist': track.get('artist', {}).get('name', 'Unknown'),
-                'url': track.get('url', ''),
-                'listeners': track.get('listeners', 0),
-                'album': track.get('album', {}).get('title', 'Unknown Album'),
-                'album_image': album_image,
-                'duration': track.get('duration', '180000'),  # Default to 3 minutes if not available
-                'tags': track.get('toptags', {}).get('tag', []) or track.get('tags', {}).get('tag', [])
-            }
-
-            # Add rhythm complexity and tempo ratings based on skill level and genre
-            rhythm_complexity = {
-                'First-timer': 1,
-                'Beginner': 2,
-                'Intermediate': 3,
-                'Advanced': 4
-            }
-
-            # Adjust tempo rating based on genre
-            fast_genres = {'metal', 'punk', 'rock', 'electronic', 'techno', 'house'}
-            slow_genres = {'blues', 'jazz', 'classical', 'folk'}
-            
-            base_tempo = tempo_rating = {
-                'First-timer': 1,
-                'Beginner': 2,
-                'Intermediate': 3,
-                'Advanced': 4
-            }[skill_level]
-
-            if selected_genre in fast_genres:
-                tempo_rating = min(4, base_tempo + 1)
-            elif selected_genre in slow_genres:
-                tempo_rating = max(1, base_tempo - 1)
-            else:
-                tempo_rating = base_tempo
-
-            # Add skill level context to the response
-            skill_context = {
-                'First-timer': 'Perfect for beginners to practice basic rhythms!',
-                'Beginner': 'Great for developing your fundamental skills.',
-                'Intermediate': 'This song will help you build more advanced techniques.',
-                'Advanced': 'A challenging piece to test your drumming mastery!'
-            }
+            track, enriched = fanout.run(resolve_recommendation(candidates))
+            forget_recent(user_id, selected_genre, available_tracks, [c for c in candidates if c is not track])
+            recommended_track = track_summary(enriched)
 
             response_data = {
                 'recommendation': recommended_track,
                 'selected_genre': selected_genre,
                 'skill_level': skill_level,
-                'skill_context': skill_context.get(skill_level, ''),
-                'rhythm_complexity': rhythm_complexity.get(skill_level, 2),
-                'tempo_rating': tempo_rating,
-                'message': f"Here's a {selected_genre} track matched to your skill level!"
+                'skill_context': SKILL_CONTEXT.get(skill_level, ''),
+                'rhythm_complexity': RHYTHM_COMPLEXITY.get(skill_level, 2),
+                'tempo_rating': tempo_rating(skill_level, selected_genre),
+                'message': f"Here's a {selected_genre} track matched to your skill level!",
+                'degraded': is_degraded()
             }
 
             return jsonify(response_data), 200
             
+        except OutboundSkipped as e:
+            logger.warning("Last.fm unavailable: %s", e)
+            return jsonify({'error': RECOMMENDATIONS_UNAVAILABLE, 'degraded': True}), 503
         except requests.RequestException as e:
-            print(f"Debug - Request error: {str(e)}")
+            logger.error("Request error: %s", e)
             return jsonify({'error': f'Failed to get recommendation: {str(e)}'}), 500
             
     except Exception as e:
-        print(f"Debug - Unexpected error: {str(e)}")
+        logger.exception("Unexpected error")
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
+@app.route('/api/recommend-songs', methods=['POST'])
+@jwt_verified_required
+@latency_budget(RECOMMEND_LATENCY_BUDGET)
+def recommend_songs():
+    """
+    Get `count` recommendations spread across every requested genre, without duplicates.
+    Pools are loaded and tracks enriched concurrently, so a batch costs about one request's latency.
+    """
+    try:
+        data = request.get_json() or {}
+        genres = data.get('genres', [])
+        count = data.get('count', RECOMMEND_BATCH_DEFAULT)
+
+        if not genres:
+            return jsonify({'error': 'Please select at least one genre'}), 400
+        if not isinstance(genres, list) or not all(isinstance(genre, str) and genre for genre in genres):
+            return jsonify({'error': 'Genres must be a list of genre names'}), 400
+        if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= RECOMMEND_BATCH_MAX:
+            return jsonify({'error': f'Count must be a whole number from 1 to {RECOMMEND_BATCH_MAX}'}), 400
+        genres = list(dict.fromkeys(genres))
+
+        user_id = request.user_id
+        customization = request.identity and request.identity.customization
+        skill_level = customization.skill_level if customization else 'First-timer'
+
+        # Load every genre's pool at once (cached ones return immediately)
+        results = fanout.run(fanout.gather_in_threads(_recommend_pool, budgeted_pool, genres, return_exceptions=True))
+        pools, errors = {}, []
+        for genre, result in zip(genres, results):
+            if isinstance(result, requests.RequestException):
+                logger.warning("Request error for genre %s: %s", genre, result)
+                errors.append(result)
+                pools[genre] = []
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                pools[genre] = result or []
+        if len(errors) == len(genres):
+            if all(isinstance(e, OutboundSkipped) for e in errors):
+                return jsonify({'error': RECOMMENDATIONS_UNAVAILABLE, 'degraded': True}), 503
+            return jsonify({'error': f'Failed to get recommendations: {str(errors[0])}'}), 500
+
+        # Each genre's quota first, then any shortfall from genres that still have tracks
+        picks = spread_picks(genres, pools, count, lambda genre, pool, wanted, exclude:
+                             pick_fresh_tracks(user_id, genre, pool, wanted, exclude=exclude))
+        if not picks:
+            return jsonify({'error': f"No tracks found for genres: {', '.join(genres)}"}), 404
+
+        enriched = fanout.run(fanout.gather_in_threads(_recommend_pool, enrich_track, [track for _, track in picks]))
+        recommendations = [{
+            'recommendation': track_summary(track),
+            'genre': genre,
+            'tempo_rating': tempo_rating(skill_level, genre),
+        } for (genre, _), track in zip(picks, enriched)]
+
+        genre_counts = {genre: sum(1 for picked, _ in picks if picked == genre) for genre in genres}
+
+        return jsonify({
+            'recommendations': recommendations,
+            'genre_counts': genre_counts,
+            'skill_level': skill_level,
+            'skill_context': SKILL_CONTEXT.get(skill_level, ''),
+            'rhythm_complexity': RHYTHM_COMPLEXITY.get(skill_level, 2),
+            'message': f"Here are {len(recommendations)} tracks matched to your skill level!",
+            'degraded': is_degraded() or bool(errors)
+        }), 200
+
+    except Exception as e:
+        logger.exception("Unexpected error")
+        return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
+
+@app.cli.command('ingest-tracks')
+@click.option('--genre', 'genres', multiple=True, help='Genre to ingest (repeatable); defaults to every popular genre.')
+@click.option('--max-pages', default=catalog.CATALOG_MAX_PAGES, show_default=True, help='Most chart pages per genre.')
+def ingest_tracks(genres, max_pages):
+    """Pull genre charts and track details from Last.fm into the tracks catalog"""
+    failed = 0
+    for genre in genres or POPULAR_GENRES:
+        try:
+            count = catalog.ingest_genre(db.engine, genre, TRACK_ENRICHMENT, max_pages)
+            click.echo(f"Ingested {count} tracks for {genre}")
+        except requests.RequestException as e:
+            failed += 1
+            click.echo(f"Failed to ingest {genre}: {str(e)}", err=True)
+    if not genres and not failed:
+        # Only prune after a full, successful run, so a Last.fm outage can't empty the catalog
+        click.echo(f"Removed {catalog.purge_untagged(db.engine)} tracks no longer on any chart")
+    if failed:
+        raise click.ClickException(f"{failed} genre(s) failed to ingest")
+
 # --- User Favorites Management ---
 
 @app.route('/api/favorites', methods=['GET'])
@@ -956,7 +1297,7 @@ def get_favorites():
             } for f in favorites]
         }), 200
     except Exception as e:
-        print(f"Error fetching favorites: {str(e)}")
+        logger.error("Error fetching favorites: %s", e)
         return jsonify({"error": "Failed to fetch favorites"}), 500
 
 @app.route('/api/favorites', methods=['POST'])
@@ -1016,7 +1357,7 @@ def add_favorite():
         return jsonify({"message": "Song added to favorites"}), 201
     except Exception as e:
         db.session.rollback()
-        print(f"Error adding favorite: {str(e)}")
+        logger.error("Error adding favorite: %s", e)
         return jsonify({"error": "Failed to add favorite"}), 500
 
 @app.route('/api/favorites/<int:favorite_id>', methods=['DELETE'])
@@ -1043,7 +1384,7 @@ def remove_favorite(favorite_id):
         return jsonify({"message": "Song removed from favorites"}), 200
     except Exception as e:
         db.session.rollback()
-        print(f"Error removing favorite: {str(e)}")
+        logger.error("Error removing favorite: %s", e)
         return jsonify({"error": "Failed to remove favorite"}), 500
 
 @app.route('/api/jam-sessions', methods=['POST'])
@@ -1071,8 +1412,7 @@ def create_jam_session():
         return jsonify({'error': 'Jam session with this title already exists', 'jam_id': existing.id}), 409
 
     try:
-        print(f"DEBUG: pattern_json: {pattern_json}")
-        print(f"DEBUG: instruments_json: {instruments_json}")
+        request_logger.debug("Creating jam session", extra={'pattern_json': pattern_json, 'instruments_json': instruments_json})
         result = db.session.execute(text("""
             INSERT INTO jam_sessions (
                 user_id, title, pattern_json, is_public, parent_jam_id,
@@ -1099,7 +1439,7 @@ def create_jam_session():
         return jsonify({'message': 'Jam session created', 'jam_id': jam_id}), 201
     except Exception as e:
         db.session.rollback()
-        print(f"Error creating jam session: {str(e)}")
+        logger.error("Error creating jam session: %s", e)
         return jsonify({'error': 'Failed to create jam session'}), 500
 
 # Add PUT endpoint for updating jam session by ID
@@ -1161,7 +1501,7 @@ def update_jam_session(jam_id):
         return jsonify({'message': 'Jam session updated', 'jam_id': jam_id}), 200
     except Exception as e:
         db.session.rollback()
-        print(f"Error updating jam session: {str(e)}")
+        logger.error("Error updating jam session: %s", e)
         return jsonify({'error': 'Failed to update jam session'}), 500
 
 def safe_json_load(value):
@@ -1174,7 +1514,15 @@ def safe_json_load(value):
         return value
     return []
 
+def jam_session_version(jam_id):
+    """A jam session's last change, for ETags (None if it doesn't exist)"""
+    row = db.session.execute(text("""
+        SELECT COALESCE(updated_at, created_at) AS changed_at FROM jam_sessions WHERE id = :jam_id
+    """), {'jam_id': jam_id}).first()
+    return row.changed_at.isoformat() if row and row.changed_at else None
+
 @app.route('/api/jam-sessions/<int:jam_id>', methods=['GET'])
+@cache_policy(public=True, version=jam_session_version)
 def get_jam_session(jam_id):
     result = db.session.execute(text("""
         SELECT * FROM jam_sessions WHERE id = :jam_id
@@ -1200,7 +1548,7 @@ def get_user_jam_sessions(user_id):
             jams.append(jam)
         return jsonify(jams), 200
     except Exception as e:
-        print(f"Error fetching jams for user {user_id}: {e}")
+        logger.error("Error fetching jams for user %s: %s", user_id, e)
         return jsonify({'error': 'Failed to fetch jams'}), 500
 
 @app.route('/api/jam-sessions/explore', methods=['GET'])
@@ -1215,7 +1563,7 @@ def explore_jam_sessions():
             jam['pattern_json'] = jam.get('pattern_json') or []
             jam['instruments_json'] = jam.get('instruments_json') or []
         except (json.JSONDecodeError, TypeError) as e:
-            print(f"Error decoding JSON for jam {jam.get('id')}: {e}")
+            logger.error("Error decoding JSON for jam %s: %s", jam.get('id'), e)
             jam['pattern_json'] = []
             jam['instruments_json'] = []
         jams.append(jam)
@@ -1247,14 +1595,13 @@ def delete_jam_session(jam_id):
         return jsonify({'message': 'Jam session deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
-        print(f"Error deleting jam session {jam_id}: {e}")
+        logger.error("Error deleting jam session %s: %s", jam_id, e)
         return jsonify({'error': 'Failed to delete jam session'}), 500
 
 @app.route('/api/chapter-progress', methods=['GET'])
 @jwt_verified_required
 def get_chapter_progress():
-    user_id = request.user_id
-    customization = UserCustomization.query.filter_by(user_id=user_id).first()
+    customization = request.identity and request.identity.customization
     progress = customization.chapter_progress if customization and customization.chapter_progress else 1
     chapter0_page = customization.chapter0_page_progress if customization and customization.chapter0_page_progress else 1
     chapter1_page = customization.chapter1_page_progress if customization and customization.chapter1_page_progress else 1
@@ -1263,12 +1610,14 @@ def get_chapter_progress():
 @app.route('/api/chapter-progress', methods=['POST'])
 @jwt_verified_required
 def update_chapter_progress():
-    user_id = request.user_id
+    identity = request.identity
+    if identity is None:
+        return jsonify({"error": "User not found"}), 404
     data = request.get_json()
     new_progress = int(data.get('chapter_progress', 1))
     new_ch0_page = int(data.get('chapter0_page_progress', 1))
     new_ch1_page = int(data.get('chapter1_page_progress', 1))
-    customization = UserCustomization.query.filter_by(user_id=user_id).first()
+    customization = identity.customization
     if customization:
         if not customization.chapter_progress or new_progress > customization.chapter_progress:
             customization.chapter_progress = new_progress
@@ -1299,11 +1648,9 @@ def create_shared_loops():
             return jsonify({'error': 'No loops selected to share'}), 400
 
         # Verify all jam sessions belong to the user
+        owned = owned_jam_ids(db.session, user_id, jam_session_ids)
         for jam_id in jam_session_ids:
-            jam = db.session.execute(text("""
-                SELECT id FROM jam_sessions WHERE id = :jam_id AND user_id = :user_id
-            """), {'jam_id': jam_id, 'user_id': user_id}).first()
-            if not jam:
+            if jam_id not in owned:
                 return jsonify({'error': f'Jam session {jam_id} not found or does not belong to you'}), 404
 
         # Generate a unique share ID
@@ -1325,10 +1672,26 @@ def create_shared_loops():
 
     except Exception as e:
         db.session.rollback()
-        print(f"Error creating shared loops: {str(e)}")
+        logger.error("Error creating shared loops: %s", e)
         return jsonify({'error': 'Failed to create shared loops'}), 500
 
+def shared_loops_version(share_id):
+    """Sender name plus the shared jams' count and last change, for ETags (None if the share doesn't exist)"""
+    row = db.session.execute(text("""
+        SELECT u.username, COUNT(j.id) AS loops, MAX(COALESCE(j.updated_at, j.created_at)) AS changed_at
+        FROM shared_loops sl
+        JOIN users u ON sl.sender_id = u.id
+        LEFT JOIN jam_sessions j ON j.id = ANY(sl.jam_session_ids)
+        WHERE sl.share_id = :share_id
+        GROUP BY u.username
+    """), {'share_id': share_id}).first()
+    if not row:
+        return None
+    changed_at = row.changed_at.isoformat() if row.changed_at else ''
+    return f"{row.username}:{row.loops}:{changed_at}"
+
 @app.route('/api/shared-loops/<share_id>', methods=['GET'])
+@cache_policy(public=True, version=shared_loops_version)
 def get_shared_loops(share_id):
     """Get shared loops by share ID"""
     try:
@@ -1361,7 +1724,7 @@ def get_shared_loops(share_id):
         }), 200
 
     except Exception as e:
-        print(f"Error fetching shared loops: {str(e)}")
+        logger.error("Error fetching shared loops: %s", e)
         return jsonify({'error': 'Failed to fetch shared loops'}), 500
 
 @app.route('/api/shared-loops/<share_id>/check-accepted', methods=['GET'])
@@ -1385,7 +1748,7 @@ def check_shared_loops_accepted(share_id):
         return jsonify({'has_accepted': has_accepted}), 200
 
     except Exception as e:
-        print(f"Error checking shared loops acceptance: {str(e)}")
+        logger.error("Error checking shared loops acceptance: %s", e)
         return jsonify({'error': 'Failed to check acceptance status'}), 500
 
 @app.route('/api/shared-loops/<share_id>/accept', methods=['POST'])
@@ -1420,31 +1783,12 @@ def accept_shared_loops(share_id):
             SELECT * FROM jam_sessions WHERE id = ANY(:jam_ids)
         """), {'jam_ids': shared.jam_session_ids}).fetchall()
 
-        # Create copies of the jam sessions for the recipient
-        for jam in jams:
-            # Check for title conflicts
-            base_title = jam.title
-            counter = 1
-            while True:
-                title = f"{base_title}{' ' + str(counter) if counter > 1 else ''}"
-                existing = db.session.execute(text("""
-                    SELECT id FROM jam_sessions WHERE user_id = :user_id AND title = :title
-                """), {'user_id': user_id, 'title': title}).first()
-                if not existing:
-                    break
-                counter += 1
-
-            # Create new jam session
-            db.session.execute(text("""
-                INSERT INTO jam_sessions (
-                    user_id, title, pattern_json, is_public, parent_jam_id,
-                    instruments_json, time_signature, note_resolution, bpm
-                )
-                VALUES (
-                    :user_id, :title, :pattern_json, :is_public, :parent_jam_id,
-                    :instruments_json, :time_signature, :note_resolution, :bpm
-                )
-            """), {
+        # Create copies of the jam sessions for the recipient, renaming ones whose title is taken
+        titles = [jam.title for jam in jams]
+        copy_names = copy_titles(titles, taken_titles(db.session, user_id, titles))
+        copies = []
+        for jam, title in zip(jams, copy_names):
+            copies.append({
                 'user_id': user_id,
                 'title': title,
                 'pattern_json': jam.pattern_json,
@@ -1456,6 +1800,19 @@ def accept_shared_loops(share_id):
                 'bpm': jam.bpm
             })
 
+        # Create the new jam sessions in one batch
+        if copies:
+            db.session.execute(text("""
+                INSERT INTO jam_sessions (
+                    user_id, title, pattern_json, is_public, parent_jam_id,
+                    instruments_json, time_signature, note_resolution, bpm
+                )
+                VALUES (
+                    :user_id, :title, :pattern_json, :is_public, :parent_jam_id,
+                    :instruments_json, :time_signature, :note_resolution, :bpm
+                )
+            """), copies)
+
         # Create notification record
         db.session.execute(text("""
             INSERT INTO shared_loop_notifications (recipient_id, share_id, status)
@@ -1470,7 +1827,7 @@ def accept_shared_loops(share_id):
 
     except Exception as e:
         db.session.rollback()
-        print(f"Error accepting shared loops: {str(e)}")
+        logger.error("Error accepting shared loops: %s", e)
         return jsonify({'error': 'Failed to accept shared loops'}), 500
 
 @app.route('/api/shared-loops/<share_id>/reject', methods=['POST'])
@@ -1494,11 +1851,14 @@ def reject_shared_loops(share_id):
 
     except Exception as e:
         db.session.rollback()
-        print(f"Error rejecting shared loops: {str(e)}")
+        logger.error("Error rejecting shared loops: %s", e)
         return jsonify({'error': 'Failed to reject shared loops'}), 500
 
-# In-memory store for OTPs (for demo; use persistent store in production)
-user_otps = {}
+# Password-reset OTPs: 'sql' shares them across workers/instances, 'memory' is per process
+OTP_STORE = os.environ.get('OTP_STORE', 'sql')
+with app.app_context():
+    user_otps = create_otp_store(OTP_STORE, engine=db.engine)
+user_otps.start_sweeper()
 
 @app.route('/api/forgot-password', methods=['POST'])
 def forgot_password():
@@ -1511,11 +1871,13 @@ def forgot_password():
         return jsonify({'error': 'This email address does not exist. Try signing up instead.'}), 404
     # Generate OTP
     otp = str(random.randint(100000, 999999))
-    user_otps[email] = otp
+    user_otps.put(email, otp)
     # Send OTP email
     msg = Message('Your BeatBridge Password Reset OTP', sender=app.config['MAIL_USERNAME'], recipients=[email])
     msg.body = f'Your OTP for password reset is: {otp}\nIf you did not request this, please ignore this email.'
-    mail.send(msg)
+    deliver_email(msg)
+    db.session.commit()
+    flush_outbox()
     return jsonify({'message': 'OTP sent to your email.'}), 200
 
 @app.route('/api/verify-otp', methods=['POST'])
@@ -1525,9 +1887,10 @@ def verify_otp():
     otp = data.get('otp')
     if not email or not otp:
         return jsonify({'error': 'Email and OTP are required'}), 400
-    if user_otps.get(email) == otp:
-        # Mark OTP as verified (could set a flag or just allow password reset)
-        user_otps[email] = 'VERIFIED'
+    # Codes are stored as strings; clients may send them as JSON numbers
+    otp = str(otp).strip()
+    if user_otps.verify(email, otp):
+        # The entry stays verified (with a fresh expiry) until the password is reset
         return jsonify({'message': 'OTP verified. You may now reset your password.'}), 200
     else:
         return jsonify({'error': 'Invalid OTP'}), 400
@@ -1539,15 +1902,16 @@ def reset_password():
     new_password = data.get('password')
     if not email or not new_password:
         return jsonify({'error': 'Email and new password are required'}), 400
-    if user_otps.get(email) != 'VERIFIED':
+    if not user_otps.is_verified(email):
         return jsonify({'error': 'OTP not verified for this email.'}), 403
     user = User.query.filter_by(email=email).first()
     if not user:
         return jsonify({'error': 'User not found'}), 404
     user.set_password(new_password)
     db.session.commit()
+    invalidate_token_version(user.id)
     # Clear OTP after successful reset
-    user_otps.pop(email, None)
+    user_otps.discard(email)
     return jsonify({'message': 'Password reset successful.'}), 200
 
 @app.route('/api/set-password', methods=['POST'])
@@ -1557,12 +1921,14 @@ def set_password():
     new_password = data.get('password')
     if not new_password:
         return jsonify({'error': 'Password is required.'}), 400
-    user = User.query.get(request.user_id)
+    user = request.identity
     if not user:
         return jsonify({'error': 'User not found.'}), 404
-    user.hash = generate_password_hash(new_password)
+    user.set_password(new_password)
     db.session.commit()
-    return jsonify({'message': 'Password set successfully.'}), 200
+    invalidate_token_version(user.id)
+    # Existing tokens were revoked, so hand the caller a fresh one
+    return jsonify({'message': 'Password set successfully.', 'token': user.generate_jwt_token()}), 200
 
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5000))
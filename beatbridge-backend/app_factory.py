@@ -3,12 +3,22 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_mail import Mail, Message
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hash_password, verify_password, needs_rehash, HashingPoolSaturated
+from otp_store import MemoryOTPStore
+from usernames import next_free_username, USERNAME_ALLOCATION_ATTEMPTS
+from db_errors import unique_violation_field
+from lastfm import fetch_genre_pool
+from recommendations import spread_picks
+from http_cache import cache_policy, apply_policy
+import metrics
+import query_monitor
+from concurrent.futures import ThreadPoolExecutor
 import jwt
 from datetime import datetime, timedelta, UTC
 import os
 from dotenv import load_dotenv
 import requests
+from sqlalchemy.exc import IntegrityError
 import json as _json
 
 # Load environment variables
@@ -31,7 +41,7 @@ FRONTEND_BASE_URL = os.getenv('FRONTEND_BASE_URL', 'http://localhost:3000')
 GOOGLE_PLACEHOLDER_PASSWORD = 'google-oauth-user'
 
 # In-memory OTP storage for password reset
-user_otps = {}
+user_otps = MemoryOTPStore()
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -41,12 +51,32 @@ class User(UserMixin, db.Model):
     is_verified = db.Column(db.Boolean, default=False)
     verification_token = db.Column(db.String(100), unique=True)
     google_id = db.Column(db.String(255), unique=True)  # For Google OAuth users
+    token_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped to revoke issued JWTs
+    __table_args__ = (
+        # Usernames and emails are unique regardless of case
+        db.Index('ux_user_username_lower', db.func.lower(username), unique=True),
+        db.Index('ux_user_email_lower', db.func.lower(email), unique=True),
+    )
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
+        # Changing the password revokes every token issued so far
+        self.token_version = (self.token_version or 0) + 1
+
+    def generate_jwt_token(self):
+        return jwt.encode(
+            {
+                'user_id': self.id,
+                'verified': bool(self.is_verified),
+                'tv': self.token_version or 0,
+                'exp': datetime.now(UTC) + JWT_EXPIRATION_DELTA
+            },
+            JWT_SECRET_KEY,
+            algorithm='HS256'
+        )
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
     def generate_verification_token(self):
         token = jwt.encode(
@@ -117,11 +147,20 @@ def create_app():
     login_manager.init_app(app)
     mail.init_app(app)
     cors.init_app(app)
+    app.after_request(apply_policy)
+    metrics.init_app(app)
+    query_monitor.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
         return User.query.get(int(user_id))
 
+    @app.errorhandler(HashingPoolSaturated)
+    def hashing_pool_saturated(e):
+        response = jsonify({'error': 'Server is busy, please try again shortly'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
     def get_current_user():
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
@@ -132,6 +171,8 @@ def create_app():
             user = User.query.get(data['user_id'])
             if not user:
                 return None, jsonify({'error': 'User not found'}), 404
+            if 'tv' in data and data['tv'] != user.token_version:
+                return None, jsonify({'error': 'Token has been revoked'}), 401
             return user, None, None
         except jwt.ExpiredSignatureError:
             return None, jsonify({'error': 'Token has expired'}), 401
@@ -170,17 +211,19 @@ def create_app():
         if data['password'] != data['confirmation']:
             return jsonify({'error': 'Passwords do not match'}), 400
             
-        if User.query.filter_by(username=data['username']).first():
-            return jsonify({'error': 'Username already exists'}), 400
-            
-        if User.query.filter_by(email=data['email']).first():
-            return jsonify({'error': 'Email already exists'}), 400
-            
         user = User(username=data['username'], email=data['email'])
         user.set_password(data['password'])
         
+        # Let the unique indexes catch a taken username or email instead of querying first
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.flush()
+        except IntegrityError as e:
+            db.session.rollback()
+            field = unique_violation_field(e, ('username', 'email'))
+            if not field:
+                raise
+            return jsonify({'error': 'Username already exists' if field == 'username' else 'Email already exists'}), 400
         
         # Generate verification token
         token = user.generate_verification_token()
@@ -209,15 +252,16 @@ def create_app():
             # Check if this is a Google user with placeholder password
             if user.google_id and user.check_password(GOOGLE_PLACEHOLDER_PASSWORD):
                 return jsonify({'error': 'This account was created with Google. Please "Sign in with Google" to log in.'}), 401
+
+            # Upgrade hashes made under an older cost policy while we have the plaintext
+            if needs_rehash(user.password_hash):
+                user.password_hash = hash_password(password)
+                db.session.commit()
             
             login_user(user)
             
             # Generate JWT token
-            token = jwt.encode(
-                {'user_id': user.id, 'exp': datetime.now(UTC) + JWT_EXPIRATION_DELTA},
-                JWT_SECRET_KEY,
-                algorithm='HS256'
-            )
+            token = user.generate_jwt_token()
             
             return jsonify({'access_token': token, 'user_id': user.id}), 200
             
@@ -387,6 +431,7 @@ def create_app():
         }), 200
 
     @app.route('/api/genres')
+    @cache_policy(public=True, max_age=86400)
     def get_genres():
         genres = [
             {'id': 'rock', 'name': 'Rock'},
@@ -454,6 +499,52 @@ def create_app():
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/recommend-songs', methods=['POST'])
+    def recommend_songs():
+        user, err_resp, err_code = get_current_user()
+        if not user:
+            return err_resp, err_code
+
+        data = request.get_json() or {}
+        genres = data.get('genres')
+        count = data.get('count', 5)
+
+        if not isinstance(genres, list) or not all(isinstance(genre, str) and genre for genre in genres):
+            return jsonify({'error': 'Genres must be a list of genre names'}), 400
+        if not genres:
+            return jsonify({'error': 'Please select at least one genre'}), 400
+        if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= 20:
+            return jsonify({'error': 'Count must be a whole number from 1 to 20'}), 400
+        genres = list(dict.fromkeys(genres))
+
+        # Fetch every genre's pool at once
+        with ThreadPoolExecutor(max_workers=len(genres)) as executor:
+            futures = {genre: executor.submit(fetch_genre_pool, genre) for genre in genres}
+        pools = {}
+        for genre, future in futures.items():
+            try:
+                pools[genre] = future.result()
+            except requests.RequestException:
+                pools[genre] = []
+
+        import random
+
+        def pick(genre, pool, wanted, exclude):
+            candidates = [t for t in pool if t['url'] not in exclude]
+            return random.sample(candidates, min(wanted, len(candidates)))
+
+        picks = spread_picks(genres, pools, count, pick)
+        if not picks:
+            return jsonify({'error': f"No tracks found for genres: {', '.join(genres)}"}), 404
+
+        return jsonify({
+            'recommendations': [{
+                'recommendation': {'name': track['name'], 'artist': track['artist']['name'], 'url': track['url']},
+                'genre': genre,
+            } for genre, track in picks],
+            'genre_counts': {genre: sum(1 for picked, _ in picks if picked == genre) for genre in genres},
+        })
+
     @app.route('/api/jam-sessions', methods=['POST'])
     def create_jam_session():
         user, err_resp, err_code = get_current_user()
@@ -501,7 +592,12 @@ def create_app():
         db.session.commit()
         return jsonify({'message': 'Jam session updated'}), 200
 
+    def jam_session_version(jam_id):
+        jam = db.session.query(JamSession.updated_at, JamSession.created_at).filter_by(id=jam_id).first()
+        return (jam.updated_at or jam.created_at).isoformat() if jam else None
+
     @app.route('/api/jam-sessions/<int:jam_id>', methods=['GET'])
+    @cache_policy(public=True, version=jam_session_version)
     def get_jam_session(jam_id):
         jam = JamSession.query.get(jam_id)
         if not jam:
@@ -572,13 +668,8 @@ def create_app():
 
     # Helper function to make unique usernames for Google users
     def make_unique_username(base_name):
-        """Generate a unique username by appending numbers if needed"""
-        username = base_name
-        counter = 1
-        while User.query.filter_by(username=username).first():
-            username = f"{base_name}{counter}"
-            counter += 1
-        return username
+        """Generate a unique username by appending the smallest free number if needed"""
+        return next_free_username(db.session, User.username, base_name)
 
     @app.route('/api/forgot-password', methods=['POST'])
     def forgot_password():
@@ -596,7 +687,7 @@ def create_app():
         # Generate OTP
         import random
         otp = str(random.randint(100000, 999999))
-        user_otps[email] = otp
+        user_otps.put(email, otp)
         
         # Send email with OTP (mock for testing)
         try:
@@ -618,13 +709,14 @@ def create_app():
         
         if not email or not otp:
             return jsonify({'error': 'Email and OTP are required'}), 400
+        # Codes are stored as strings; clients may send them as JSON numbers
+        otp = str(otp).strip()
             
-        stored_otp = user_otps.get(email)
-        if not stored_otp or stored_otp != otp:
+        if not user_otps.verify(email, otp):
             return jsonify({'error': 'Invalid OTP'}), 400
             
         # Remove OTP after successful verification
-        del user_otps[email]
+        user_otps.discard(email)
         return jsonify({'message': 'OTP verified successfully'}), 200
 
     @app.route('/api/reset-password', methods=['POST'])
@@ -695,24 +787,30 @@ def create_app():
                     user.google_id = google_id
                     db.session.commit()
                 else:
-                    # Create new user
-                    username = make_unique_username(name.replace(' ', '').lower())
-                    user = User(
-                        username=username,
-                        email=email,
-                        google_id=google_id,
-                        is_verified=True
-                    )
-                    user.set_password(GOOGLE_PLACEHOLDER_PASSWORD)
-                    db.session.add(user)
-                    db.session.commit()
+                    # Create new user, retrying if a concurrent sign-up takes the username first
+                    for attempt in range(USERNAME_ALLOCATION_ATTEMPTS):
+                        username = make_unique_username(name.replace(' ', '').lower())
+                        user = User(
+                            username=username,
+                            email=email,
+                            google_id=google_id,
+                            is_verified=True
+                        )
+                        user.set_password(GOOGLE_PLACEHOLDER_PASSWORD)
+                        db.session.add(user)
+                        try:
+                            db.session.commit()
+                            break
+                        except IntegrityError:
+                            db.session.rollback()
+                            user = User.query.filter((User.google_id == google_id) | (User.email == email)).first()
+                            if user:
+                                break
+                    else:
+                        return redirect(f'{FRONTEND_BASE_URL}/login?error=google_auth_failed')
             
             # Generate JWT token
-            token = jwt.encode(
-                {'user_id': user.id, 'exp': datetime.now(UTC) + JWT_EXPIRATION_DELTA},
-                JWT_SECRET_KEY,
-                algorithm='HS256'
-            )
+            token = user.generate_jwt_token()
             
             return redirect(f'{FRONTEND_BASE_URL}/google-auth-success?token={token}')
             
@@ -734,7 +832,8 @@ def create_app():
             
         user.set_password(new_password)
         db.session.commit()
-        return jsonify({'message': 'Password set successfully'}), 200
+        # Existing tokens were revoked, so hand the caller a fresh one
+        return jsonify({'message': 'Password set successfully', 'token': user.generate_jwt_token()}), 200
 
     # Chapter Progress Endpoints
     @app.route('/api/chapter-progress', methods=['GET'])
@@ -0,0 +1,213 @@
+"""
+Small in-process caches shared by the Flask app.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Thread-safe key/value cache whose entries expire after `ttl` seconds.
+    With `max_size`, the least recently used entries are evicted beyond that many.
+    """
+
+    def __init__(self, ttl, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (value, expires_at), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _live(self, key):
+        """Entry for key if present and unexpired (caller holds the lock)"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, ttl):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        if self.max_size is not None:
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def update(self, key, fn, ttl=None):
+        """
+        Atomically replace the value for key with fn(current value or None) and
+        return the new value. fn runs under the cache lock, so keep it short.
+        """
+        with self._lock:
+            entry = self._live(key)
+            value = fn(None if entry is None else entry[0])
+            self._store(key, value, ttl)
+            return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class CacheRegistry:
+    """Named cache namespaces, each with its own TTL and size limit"""
+
+    def __init__(self):
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def namespace(self, name, ttl, max_size=None):
+        """Return the cache for `name`, creating it with the given limits on first use"""
+        with self._lock:
+            if name not in self._namespaces:
+                self._namespaces[name] = TTLCache(ttl, max_size=max_size)
+            return self._namespaces[name]
+
+    def add(self, name, cache):
+        """Register another cache object (anything with stats()) under `name`"""
+        with self._lock:
+            self._namespaces[name] = cache
+        return cache
+
+    def stats(self):
+        """Per-namespace counters, e.g. for a metrics endpoint"""
+        with self._lock:
+            namespaces = dict(self._namespaces)
+        return {name: cache.stats() for name, cache in namespaces.items()}
+
+
+# Process-wide registry the app's caches are created in
+caches = CacheRegistry()
+
+
+class RefreshingCache:
+    """
+    Stale-while-revalidate cache around a loader function.
+
+    Values are fresh for `ttl` seconds; after that they keep being served while
+    one background load per key replaces them (entries are dropped entirely
+    once they're older than ttl + stale_ttl, or by the size limit). Only a key
+    with no value at all makes callers wait, and concurrent callers share a
+    single load. Falsy results (e.g. an empty track list) aren't cached.
+    """
+
+    def __init__(self, loader, ttl, stale_ttl, cache, executor, retry_after=60):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.retry_after = retry_after
+        self._entries = cache  # TTLCache of key -> (value, fresh_until); its TTL should cover ttl + stale_ttl
+        self._executor = executor
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def get(self, key, timeout=None):
+        """
+        The cached value (stale or not) for key; a key with no value waits for its
+        load, raising TimeoutError after `timeout` seconds (the load carries on)
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._load_async(key).result(timeout=timeout)
+        value, fresh_until = entry
+        if fresh_until <= time.monotonic():
+            with self._lock:
+                self.stale_hits += 1
+            self._load_async(key)
+        return value
+
+    def warm(self, keys):
+        """Start loading every key in the background"""
+        for key in keys:
+            self._load_async(key)
+
+    def _load_async(self, key):
+        """The in-flight load for key, starting one if there is none"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._executor.submit(self._load, key)
+                self._inflight[key] = future
+            return future
+
+    def _load(self, key):
+        try:
+            value = self.loader(key)
+            if value:
+                self._entries.set(key, (value, time.monotonic() + self.ttl), ttl=self.ttl + self.stale_ttl)
+            with self._lock:
+                self.refreshes += 1
+            return value
+        except Exception as e:
+            with self._lock:
+                self.refresh_failures += 1
+            logger.warning("Cache refresh failed for %s: %s", key, e)
+            # Keep serving the stale value, but don't retry on every request while the source is down
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.set(key, (entry[0], time.monotonic() + self.retry_after),
+                                  ttl=self.retry_after + self.stale_ttl)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'stale_hits': self.stale_hits,
+                'refreshes': self.refreshes,
+                'refresh_failures': self.refresh_failures,
+                'inflight': len(self._inflight),
+            }
+        stats.update(self._entries.stats())
+        return stats
@@ -0,0 +1,132 @@
+"""
+Offline track catalog: each genre's whole Last.fm chart plus track details,
+stored in the tracks / track_tags tables.
+
+The ingest-tracks CLI command refreshes it (run it periodically, e.g. from
+cron). With RECOMMENDATION_SOURCE=catalog, genre pools are read from here, so
+recommendations never wait on Last.fm or spend its rate limit.
+"""
+import json
+import os
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, DateTime, ForeignKey, Index, text, select
+from enrichment import track_key
+from lastfm import fetch_full_genre_chart
+
+# Most chart pages (of 50 tracks) ingested per genre
+CATALOG_MAX_PAGES = int(os.environ.get('CATALOG_MAX_PAGES', 20))
+CATALOG_ID_CHUNK = 500
+
+metadata = MetaData()
+tracks = Table(
+    'tracks', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('url', String(512), nullable=False, unique=True),  # Last.fm track URL
+    Column('name', String(255), nullable=False),
+    Column('artist', String(255), nullable=False),
+    Column('album', String(255)),
+    Column('listeners', Integer, nullable=False, default=0),
+    Column('duration', Integer),  # Milliseconds
+    Column('info', Text, nullable=False),  # JSON chart entry merged with its track.getInfo details
+    Column('updated_at', DateTime, nullable=False),
+    Index('ix_tracks_listeners', 'listeners'),
+)
+track_tags = Table(
+    'track_tags', metadata,
+    Column('track_id', Integer, ForeignKey('tracks.id', ondelete='CASCADE'), primary_key=True),
+    Column('tag', String(100), primary_key=True),  # Lowercase genre
+    Column('rank', Integer, nullable=False),  # Position on the genre's chart
+    Index('ix_track_tags_tag_rank', 'tag', 'rank'),
+)
+
+
+def ensure_schema(engine):
+    metadata.create_all(engine, checkfirst=True)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def catalog_row(track, details, now):
+    """A tracks row for a chart entry and its (possibly missing) track.getInfo details"""
+    info = dict(track)
+    if details:
+        info.update(details)
+        info['url'] = track['url']  # Keep the chart URL as the track's identity
+    album = info.get('album')
+    album_title = album.get('title') if isinstance(album, dict) else None
+    return {
+        'url': track['url'][:512],
+        'name': track['name'][:255],
+        'artist': track['artist']['name'][:255],
+        'album': album_title[:255] if album_title else None,
+        'listeners': _int(info.get('listeners')) or 0,
+        'duration': _int(info.get('duration')),
+        'info': json.dumps(info),
+        'updated_at': now,
+    }
+
+
+def ingest_genre(engine, genre, enrichment, max_pages=CATALOG_MAX_PAGES):
+    """
+    Replace a genre's catalog entries with its current Last.fm chart, fetching
+    details for tracks the enrichment cache doesn't have yet. Returns the number
+    of tracks stored.
+    """
+    chart = [t for t in fetch_full_genre_chart(genre, max_pages)
+             if t.get('url') and t.get('name') and t.get('artist', {}).get('name')]
+    enrichment.prefill(chart)
+    details = enrichment.cached_info(chart)
+    now = datetime.utcnow()
+    rows = [catalog_row(t, details.get(track_key(t['artist']['name'], t['name'])), now) for t in chart]
+
+    tag = genre.lower()
+    with engine.begin() as conn:
+        if rows:
+            conn.execute(text("""
+                INSERT INTO tracks (url, name, artist, album, listeners, duration, info, updated_at)
+                VALUES (:url, :name, :artist, :album, :listeners, :duration, :info, :updated_at)
+                ON CONFLICT (url) DO UPDATE SET
+                    name = excluded.name,
+                    artist = excluded.artist,
+                    album = excluded.album,
+                    listeners = excluded.listeners,
+                    duration = excluded.duration,
+                    info = excluded.info,
+                    updated_at = excluded.updated_at
+            """), rows)
+        ids = {}
+        for start in range(0, len(rows), CATALOG_ID_CHUNK):
+            urls = [row['url'] for row in rows[start:start + CATALOG_ID_CHUNK]]
+            ids.update(conn.execute(select(tracks.c.url, tracks.c.id).where(tracks.c.url.in_(urls))).all())
+        conn.execute(track_tags.delete().where(track_tags.c.tag == tag))
+        if rows:
+            conn.execute(track_tags.insert(), [
+                {'track_id': ids[row['url']], 'tag': tag, 'rank': rank} for rank, row in enumerate(rows, 1)
+            ])
+    return len(rows)
+
+
+def purge_untagged(engine):
+    """Delete tracks that have dropped off every genre chart; returns how many"""
+    with engine.begin() as conn:
+        return conn.execute(text(
+            "DELETE FROM tracks WHERE NOT EXISTS (SELECT 1 FROM track_tags WHERE track_tags.track_id = tracks.id)"
+        )).rowcount
+
+
+def catalog_pool(engine, genre, limit):
+    """A genre's top `limit` catalog tracks in chart order, shaped like enriched Last.fm tracks"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(tracks.c.info)
+            .select_from(tracks.join(track_tags, track_tags.c.track_id == tracks.c.id))
+            .where(track_tags.c.tag == genre.lower())
+            .order_by(track_tags.c.rank)
+            .limit(limit)
+        )
+        return [json.loads(row.info) for row in rows]
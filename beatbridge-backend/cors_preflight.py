@@ -0,0 +1,89 @@
+"""
+CORS as WSGI middleware, with a fast path for preflight requests.
+
+OPTIONS requests are answered here, before Flask builds a request context,
+so a preflight never touches sessions, Flask-Login or the database. Allowed
+origins are an exact-match frozenset plus compiled patterns (for Vercel and
+Netlify preview deploys); the header list for each origin is built once and
+reused. Preflights carry Access-Control-Max-Age, so browsers cache them
+instead of preflighting every authenticated call. Other responses get
+Access-Control-Allow-Origin for allowed origins and Vary: Origin.
+"""
+import os
+import re
+import threading
+
+CORS_MAX_AGE = int(os.environ.get('CORS_MAX_AGE', 7200))  # Chromium caps preflight caching at 2 hours
+CORS_ALLOW_HEADERS = os.environ.get('CORS_ALLOW_HEADERS', 'Content-Type,Authorization,Accept')
+CORS_ALLOW_METHODS = 'GET,PUT,POST,DELETE,OPTIONS'
+# Most distinct origins whose decision is remembered (bounds memory if clients send arbitrary origins)
+ORIGIN_CACHE_SIZE = 1024
+
+
+class CORSPolicy:
+    """Which origins may call us, and the prebuilt CORS headers for each"""
+
+    def __init__(self, origins, patterns=(), max_age=CORS_MAX_AGE, allow_headers=CORS_ALLOW_HEADERS,
+                 allow_methods=CORS_ALLOW_METHODS):
+        self.origins = frozenset(origins)
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.max_age = max_age
+        self.allow_headers = allow_headers
+        self.allow_methods = allow_methods
+        self._headers = {}  # origin -> (response headers, preflight headers), or None if not allowed
+        self._lock = threading.Lock()
+
+    def allowed(self, origin):
+        return origin in self.origins or any(pattern.fullmatch(origin) for pattern in self.patterns)
+
+    def headers(self, origin):
+        """(response headers, preflight headers) for `origin`, or None if it isn't allowed"""
+        try:
+            return self._headers[origin]
+        except KeyError:
+            pass
+        entry = None
+        if self.allowed(origin):
+            response = [('Access-Control-Allow-Origin', origin), ('Access-Control-Allow-Credentials', 'true')]
+            entry = (response, response + [
+                ('Access-Control-Allow-Headers', self.allow_headers),
+                ('Access-Control-Allow-Methods', self.allow_methods),
+                ('Access-Control-Max-Age', str(self.max_age)),
+            ])
+        with self._lock:
+            if len(self._headers) < ORIGIN_CACHE_SIZE or origin in self.origins:
+                self._headers[origin] = entry
+        return entry
+
+
+class CORSMiddleware:
+    """Answers OPTIONS itself and adds CORS headers to the wrapped app's responses"""
+
+    def __init__(self, app, policy):
+        self.app = app
+        self.policy = policy
+
+    def __call__(self, environ, start_response):
+        origin = environ.get('HTTP_ORIGIN')
+        entry = self.policy.headers(origin) if origin else None
+
+        if environ['REQUEST_METHOD'] == 'OPTIONS':
+            headers = [('Vary', 'Origin'), ('Content-Length', '0')]
+            if entry:
+                headers.extend(entry[1])
+            start_response('204 No Content', headers)
+            return [b'']
+
+        def cors_start_response(status, headers, exc_info=None):
+            vary = [i for i, (name, _) in enumerate(headers) if name.lower() == 'vary']
+            if vary:
+                name, value = headers[vary[0]]
+                if 'origin' not in value.lower():
+                    headers[vary[0]] = (name, f"{value}, Origin")
+            else:
+                headers.append(('Vary', 'Origin'))
+            if entry:
+                headers.extend(entry[0])
+            return start_response(status, headers, exc_info)
+
+        return self.app(environ, cors_start_response)
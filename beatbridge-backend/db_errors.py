@@ -0,0 +1,27 @@
+"""
+Helpers for turning database constraint errors into API validation errors.
+"""
+
+
+def unique_violation_field(error, fields):
+    """
+    Return which of `fields` a unique-constraint IntegrityError was raised for
+    (matched against the violated constraint/index name), or None.
+    """
+    orig = getattr(error, 'orig', error)
+    message = str(orig).lower()
+    pgcode = getattr(orig, 'pgcode', None)
+    if pgcode is not None:
+        if pgcode != '23505':  # unique_violation
+            return None
+        # psycopg2 reports the constraint or index name, e.g. users_email_key / ux_users_email_lower
+        source = (orig.diag.constraint_name or message).lower()
+    else:
+        # SQLite: "UNIQUE constraint failed: users.email" or "... index 'ux_users_email_lower'"
+        if 'unique' not in message:
+            return None
+        source = message
+    for field in fields:
+        if field in source:
+            return field
+    return None
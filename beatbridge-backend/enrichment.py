@@ -0,0 +1,210 @@
+"""
+Persistent cache of Last.fm track.getInfo results.
+
+Details are stored in the track_enrichment table keyed by normalized
+(artist, track), so every worker and instance shares them and they survive
+restarts. "Track not found" answers and failed lookups are cached too, for
+much shorter, so a bad track doesn't cost an outbound call on every pick.
+Prefill looks up a whole pool's tracks ahead of time, so most recommendations
+need no Last.fm call at all. It is paced by a token bucket (per process), uses
+its own fetcher so it can bypass the user-facing circuit breaker, caches
+nothing for a failed lookup and stops at the first one, leaving the rest for
+the next run. `flask ingest-tracks` prefills every genre it ingests once;
+prefilling each freshly fetched pool (ENRICHMENT_PREFILL) happens in every
+worker, so it is off by default.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import (MetaData, Table, Column, String, Text, DateTime, Index, text, select, tuple_)
+from resilience import OutboundSkipped, TokenBucket, mark_degraded
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_TTL = timedelta(days=int(os.environ.get('ENRICHMENT_TTL_DAYS', 7)))
+ENRICHMENT_NOT_FOUND_TTL = timedelta(hours=6)
+ENRICHMENT_ERROR_TTL = timedelta(minutes=5)
+# Threads running queued background prefills; ENRICHMENT_PREFILL_RATE is what bounds their calls
+ENRICHMENT_PREFILL_WORKERS = int(os.environ.get('ENRICHMENT_PREFILL_WORKERS', 1))
+# track.getInfo calls per second that prefill may make from one process
+ENRICHMENT_PREFILL_RATE = float(os.environ.get('ENRICHMENT_PREFILL_RATE', 2))
+ENRICHMENT_PREFILL_CHUNK = 25
+
+metadata = MetaData()
+track_enrichment = Table(
+    'track_enrichment', metadata,
+    Column('artist_key', String(255), primary_key=True),
+    Column('track_key', String(255), primary_key=True),
+    Column('status', String(16), nullable=False),  # found, not_found or error
+    Column('info', Text),  # JSON track.getInfo payload when found
+    Column('fetched_at', DateTime, nullable=False),
+    Column('expires_at', DateTime, nullable=False),
+    Index('ix_track_enrichment_expires_at', 'expires_at'),
+)
+
+
+def normalize(value):
+    """Case- and whitespace-insensitive form of an artist or track name"""
+    return re.sub(r'\s+', ' ', (value or '').strip().lower())[:255]
+
+
+def track_key(artist, name):
+    return normalize(artist), normalize(name)
+
+
+class EnrichmentCache:
+    """track.getInfo lookups through the track_enrichment table"""
+
+    def __init__(self, engine, fetch_info, prefill_fetch_info=None, prefill_workers=ENRICHMENT_PREFILL_WORKERS,
+                 prefill_rate=ENRICHMENT_PREFILL_RATE):
+        self.engine = engine
+        self.fetch_info = fetch_info  # (artist, name) -> info dict, or None if unknown; raises on failure
+        self.prefill_fetch_info = prefill_fetch_info or fetch_info  # Same, for background prefill
+        self._prefill_limiter = TokenBucket(prefill_rate)
+        self._prefill_pool = ThreadPoolExecutor(max_workers=prefill_workers, thread_name_prefix='enrichment')
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.prefilled = 0
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def ensure_schema(self):
+        metadata.create_all(self.engine, checkfirst=True)
+
+    def lookup(self, artist, name):
+        """Cached track details (None for unknown tracks or recent failures), fetching them on a miss"""
+        key = track_key(artist, name)
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(track_enrichment.c.status, track_enrichment.c.info).where(
+                    track_enrichment.c.artist_key == key[0],
+                    track_enrichment.c.track_key == key[1],
+                    track_enrichment.c.expires_at > datetime.utcnow(),
+                )
+            ).first()
+        if row is not None:
+            if row.status == 'found':
+                self._count('hits')
+                return json.loads(row.info)
+            self._count('negative_hits')
+            return None
+
+        self._count('misses')
+        try:
+            status, info = self._fetch(artist, name)
+        except OutboundSkipped:
+            return None  # Not Last.fm's answer, so nothing to cache
+        self._store([(key, status, info)])
+        return info
+
+    def _fetch(self, artist, name):
+        try:
+            info = self.fetch_info(artist, name)
+        except OutboundSkipped:
+            raise
+        except Exception as e:
+            logger.warning("Error fetching track details: %s", e)
+            mark_degraded()  # The track goes out without its details
+            return 'error', None
+        return ('found', info) if info is not None else ('not_found', None)
+
+    def _store(self, results):
+        now = datetime.utcnow()
+        ttls = {'found': ENRICHMENT_TTL, 'not_found': ENRICHMENT_NOT_FOUND_TTL, 'error': ENRICHMENT_ERROR_TTL}
+        rows = [{
+            'artist_key': key[0],
+            'track_key': key[1],
+            'status': status,
+            'info': json.dumps(info) if info is not None else None,
+            'fetched_at': now,
+            'expires_at': now + ttls[status],
+        } for key, status, info in results]
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO track_enrichment (artist_key, track_key, status, info, fetched_at, expires_at)
+                VALUES (:artist_key, :track_key, :status, :info, :fetched_at, :expires_at)
+                ON CONFLICT (artist_key, track_key) DO UPDATE SET
+                    status = excluded.status,
+                    info = excluded.info,
+                    fetched_at = excluded.fetched_at,
+                    expires_at = excluded.expires_at
+            """), rows)
+
+    def prefill(self, tracks):
+        """
+        Fetch and store details for every track in the list that isn't cached
+        yet, at most prefill_rate calls per second. Stops at the first failed
+        lookup (caching nothing for it) and returns False; True once done.
+        """
+        tracks = [t for t in tracks if t.get('name') and t.get('artist', {}).get('name')]
+        for start in range(0, len(tracks), ENRICHMENT_PREFILL_CHUNK):
+            chunk = {track_key(t['artist']['name'], t['name']): t for t in tracks[start:start + ENRICHMENT_PREFILL_CHUNK]}
+            with self.engine.connect() as conn:
+                cached = {tuple(row) for row in conn.execute(
+                    select(track_enrichment.c.artist_key, track_enrichment.c.track_key).where(
+                        tuple_(track_enrichment.c.artist_key, track_enrichment.c.track_key).in_(list(chunk)),
+                        track_enrichment.c.expires_at > datetime.utcnow(),
+                    )
+                )}
+            results, failed = [], False
+            for key, track in chunk.items():
+                if key in cached:
+                    continue
+                self._prefill_limiter.acquire()
+                try:
+                    info = self.prefill_fetch_info(track['artist']['name'], track['name'])
+                except Exception as e:
+                    # Likely rate limited or down: pushing on would only make it worse
+                    logger.warning("Stopping track enrichment prefill after a failed lookup: %s", e)
+                    failed = True
+                    break
+                results.append((key, 'found' if info is not None else 'not_found', info))
+            if results:
+                self._store(results)
+                self._count('prefilled', len(results))
+            if failed:
+                return False
+        return True
+
+    def cached_info(self, tracks):
+        """{(artist_key, track_key): details} for the tracks that have cached details, in one query per chunk"""
+        keys = list({track_key(t['artist']['name'], t['name']) for t in tracks})
+        found = {}
+        with self.engine.connect() as conn:
+            for start in range(0, len(keys), ENRICHMENT_PREFILL_CHUNK):
+                rows = conn.execute(
+                    select(track_enrichment.c.artist_key, track_enrichment.c.track_key, track_enrichment.c.info).where(
+                        tuple_(track_enrichment.c.artist_key, track_enrichment.c.track_key).in_(
+                            keys[start:start + ENRICHMENT_PREFILL_CHUNK]),
+                        track_enrichment.c.status == 'found',
+                        track_enrichment.c.expires_at > datetime.utcnow(),
+                    )
+                )
+                found.update({(row.artist_key, row.track_key): json.loads(row.info) for row in rows})
+        return found
+
+    def prefill_async(self, tracks):
+        """Queue a background prefill for a freshly fetched genre pool"""
+        def run():
+            try:
+                self.prefill(tracks)
+            except Exception as e:
+                logger.error("Track enrichment prefill failed: %s", e)
+        return self._prefill_pool.submit(run)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'prefilled': self.prefilled,
+            }
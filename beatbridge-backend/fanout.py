@@ -0,0 +1,48 @@
+"""
+Concurrent fan-out of blocking outbound work from sync Flask views.
+
+The Last.fm and database calls behind a recommendation are blocking
+(requests, SQLAlchemy), so each one runs on a thread pool and an asyncio
+event loop waits on them together: a view that needs several independent
+lookups waits for the slowest one rather than their sum. run() drives a
+coroutine to completion from sync code; in_thread() hands a blocking call to
+the pool in the caller's context, so it shares the request's latency budget.
+"""
+import asyncio
+from resilience import in_current_context
+
+
+def run(coro):
+    """Run a coroutine to completion from a sync view (a fresh event loop per call)"""
+    return asyncio.run(coro)
+
+
+async def in_thread(executor, fn, *args):
+    """Await fn(*args) run on `executor` in the caller's context"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, in_current_context(fn), *args)
+
+
+async def gather_in_threads(executor, fn, items, return_exceptions=False):
+    """fn(item) for every item at once on `executor`; results in item order"""
+    return await asyncio.gather(*(in_thread(executor, fn, item) for item in items),
+                                return_exceptions=return_exceptions)
+
+
+async def first_result(executor, fn, items, accept):
+    """
+    fn(item) for every item at once; the first result in item order that
+    `accept`s, as (item, result). Later items only stand in for earlier ones,
+    so we stop waiting as soon as the earliest pending item is accepted, and
+    fall back to (items[0], its result) if none is. Exceptions propagate.
+    """
+    tasks = [asyncio.ensure_future(in_thread(executor, fn, item)) for item in items]
+    try:
+        for item, task in zip(items, tasks):
+            result = await task
+            if accept(result):
+                return item, result
+        return items[0], tasks[0].result()
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,189 @@
+"""
+Cached Google OpenID Connect metadata for the sign-in flow.
+
+The discovery document and the ID-token signing certificates are kept in memory
+for as long as Google's Cache-Control/Expires headers allow and refreshed from a
+background timer before they expire, so a sign-in normally makes a single
+outbound call: the authorization-code exchange, over a pooled keep-alive connection.
+"""
+import logging
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import jwt as pyjwt
+from google.auth import jwt as google_jwt
+import outbound
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+# PEM certificates (the format google.auth.jwt.decode expects) for the keys in the discovery jwks_uri
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+OIDC_HTTP_TIMEOUT = float(os.environ.get('OIDC_HTTP_TIMEOUT', 5))
+OIDC_DEFAULT_MAX_AGE = 3600  # Used when a response carries no caching headers
+OIDC_MIN_MAX_AGE = 60  # Floor for refetches, also bounds refreshes forced by unknown key ids
+OIDC_REFRESH_AT = 0.8  # Refresh in the background once this fraction of the lifetime has passed
+
+for host in ('accounts.google.com', 'www.googleapis.com', 'oauth2.googleapis.com'):
+    outbound.client.configure(host, timeout=OIDC_HTTP_TIMEOUT)
+
+
+class OIDCUnavailable(ValueError):
+    """Google's signing certificates couldn't be fetched, so a token can't be verified right now"""
+
+
+def cache_lifetime(headers, default=OIDC_DEFAULT_MAX_AGE):
+    """Seconds a response may be cached for, from Cache-Control max-age or Expires"""
+    cache_control = headers.get('Cache-Control', '')
+    directives = [d.strip().lower() for d in cache_control.split(',') if d.strip()]
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    for directive in directives:
+        if directive.startswith('max-age='):
+            try:
+                max_age = int(directive.split('=', 1)[1])
+            except ValueError:
+                break
+            # Age says how long a shared cache already held the response
+            try:
+                max_age -= int(headers.get('Age', 0))
+            except ValueError:
+                pass
+            return max(max_age, 0)
+
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            expires_at = parsedate_to_datetime(expires)
+            date = parsedate_to_datetime(headers['Date']) if headers.get('Date') else None
+        except (TypeError, ValueError):
+            return 0
+        now = date.timestamp() if date else time.time()
+        return max(int(expires_at.timestamp() - now), 0)
+    return default
+
+
+class CachedDocument:
+    """A JSON document fetched over HTTP, cached per its headers and refreshed before it expires"""
+
+    def __init__(self, url, session, timeout=OIDC_HTTP_TIMEOUT):
+        self.url = url
+        self.session = session
+        self.timeout = timeout
+        self._value = None
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def get(self):
+        """Return the cached document, fetching it first if it's missing or expired"""
+        if self._value is not None and time.monotonic() < self._expires_at:
+            return self._value
+        with self._lock:
+            # Another thread may have refreshed it while we waited
+            if self._value is not None and time.monotonic() < self._expires_at:
+                return self._value
+            try:
+                return self._fetch()
+            except Exception:
+                if self._value is None:
+                    raise
+                # Keep serving the last good copy while Google is unreachable
+                logger.warning("OIDC refresh of %s failed; using cached copy", self.url)
+                return self._value
+
+    def refresh(self, force=False):
+        """Refetch now; unless forced, skipped if the copy is younger than OIDC_MIN_MAX_AGE"""
+        with self._lock:
+            if not force and self._value is not None and time.monotonic() - self._fetched_at < OIDC_MIN_MAX_AGE:
+                return self._value
+            return self._fetch()
+
+    def _fetch(self):
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        value = response.json()
+        lifetime = max(cache_lifetime(response.headers), OIDC_MIN_MAX_AGE)
+        now = time.monotonic()
+        self._value = value
+        self._fetched_at = now
+        self._expires_at = now + lifetime
+        self._schedule(lifetime * OIDC_REFRESH_AT)
+        return value
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                self._fetch()
+        except Exception as e:
+            logger.warning("OIDC background refresh of %s failed: %s", self.url, e)
+            # Try again shortly; requests keep using the cached copy meanwhile
+            self._schedule(OIDC_MIN_MAX_AGE)
+
+
+class GoogleOIDC:
+    """Discovery, code exchange and ID-token verification against Google"""
+
+    def __init__(self, client_id, client_secret, session=None,
+                 discovery_url=GOOGLE_DISCOVERY_URL, certs_url=GOOGLE_CERTS_URL):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.session = session or outbound.client  # Pooled keep-alive connections per Google host
+        self.discovery = CachedDocument(discovery_url, self.session)
+        self.certs = CachedDocument(certs_url, self.session)
+
+    def warm(self):
+        """Fetch discovery and certs in the background so the first sign-in doesn't wait for them"""
+        def run():
+            for document in (self.discovery, self.certs):
+                try:
+                    document.get()
+                except Exception as e:
+                    logger.warning("OIDC warm-up of %s failed: %s", document.url, e)
+        threading.Thread(target=run, name='oidc-warmup', daemon=True).start()
+
+    def provider_config(self):
+        return self.discovery.get()
+
+    def exchange_code(self, token_url, headers, body):
+        """POST the authorization code to the token endpoint and return the JSON response"""
+        response = self.session.post(token_url, headers=headers, data=body,
+                                     auth=(self.client_id, self.client_secret), timeout=OIDC_HTTP_TIMEOUT)
+        return response.json()
+
+    def verify_id_token(self, token):
+        """
+        Verify signature, audience, expiry and issuer of a Google ID token.
+        Raises ValueError if the token is invalid, or OIDCUnavailable (also a
+        ValueError) if the certificates it needs can't be fetched.
+        """
+        try:
+            key_id = pyjwt.get_unverified_header(token).get('kid')
+        except pyjwt.InvalidTokenError as e:
+            raise ValueError(f"Malformed ID token: {str(e)}")
+        certs = self._certs(self.certs.get)
+        if key_id not in certs:
+            # Google rotated its keys before our copy expired
+            certs = self._certs(self.certs.refresh)
+
+        idinfo = google_jwt.decode(token, certs=certs, audience=self.client_id)
+        if idinfo.get('iss') not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer: {idinfo.get('iss')}")
+        return idinfo
+
+    def _certs(self, fetch):
+        try:
+            return fetch()
+        except Exception as e:
+            raise OIDCUnavailable(f"Google certificates unavailable: {str(e)}") from e
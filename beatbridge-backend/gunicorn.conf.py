@@ -0,0 +1,22 @@
+# Loaded automatically by `gunicorn app:app` from this directory.
+import glob
+import os
+import tempfile
+
+# Workers write their metrics here so /metrics can aggregate them (see metrics.py).
+# Set before any worker imports prometheus_client, which reads it at import.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'beatbridge-metrics'))
+
+
+def on_starting(server):
+    """Start each deploy from empty counters rather than a previous run's files"""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(path, exist_ok=True)
+    # Only prometheus_client's own files: the directory comes from the environment and may hold anything
+    for leftover in glob.glob(os.path.join(path, '*.db')):
+        os.remove(leftover)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
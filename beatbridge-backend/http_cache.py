@@ -0,0 +1,83 @@
+"""
+Per-route HTTP caching policy with strong ETags.
+
+Responses are not cacheable unless their route declares a policy with
+@cache_policy: public or private, a max-age in seconds (0 means caches may
+keep it but must revalidate on every use) and optionally immutable. Cacheable
+200 responses carry a strong ETag and an If-None-Match that matches it is
+answered with 304 Not Modified.
+
+The ETag comes from the route's `version` callable when it has one (a cheap
+lookup such as a row's updated_at, called with the view's arguments), else
+from a hash of the response body. With `version`, revalidation is answered
+before the view runs, so a 304 skips its queries and serialization.
+"""
+import hashlib
+from functools import wraps
+from flask import g, request, make_response
+
+NO_STORE = 'no-cache, no-store, must-revalidate'
+
+
+class CachePolicy:
+    """Cache-Control for a route's successful responses"""
+
+    def __init__(self, max_age=0, public=False, immutable=False):
+        self.max_age = max_age
+        self.public = public
+        self.immutable = immutable
+
+    def header(self):
+        parts = ['public' if self.public else 'private']
+        parts.append(f"max-age={self.max_age}" if self.max_age else 'no-cache')
+        if self.immutable:
+            parts.append('immutable')
+        return ', '.join(parts)
+
+
+def version_etag(version):
+    """Strong ETag for a resource version, e.g. a row's updated_at"""
+    return hashlib.sha256(f"{request.path}:{version}".encode()).hexdigest()[:32]
+
+
+def cache_policy(max_age=0, public=False, immutable=False, version=None):
+    """
+    Route decorator declaring how its responses may be cached. `version`, if
+    given, is called with the view's arguments and returns a value that
+    changes whenever the response would (None to skip the early check).
+    """
+    policy = CachePolicy(max_age, public, immutable)
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.cache_policy = policy
+            if version is not None and request.method in ('GET', 'HEAD'):
+                current = version(*args, **kwargs)
+                if current is not None:
+                    g.cache_etag = version_etag(current)
+                    if request.if_none_match.contains(g.cache_etag):
+                        return make_response('', 304)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def apply_policy(response):
+    """after_request hook: the route's caching headers and ETag, or no-store"""
+    policy = g.get('cache_policy')
+    if policy is None or response.status_code not in (200, 304) or request.method not in ('GET', 'HEAD'):
+        response.headers['Cache-Control'] = NO_STORE
+        response.headers['Expires'] = 0
+        response.headers['Pragma'] = 'no-cache'
+        return response
+
+    response.headers['Cache-Control'] = policy.header()
+    if g.get('cache_etag'):
+        response.set_etag(g.cache_etag)
+    elif response.status_code == 200 and 'ETag' not in response.headers \
+            and not response.direct_passthrough and not response.is_streamed:
+        response.add_etag()  # Hash of the body
+    if response.status_code == 200:
+        response.make_conditional(request)
+    return response
@@ -0,0 +1,158 @@
+"""
+Last.fm API access for song recommendations.
+
+A genre's pool is built from the first MAX_PAGES pages of tag.gettoptracks,
+fetched concurrently on a small shared thread pool and deduplicated by track
+URL, so a cold pool costs one parallel wave of requests. The catalog
+ingestion job walks a genre's whole chart with fetch_full_genre_chart.
+
+Every call goes through one circuit breaker and the shared keep-alive client
+in outbound.py, which clamps it to the current request's latency budget.
+Background jobs pass use_breaker=False so their failures (e.g. being rate
+limited during a prefill) don't fail users' lookups fast.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+import outbound
+from resilience import CircuitBreaker, OutboundSkipped, budget_timeout
+
+logger = logging.getLogger(__name__)
+
+LASTFM_API_KEY = os.environ.get('LASTFM_API_KEY', 'your-lastfm-api-key')  # Get from environment variable
+LASTFM_BASE_URL = os.environ.get('LASTFM_BASE_URL', 'http://ws.audioscrobbler.com/2.0/')  # Overridable for local stand-ins
+TRACKS_PER_PAGE = 50  # Increased from 20
+MAX_PAGES = 3  # Number of pages to cache per genre
+# Upper bound on concurrent Last.fm page fetches per worker process
+LASTFM_FETCH_WORKERS = int(os.environ.get('LASTFM_FETCH_WORKERS', 8))
+LASTFM_TRACK_NOT_FOUND = 6  # API error code for an unknown track
+
+# Consecutive failures (errors, timeouts, 5xx) that open the breaker, and seconds before a trial call
+LASTFM_BREAKER_THRESHOLD = int(os.environ.get('LASTFM_BREAKER_THRESHOLD', 5))
+LASTFM_BREAKER_RESET = float(os.environ.get('LASTFM_BREAKER_RESET', 30))
+
+outbound.client.configure(urlsplit(LASTFM_BASE_URL).netloc, timeout=5)
+_fetch_pool = ThreadPoolExecutor(max_workers=LASTFM_FETCH_WORKERS, thread_name_prefix='lastfm')
+breaker = CircuitBreaker('lastfm', failure_threshold=LASTFM_BREAKER_THRESHOLD, reset_timeout=LASTFM_BREAKER_RESET)
+
+
+def lastfm_get(params, timeout, use_breaker=True):
+    """
+    GET the Last.fm API through the circuit breaker, within the request's
+    latency budget. Raises CircuitOpen or BudgetExhausted without calling out
+    when either won't allow the call. With use_breaker=False the breaker is
+    neither checked nor told how the call went.
+    """
+    budget_timeout(timeout)  # Fail fast, before taking a half-open trial slot, if the budget is spent
+    if not use_breaker:
+        return outbound.client.get(LASTFM_BASE_URL, params=params, timeout=timeout)
+    breaker.check()
+    try:
+        response = outbound.client.get(LASTFM_BASE_URL, params=params, timeout=timeout)
+    except OutboundSkipped:
+        # Cut short by our budget, which says nothing about Last.fm's health
+        breaker.record_skipped()
+        raise
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def fetch_genre_tracks(genre, page=1):
+    """Fetch tracks for a genre from Last.fm with pagination"""
+    params = {
+        'method': 'tag.gettoptracks',
+        'tag': genre,
+        'api_key': LASTFM_API_KEY,
+        'format': 'json',
+        'limit': TRACKS_PER_PAGE,
+        'page': page
+    }
+    response = lastfm_get(params, timeout=5)
+    response.raise_for_status()
+    return response.json()
+
+
+def page_tracks(data):
+    """Track list from a tag.gettoptracks response (Last.fm sends a bare object for a single track)"""
+    tracks = data.get('tracks', {}).get('track', []) if isinstance(data, dict) else []
+    return [tracks] if isinstance(tracks, dict) else tracks
+
+
+def total_pages(data):
+    """Number of chart pages Last.fm reports for a tag.gettoptracks response"""
+    try:
+        return int(data['tracks']['@attr']['totalPages'])
+    except (KeyError, TypeError, ValueError):
+        return 1
+
+
+def _merge_pages(genre, pages):
+    """Tracks from a list of page futures in chart order, deduplicated by URL; failed pages are skipped"""
+    pool, seen, errors = [], set(), []
+    for future in pages:
+        try:
+            data = future.result()
+        except requests.RequestException as e:
+            errors.append(e)
+            continue
+        for track in page_tracks(data):
+            url = track.get('url')
+            if url and url not in seen:
+                seen.add(url)
+                pool.append(track)
+    if errors:
+        if len(errors) == len(pages):
+            raise errors[0]
+        logger.warning("Last.fm: %d of %d pages failed for genre %s: %s", len(errors), len(pages), genre, errors[0])
+    return pool
+
+
+def fetch_genre_pool(genre, pages=MAX_PAGES):
+    """
+    All tracks on the first `pages` pages for a genre, fetched concurrently and
+    deduplicated by URL (in chart order). Pages that fail are skipped; if every
+    page fails the first error is raised.
+    """
+    return _merge_pages(genre, [_fetch_pool.submit(fetch_genre_tracks, genre, page) for page in range(1, pages + 1)])
+
+
+def fetch_full_genre_chart(genre, max_pages):
+    """
+    Every track on a genre's chart, up to `max_pages` pages: the first page
+    says how many there are, then the rest are fetched concurrently.
+    """
+    first = _fetch_pool.submit(fetch_genre_tracks, genre, 1)
+    pages = min(total_pages(first.result()), max_pages)
+    return _merge_pages(genre, [first] + [_fetch_pool.submit(fetch_genre_tracks, genre, page) for page in range(2, pages + 1)])
+
+
+class LastFMError(Exception):
+    """Last.fm answered with an API error"""
+
+
+def fetch_track_info(artist, name, use_breaker=True):
+    """
+    track.getInfo details for a track, or None if Last.fm doesn't know it.
+    Raises requests.RequestException or LastFMError on other failures.
+    """
+    params = {
+        'method': 'track.getInfo',
+        'artist': artist,
+        'track': name,
+        'api_key': LASTFM_API_KEY,
+        'format': 'json'
+    }
+    data = lastfm_get(params, timeout=2, use_breaker=use_breaker).json()
+    if 'track' in data:
+        return data['track']
+    if data.get('error') == LASTFM_TRACK_NOT_FOUND:
+        return None
+    raise LastFMError(f"track.getInfo error {data.get('error')}: {data.get('message')}")
@@ -0,0 +1 @@
+"""Load-generation harness for the production app; see loadtest/run.py."""
@@ -0,0 +1,91 @@
+"""
+Benchmark for username allocation with many colliding names.
+
+Fills a scratch table with "popular", "popular1", … "popular{n-1}" and times
+the old probe-per-candidate loop against usernames.next_free_username,
+counting SQL statements for each.
+
+    python -m loadtest.bench_usernames --collisions 10 100 1000 10000
+    python -m loadtest.bench_usernames --database-url postgresql://user:pw@localhost/scratch
+
+The scratch table (username_bench) is dropped afterwards.
+"""
+import argparse
+import json
+import time
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, create_engine, event, select, insert, text
+from sqlalchemy.orm import Session
+
+from usernames import next_free_username
+
+BASE = 'popular'
+
+
+def build_table(engine):
+    metadata = MetaData()
+    table = Table('username_bench', metadata,
+                  Column('id', Integer, primary_key=True),
+                  Column('username', String(80), unique=True, nullable=False))
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    if engine.dialect.name == 'postgresql':
+        # Same index the users table gets from migrations/add_case_insensitive_user_uniqueness.sql
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX ix_username_bench_pattern ON username_bench (lower(username) text_pattern_ops)"))
+    return metadata, table
+
+
+def legacy_allocate(session, column, base):
+    """The old loop: one query per taken candidate"""
+    candidate = base
+    suffix = 1
+    while session.execute(select(column).where(column == candidate)).first():
+        candidate = f"{base}{suffix}"
+        suffix += 1
+    return candidate
+
+
+def measure(engine, allocate, column):
+    statements = []
+    listener = lambda *args: statements.append(1)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        with Session(engine) as session:
+            started = time.perf_counter()
+            name = allocate(session, column, BASE)
+            elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return {'username': name, 'queries': len(statements), 'ms': round(elapsed * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--collisions', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--database-url', default='sqlite://')
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    metadata, table = build_table(engine)
+    results = []
+    try:
+        filled = 0
+        for count in sorted(args.collisions):
+            with engine.begin() as conn:
+                conn.execute(insert(table), [{'username': f"{BASE}{i}" if i else BASE}
+                                             for i in range(filled, count)])
+            filled = count
+            results.append({
+                'collisions': count,
+                'legacy': measure(engine, legacy_allocate, table.c.username),
+                'prefix_query': measure(engine, next_free_username, table.c.username),
+            })
+    finally:
+        metadata.drop_all(engine)
+
+    print(json.dumps({'dialect': engine.dialect.name, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+"""
+Load generator for the production Flask app (app.py).
+
+Boots app.py in-process against the database configured the usual way
+(DATABASE_URL or DB_*), swaps Last.fm and SMTP for the local stand-ins in
+loadtest.stubs, seeds verified users, then drives a weighted mix of requests
+from concurrent virtual users and writes a JSON report (latency percentiles,
+requests/sec and SQL statements per request, per endpoint).
+
+    python -m loadtest.run --duration 30 --concurrency 8 --output results.json
+
+Run it against a scratch database with migrations applied: it only ever adds
+rows (users are namespaced per run) but does not clean up after itself.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import requests
+
+from loadtest.stubs import LastFMStub, SMTPSink
+
+GENRES = ['rock', 'pop', 'jazz', 'metal', 'funk', 'blues', 'electronic', 'k-pop']
+
+# Relative weight of each operation in the mixed workload
+DEFAULT_MIX = {
+    'login': 10,
+    'recommend': 25,
+    'jam_create': 10,
+    'jam_read': 15,
+    'jam_update': 8,
+    'jam_delete': 4,
+    'explore': 18,
+    'share_accept': 10,
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Recorder:
+    """Collects client-side latencies and server-side SQL statement counts per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.db_queries = defaultdict(list)
+
+    def request(self, endpoint, status, seconds):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+
+    def queries(self, endpoint, count):
+        with self._lock:
+            self.db_queries[endpoint].append(count)
+
+    def report(self, elapsed):
+        endpoints = {}
+        total = errors = 0
+        for endpoint in sorted(self.latencies):
+            values = sorted(self.latencies[endpoint])
+            statuses = dict(self.statuses[endpoint])
+            failed = sum(n for status, n in statuses.items() if status >= 500 or status == 0)
+            queries = self.db_queries.get(endpoint, [])
+            total += len(values)
+            errors += failed
+            endpoints[endpoint] = {
+                'count': len(values),
+                'errors': failed,
+                'rps': round(len(values) / elapsed, 2),
+                'status_codes': {str(k): v for k, v in sorted(statuses.items())},
+                'latency_ms': {
+                    'mean': round(1000 * sum(values) / len(values), 2),
+                    'p50': round(1000 * percentile(values, 50), 2),
+                    'p95': round(1000 * percentile(values, 95), 2),
+                    'p99': round(1000 * percentile(values, 99), 2),
+                    'max': round(1000 * values[-1], 2),
+                },
+                'db_queries_per_request': {
+                    'mean': round(sum(queries) / len(queries), 2) if queries else None,
+                    'max': max(queries) if queries else None,
+                },
+            }
+        return {
+            'totals': {'requests': total, 'errors': errors, 'rps': round(total / elapsed, 2)},
+            'endpoints': endpoints,
+        }
+
+
+class VirtualUser:
+    def __init__(self, base_url, recorder, name, password):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.session = requests.Session()
+        self.name = name
+        self.email = f"{name}@loadtest.local"
+        self.password = password
+        self.token = None
+        self.jam_ids = []
+        self.counter = 0
+
+    def call(self, method, rule, path, record=True, **kwargs):
+        """Issue a request; `rule` is the Flask URL rule the result is reported under"""
+        headers = kwargs.pop('headers', {})
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, headers=headers, timeout=30, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        if record:
+            self.recorder.request(f"{method} {rule}", status, time.perf_counter() - started)
+        return response
+
+    def next_title(self):
+        self.counter += 1
+        return f"{self.name} loop {self.counter}"
+
+
+def jam_payload(title):
+    return {
+        'title': title,
+        'pattern_json': [[random.randint(0, 1) for _ in range(16)] for _ in range(4)],
+        'instruments_json': ['Kick', 'Snare', 'Hi-Hat', 'Crash'],
+        'is_public': random.random() < 0.8,
+        'time_signature': '4/4',
+        'note_resolution': '16th',
+        'bpm': random.choice([80, 100, 120, 140]),
+    }
+
+
+def op_login(user, users):
+    response = user.call('POST', '/api/login', '/api/login', json={'username': user.name, 'password': user.password})
+    if response is not None and response.status_code == 200:
+        user.token = response.json()['token']
+
+
+def op_recommend(user, users):
+    user.call('POST', '/api/recommend-song', '/api/recommend-song', json={'genres': [random.choice(GENRES)]})
+
+
+def op_jam_create(user, users):
+    response = user.call('POST', '/api/jam-sessions', '/api/jam-sessions', json=jam_payload(user.next_title()))
+    if response is not None and response.status_code == 201:
+        user.jam_ids.append(response.json()['jam_id'])
+
+
+def op_jam_read(user, users):
+    if user.jam_ids:
+        jam_id = random.choice(user.jam_ids)
+        user.call('GET', '/api/jam-sessions/<int:jam_id>', f"/api/jam-sessions/{jam_id}")
+
+
+def op_jam_update(user, users):
+    if user.jam_ids:
+        jam_id = random.choice(user.jam_ids)
+        user.call('PUT', '/api/jam-sessions/<int:jam_id>', f"/api/jam-sessions/{jam_id}", json=jam_payload(user.next_title()))
+
+
+def op_jam_delete(user, users):
+    # Keep a few jams around so reads, updates and shares always have something to work with
+    if len(user.jam_ids) > 3:
+        jam_id = user.jam_ids.pop(random.randrange(len(user.jam_ids)))
+        user.call('DELETE', '/api/jam-sessions/<int:jam_id>', f"/api/jam-sessions/{jam_id}")
+
+
+def op_explore(user, users):
+    user.call('GET', '/api/jam-sessions/explore', '/api/jam-sessions/explore')
+
+
+def op_share_accept(user, users):
+    if not user.jam_ids:
+        return
+    jam_ids = random.sample(user.jam_ids, min(3, len(user.jam_ids)))
+    response = user.call('POST', '/api/shared-loops', '/api/shared-loops', json={'jam_session_ids': jam_ids})
+    if response is None or response.status_code != 201:
+        return
+    share_id = response.json()['share_id']
+    recipient = random.choice([u for u in users if u is not user] or [user])
+    recipient.call('POST', '/api/shared-loops/<share_id>/accept', f"/api/shared-loops/{share_id}/accept")
+
+
+OPERATIONS = {
+    'login': op_login,
+    'recommend': op_recommend,
+    'jam_create': op_jam_create,
+    'jam_read': op_jam_read,
+    'jam_update': op_jam_update,
+    'jam_delete': op_jam_delete,
+    'explore': op_explore,
+    'share_accept': op_share_accept,
+}
+
+
+def seed_users(base_url, recorder, sink, count, run_id):
+    """Register, verify and customize `count` users through the public API"""
+    users = []
+    for i in range(count):
+        user = VirtualUser(base_url, recorder, f"lt{run_id}u{i}", 'LoadTest123!')
+        user.call('POST', '/api/register', '/api/register', record=False, json={
+            'username': user.name, 'email': user.email,
+            'password': user.password, 'confirmation': user.password,
+        })
+        code = sink.find_code(user.email)
+        if code is None:
+            raise RuntimeError(f"No verification email captured for {user.email}")
+        response = user.call('POST', '/api/verify-email', '/api/verify-email', record=False,
+                             json={'verification_code': code})
+        user.token = response.json()['token']
+        user.call('POST', '/api/save-customization', '/api/save-customization', record=False, json={
+            'skill_level': random.choice(['First-timer', 'Beginner', 'Intermediate', 'Advanced']),
+            'practice_frequency': 'Daily',
+            'favorite_genres': random.sample(GENRES, 2),
+        })
+        for _ in range(3):
+            response = user.call('POST', '/api/jam-sessions', '/api/jam-sessions', record=False,
+                                 json=jam_payload(user.next_title()))
+            user.jam_ids.append(response.json()['jam_id'])
+        users.append(user)
+    return users
+
+
+def drive(users, mix, duration, concurrency):
+    """Run `concurrency` threads, each looping over its share of users until `duration` elapses"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(index)
+        mine = users[index::concurrency]
+        while time.monotonic() < deadline:
+            user = rng.choice(mine)
+            OPERATIONS[rng.choices(names, weights)[0]](user, users)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - started
+
+
+def instrument(app_module, recorder):
+    """Count SQL statements issued while handling each request, keyed like the client-side report"""
+    from flask import g, request, has_request_context
+    from sqlalchemy import event
+
+    flask_app, db = app_module.app, app_module.db
+
+    @flask_app.before_request
+    def _loadtest_start():
+        g.loadtest_queries = 0
+
+    @flask_app.teardown_request
+    def _loadtest_finish(exc):
+        rule = request.url_rule.rule if request.url_rule else request.path
+        recorder.queries(f"{request.method} {rule}", g.get('loadtest_queries', 0))
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'loadtest_queries' in g:
+            g.loadtest_queries += 1
+
+    with flask_app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Drive a mixed workload against app.py and report per-endpoint stats')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run the mixed workload')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--users', type=int, default=16, help='virtual users to seed (at least --concurrency)')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed for payloads and the op mix')
+    parser.add_argument('--lastfm-latency', type=float, default=0.0, help='artificial latency of the Last.fm stub (s)')
+    parser.add_argument('--mix', default=None, help='JSON object overriding operation weights, e.g. \'{"recommend": 50}\'')
+    parser.add_argument('--port', type=int, default=0, help='port for the in-process app server (0 = any)')
+    parser.add_argument('--output', default='-', help='where to write the JSON report (- for stdout)')
+    args = parser.parse_args(argv)
+    if args.users < args.concurrency:
+        parser.error('--users must be at least --concurrency')
+
+    random.seed(args.seed)
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix.update(json.loads(args.mix))
+
+    lastfm = LastFMStub(latency=args.lastfm_latency).start()
+    sink = SMTPSink().start()
+
+    # app.py reads its configuration at import time, so point it at the stand-ins first
+    os.environ['LASTFM_BASE_URL'] = lastfm.url
+    os.environ['LASTFM_API_KEY'] = 'loadtest'
+    os.environ['MAIL_SERVER'] = sink.host
+    os.environ['MAIL_PORT'] = str(sink.port)
+    os.environ['MAIL_USE_TLS'] = 'False'
+    os.environ['MAIL_USERNAME'] = 'loadtest@beatbridge.local'
+    os.environ['MAIL_PASSWORD'] = 'loadtest'
+    os.environ.setdefault('LOCAL_DEV', '1')
+
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    recorder = Recorder()
+    # stdout is reserved for the report, so anything the app or its libraries write there goes to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as app_module
+        instrument(app_module, recorder)
+        server = make_server('127.0.0.1', args.port, app_module.app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        # Namespace usernames per run so repeated runs against one database don't collide
+        run_id = f"{int(time.time())}{os.getpid() % 1000}"
+        users = seed_users(base_url, Recorder(), sink, args.users, run_id)
+        for user in users:
+            user.recorder = recorder
+        started_at = datetime.now(timezone.utc).isoformat()
+        elapsed = drive(users, mix, args.duration, args.concurrency)
+        server.shutdown()
+
+    lastfm.stop()
+    sink.stop()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': started_at,
+            'elapsed_s': round(elapsed, 2),
+            'duration_s': args.duration,
+            'concurrency': args.concurrency,
+            'users': args.users,
+            'seed': args.seed,
+            'mix': mix,
+            'lastfm_latency_s': args.lastfm_latency,
+            'lastfm_calls': dict(lastfm.calls),
+            'emails_sent': len(sink.messages),
+            'python': platform.python_version(),
+        },
+    }
+    report.update(recorder.report(elapsed))
+    output = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Local stand-ins for the services the backend talks to: a Last.fm API stub and an SMTP sink.
+"""
+import base64
+import json
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class LastFMStub:
+    """Serves canned tag.gettoptracks / track.getInfo responses on a local port"""
+
+    def __init__(self, host='127.0.0.1', port=0, tracks_per_genre=150, latency=0.0):
+        self.tracks_per_genre = tracks_per_genre
+        self.latency = latency
+        self.unknown_tracks = set()  # track.getInfo answers "Track not found" for these names
+        self.calls = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+            disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                stub._count(params.get('method', 'unknown'))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = json.dumps(stub.respond(params)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}/2.0/"
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def respond(self, params):
+        method = params.get('method')
+        if method == 'tag.gettoptracks':
+            genre = params.get('tag', 'rock')
+            limit = int(params.get('limit', 50))
+            page = int(params.get('page', 1))
+            start = (page - 1) * limit
+            indexes = range(start, min(start + limit, self.tracks_per_genre))
+            return {'tracks': {
+                'track': [self._track(genre, i) for i in indexes],
+                '@attr': {'tag': genre, 'page': str(page), 'perPage': str(limit),
+                          'totalPages': str(-(-self.tracks_per_genre // limit))}
+            }}
+        if method == 'track.getInfo':
+            if params.get('track') in self.unknown_tracks:
+                return {'error': 6, 'message': 'Track not found'}
+            return {'track': {
+                'name': params.get('track'),
+                'artist': {'name': params.get('artist')},
+                'listeners': '12345',
+                'duration': '215000',
+                'album': {'title': 'Stub Album', 'image': [
+                    {'#text': 'http://img.example/small.png', 'size': 'small'},
+                    {'#text': 'http://img.example/large.png', 'size': 'large'},
+                ]},
+                'toptags': {'tag': [{'name': 'stub'}]},
+            }}
+        return {'error': 3, 'message': 'Invalid Method'}
+
+    def _track(self, genre, i):
+        return {
+            'name': f"{genre} track {i}",
+            'artist': {'name': f"{genre} artist {i % 40}"},
+            'url': f"http://lastfm.example/{genre}/{i}",
+            'image': [{'#text': f"http://img.example/{genre}/{i}.png", 'size': 'large'}],
+        }
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SMTPSink:
+    """Minimal SMTP server that accepts (and authenticates) everything and keeps the messages"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write((line + '\r\n').encode())
+
+            def handle(self):
+                with sink._lock:
+                    sink.connections += 1
+                self.reply('220 sink ESMTP')
+                mail_from, rcpt_to = None, []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode(errors='replace').strip()
+                    verb = command.split(' ', 1)[0].upper()
+                    if verb == 'EHLO':
+                        self.reply('250-sink')
+                        self.reply('250-AUTH PLAIN LOGIN')
+                        self.reply('250 8BITMIME')
+                    elif verb == 'HELO':
+                        self.reply('250 sink')
+                    elif verb == 'AUTH':
+                        self._auth(command)
+                    elif verb == 'MAIL':
+                        mail_from, rcpt_to = command[10:].strip('<> '), []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        rcpt_to.append(command[8:].strip('<> '))
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        data = []
+                        while True:
+                            chunk = self.rfile.readline()
+                            if not chunk or chunk in (b'.\r\n', b'.\n'):
+                                break
+                            data.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                        sink._store(mail_from, rcpt_to, b''.join(data).decode(errors='replace'))
+                        self.reply('250 OK queued')
+                    elif verb == 'RSET':
+                        mail_from, rcpt_to = None, []
+                        self.reply('250 OK')
+                    elif verb == 'NOOP':
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+            def _auth(self, command):
+                parts = command.split()
+                mechanism = parts[1].upper() if len(parts) > 1 else ''
+                if mechanism == 'PLAIN' and len(parts) == 2:
+                    self.reply('334 ')
+                    self.rfile.readline()
+                elif mechanism == 'LOGIN':
+                    if len(parts) == 2:
+                        self.reply('334 ' + base64.b64encode(b'Username:').decode())
+                        self.rfile.readline()
+                    self.reply('334 ' + base64.b64encode(b'Password:').decode())
+                    self.rfile.readline()
+                self.reply('235 Authentication successful')
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        self.host = host
+        self.port = self.server.server_address[1]
+
+    def _store(self, mail_from, rcpt_to, data):
+        with self._lock:
+            self.messages.append({'from': mail_from, 'to': list(rcpt_to), 'data': data})
+
+    def find_code(self, recipient, pattern=r'code is: (\d{6})', timeout=5.0):
+        """Return the most recent 6-digit code mailed to `recipient`, waiting up to `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                for message in reversed(self.messages):
+                    if recipient in message['to']:
+                        match = re.search(pattern, message['data'])
+                        if match:
+                            return match.group(1)
+            time.sleep(0.05)
+        return None
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
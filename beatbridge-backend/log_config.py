@@ -0,0 +1,144 @@
+"""
+Structured, non-blocking logging.
+
+configure_logging() routes every logger through a QueueHandler: request
+threads only put the record on an in-memory queue and a QueueListener thread
+formats it as one JSON object per line and writes it to stdout. If the queue
+is full the record is dropped (and counted) rather than blocking the request.
+
+Levels are set globally with LOG_LEVEL and per logger with LOG_LEVELS, e.g.
+"app.requests=DEBUG,cache=WARNING". DEBUG records are sampled: only
+LOG_DEBUG_SAMPLE_RATE of them are kept, so turning debug logging on for a
+busy logger doesn't flood the output. Fields passed with `extra=` are added
+to the JSON record, truncated to LOG_PAYLOAD_LIMIT characters each so that
+request payloads can't blow up a log line.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Comma-separated logger=LEVEL overrides
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+# Share of DEBUG records that are written (1 keeps all of them)
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.1))
+# Characters kept of each extra field (e.g. a logged request payload)
+LOG_PAYLOAD_LIMIT = int(os.environ.get('LOG_PAYLOAD_LIMIT', 200))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def truncate(value, limit=LOG_PAYLOAD_LIMIT):
+    """`value` as a string of at most `limit` characters, noting how much was cut"""
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text) - limit} more chars)"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, extra fields and any traceback"""
+
+    def __init__(self, payload_limit=LOG_PAYLOAD_LIMIT):
+        super().__init__()
+        self.payload_limit = payload_limit
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value if isinstance(value, (int, float, bool, type(None))) \
+                    else truncate(value, self.payload_limit)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Keeps every record at INFO and above, and `rate` of DEBUG records"""
+
+    def __init__(self, rate=LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; drops them if the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Resolve the message and traceback now (the args may change once we return),
+        # but leave the formatting to the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+_listener = None
+_handler = None
+
+
+def set_levels(levels):
+    """Apply "logger=LEVEL,..." overrides"""
+    for override in filter(None, (part.strip() for part in levels.split(','))):
+        name, _, level = override.partition('=')
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+
+def configure_logging(level=LOG_LEVEL, levels=LOG_LEVELS, stream=None):
+    """Install the queue handler on the root logger and start the writer thread (once per process)"""
+    global _listener, _handler
+    set_levels(levels)
+    if _listener is not None:
+        return _handler
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(DebugSampler())
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flush what's queued on shutdown
+    return _handler
+
+
+def log_stats():
+    """Records dropped because the log queue was full"""
+    return {'dropped': _handler.dropped if _handler else 0}
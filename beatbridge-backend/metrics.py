@@ -0,0 +1,246 @@
+"""
+Prometheus metrics: per-route requests and latency, SQL per request, outbound calls.
+
+init_app() times every request by route and counts its status codes. SQL
+statements run while handling a request (including on threads that share the
+request's context, see resilience.in_current_context) are counted and timed
+through SQLAlchemy engine events; these are the only cursor listeners, and
+other per-statement consumers (query_monitor.py) register with
+on_statement() rather than timing statements again. outbound.py reports each Last.fm/Google
+call's latency and outcome, passwords.py each hash and its queue depth, and
+resilience.py breaker state and budget overruns as they happen. The counters
+the caches, the outbound client and the log queue keep for stats() are copied
+into Prometheus counters by publish_stats(), at most every
+METRICS_STATS_INTERVAL seconds after a request and on every scrape. GET
+/metrics serves it all in Prometheus text format.
+
+Under gunicorn every worker has its own counters. With PROMETHEUS_MULTIPROC_DIR
+set (gunicorn.conf.py sets one up) prometheus_client keeps them in files in
+that directory and /metrics aggregates all workers, whichever one serves it.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+from flask import Response, g, request
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from cache import caches
+from log_config import log_stats
+
+# If set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Seconds between copies of cache, outbound client and log queue stats into the exported counters
+METRICS_STATS_INTERVAL = float(os.environ.get('METRICS_STATS_INTERVAL', 10))
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests handled', ['method', 'route', 'status'])
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time to handle an HTTP request', ['method', 'route'],
+                            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+DB_QUERIES = Histogram('db_queries_per_request', 'SQL statements run per HTTP request', ['route'],
+                       buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_TIME = Histogram('db_time_per_request_seconds', 'Total time in SQL statements per HTTP request', ['route'],
+                    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+OUTBOUND_LATENCY = Histogram('outbound_request_duration_seconds', 'Outbound HTTP call latency, per attempt',
+                             ['host', 'outcome'], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+# Gauges are summed (or maxed) over live workers; counters keep dead workers' counts
+HASH_LATENCY = Histogram('password_hash_duration_seconds', 'Time to hash or verify a password on the pool',
+                         buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+HASH_QUEUE_DEPTH = Gauge('password_hash_queue_depth', 'Hashes running or waiting on the pool',
+                         multiprocess_mode='livesum')
+HASH_REJECTED = Counter('password_hash_rejected_total', 'Hashes rejected because the pool was saturated')
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+BREAKER_STATE = Gauge('circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open; worst worker)',
+                      ['breaker'], multiprocess_mode='livemax')
+BREAKER_TRIPS = Counter('circuit_breaker_trips_total', 'Times a circuit breaker opened', ['breaker'])
+BREAKER_REJECTED = Counter('circuit_breaker_rejected_total', 'Calls failed fast by an open breaker', ['breaker'])
+BUDGET_EVENTS = Counter('latency_budget_events_total',
+                        'Budgeted requests ("budgets"), budgets that ran out ("exhausted") and degraded responses',
+                        ['event'])
+CACHE_EVENTS = Counter('cache_events_total', 'Cache hits, misses, evictions and other counts by namespace',
+                       ['namespace', 'event'])
+CACHE_ENTRIES = Gauge('cache_entries', 'Entries held per cache namespace', ['namespace'],
+                      multiprocess_mode='livesum')
+OUTBOUND_REQUESTS = Counter('outbound_requests_total', 'Outbound attempts, retries and errors by host',
+                            ['host', 'kind'])
+OUTBOUND_CONNECTIONS = Counter('outbound_connections_total', 'Outbound connections opened by host', ['host'])
+OUTBOUND_REUSE = Gauge('outbound_connection_reuse_ratio', 'Share of outbound requests that reused a connection',
+                       ['host'], multiprocess_mode='liveall')
+LOG_DROPPED = Counter('log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+
+class RequestQueries:
+    """SQL count and time for one request (statements may run on several threads)"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+
+
+def _current_queries():
+    try:
+        return g.get('metrics_queries')
+    except RuntimeError:
+        return None  # Outside a request (background threads, CLI)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+_statement_hooks = []
+
+
+def on_statement(hook):
+    """
+    Call hook(statement, parameters, context, executemany, seconds) after every
+    SQL statement, with the time measured here
+    """
+    if hook not in _statement_hooks:
+        _statement_hooks.append(hook)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    queries = _current_queries()
+    if queries is not None:
+        queries.add(elapsed)
+    for hook in _statement_hooks:
+        hook(statement, parameters, context, executemany, elapsed)
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get('metrics_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+_engine_events = False
+
+
+def instrument_engines():
+    """Time SQL statements on every engine (once per process)"""
+    global _engine_events
+    if not _engine_events:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _engine_events = True
+
+
+def route_label():
+    """The matched URL rule (e.g. /api/jam-sessions/<int:jam_id>), so labels don't grow with IDs"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = RequestQueries()
+
+
+def _finish_request(response):
+    started = g.get('metrics_started')
+    if started is not None:
+        route = route_label()
+        REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+        REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - started)
+        queries = g.metrics_queries
+        DB_QUERIES.labels(route).observe(queries.count)
+        DB_TIME.labels(route).observe(queries.seconds)
+    if time.monotonic() - _last_publish >= METRICS_STATS_INTERVAL:
+        publish_stats()
+    return response
+
+
+def observe_outbound(host, seconds, outcome):
+    """Record one outbound attempt; outcome is e.g. '2xx', '5xx', 'timeout' or 'error'"""
+    OUTBOUND_LATENCY.labels(host, outcome).observe(seconds)
+
+
+def breaker_state(name, state):
+    BREAKER_STATE.labels(name).set(BREAKER_STATES[state])
+
+
+def budget_event(event):
+    """Count a budget event: 'budgets', 'exhausted' or 'degraded'"""
+    BUDGET_EVENTS.labels(event).inc()
+
+
+# Config and point-in-time values in cache stats(); every other number there is a running count
+_CACHE_SETTINGS = frozenset(['size', 'max_size', 'ttl', 'inflight'])
+_published = {}  # (counter, labels) -> value last copied into it by this worker
+_publish_lock = threading.Lock()
+_last_publish = 0.0
+
+
+def _publish_count(counter, labels, value):
+    """Advance `counter` to a running count kept elsewhere (counters can only be incremented)"""
+    key = (counter, labels)
+    delta = value - _published.get(key, 0)
+    if delta > 0:
+        (counter.labels(*labels) if labels else counter).inc(delta)
+    _published[key] = value
+
+
+def publish_stats():
+    """Copy this worker's cache, outbound client and log queue stats into the exported metrics"""
+    global _last_publish
+    from outbound import client  # Imported here: outbound reports its latency through this module
+
+    with _publish_lock:
+        _last_publish = time.monotonic()
+        for namespace, stats in caches.stats().items():
+            for name, value in stats.items():
+                if name not in _CACHE_SETTINGS and isinstance(value, (int, float)):
+                    _publish_count(CACHE_EVENTS, (namespace, name), value)
+            if 'size' in stats:
+                CACHE_ENTRIES.labels(namespace).set(stats['size'])
+
+        hosts = {}
+        for url, stats in client.stats().items():
+            host = urlsplit(url).netloc
+            totals = hosts.setdefault(host, {'requests': 0, 'retries': 0, 'errors': 0, 'connections': 0})
+            for name in totals:
+                totals[name] += stats[name]
+            OUTBOUND_REUSE.labels(host).set(stats['reuse_ratio'])
+        for host, totals in hosts.items():
+            for kind in ('requests', 'retries', 'errors'):
+                _publish_count(OUTBOUND_REQUESTS, (host, kind), totals[kind])
+            _publish_count(OUTBOUND_CONNECTIONS, (host,), totals['connections'])
+
+        _publish_count(LOG_DROPPED, (), log_stats()['dropped'])
+
+
+def registry():
+    """All workers' metrics in multiprocess mode, else this process's"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+        return collected
+    return REGISTRY
+
+
+def metrics_view():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    publish_stats()
+    return Response(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Instrument `app`'s requests and SQL and serve GET /metrics"""
+    instrument_engines()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,9 @@
+-- Enforce case-insensitive uniqueness of usernames and emails (registration relies on these to detect conflicts)
+-- This fails if existing rows differ only by case; find them first with e.g.
+--   SELECT lower(email), count(*) FROM users GROUP BY 1 HAVING count(*) > 1;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_users_username_lower ON users (lower(username));
+CREATE UNIQUE INDEX IF NOT EXISTS ux_users_email_lower ON users (lower(email));
+
+-- Username allocation now matches prefixes of lower(username)
+DROP INDEX IF EXISTS ix_users_username_pattern;
+CREATE INDEX IF NOT EXISTS ix_users_username_lower_pattern ON users (lower(username) text_pattern_ops);
@@ -0,0 +1,2 @@
+-- Add token_version column to users table (bumped to revoke previously issued JWTs)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,2 @@
+-- Index usernames for prefix (LIKE 'name%') lookups used by username allocation
+CREATE INDEX IF NOT EXISTS ix_users_username_pattern ON users (username text_pattern_ops);
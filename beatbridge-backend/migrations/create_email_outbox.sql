@@ -0,0 +1,18 @@
+-- Create email_outbox table (queued mail delivered by the background outbox worker)
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id SERIAL PRIMARY KEY,
+    sender VARCHAR(255),
+    recipients TEXT NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT,
+    html TEXT,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL,
+    claimed_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL,
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_email_outbox_status_next_attempt_at ON email_outbox (status, next_attempt_at);
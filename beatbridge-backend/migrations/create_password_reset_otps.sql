@@ -0,0 +1,10 @@
+-- Create password_reset_otps table (shared OTP store for the password reset flow)
+CREATE TABLE IF NOT EXISTS password_reset_otps (
+    email VARCHAR(120) PRIMARY KEY,
+    code VARCHAR(16) NOT NULL,
+    verified BOOLEAN NOT NULL DEFAULT FALSE,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_password_reset_otps_expires_at ON password_reset_otps (expires_at);
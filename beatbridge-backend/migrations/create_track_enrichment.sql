@@ -0,0 +1,12 @@
+-- Create track_enrichment table (cached Last.fm track.getInfo results, including negative entries)
+CREATE TABLE IF NOT EXISTS track_enrichment (
+    artist_key VARCHAR(255) NOT NULL,
+    track_key VARCHAR(255) NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    info TEXT,
+    fetched_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (artist_key, track_key)
+);
+
+CREATE INDEX IF NOT EXISTS ix_track_enrichment_expires_at ON track_enrichment (expires_at);
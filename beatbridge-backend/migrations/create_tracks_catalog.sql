@@ -0,0 +1,23 @@
+-- Create tracks and track_tags tables (offline Last.fm catalog filled by `flask ingest-tracks`)
+CREATE TABLE IF NOT EXISTS tracks (
+    id SERIAL PRIMARY KEY,
+    url VARCHAR(512) NOT NULL UNIQUE,
+    name VARCHAR(255) NOT NULL,
+    artist VARCHAR(255) NOT NULL,
+    album VARCHAR(255),
+    listeners INTEGER NOT NULL DEFAULT 0,
+    duration INTEGER,
+    info TEXT NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_tracks_listeners ON tracks (listeners);
+
+CREATE TABLE IF NOT EXISTS track_tags (
+    track_id INTEGER NOT NULL REFERENCES tracks(id) ON DELETE CASCADE,
+    tag VARCHAR(100) NOT NULL,
+    rank INTEGER NOT NULL,
+    PRIMARY KEY (track_id, tag)
+);
+
+CREATE INDEX IF NOT EXISTS ix_track_tags_tag_rank ON track_tags (tag, rank);
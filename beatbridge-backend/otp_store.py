@@ -0,0 +1,225 @@
+"""
+Storage for password-reset OTPs.
+
+Codes expire after OTP_TTL_SECONDS and are dropped after OTP_MAX_ATTEMPTS wrong
+guesses. MemoryOTPStore keeps them in-process; SQLOTPStore keeps them in the
+password_reset_otps table so forgot/verify/reset work no matter which worker or
+instance each call lands on.
+"""
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+OTP_TTL_SECONDS = int(os.environ.get('OTP_TTL_SECONDS', 600))
+OTP_MAX_ATTEMPTS = int(os.environ.get('OTP_MAX_ATTEMPTS', 5))
+OTP_SWEEP_INTERVAL = int(os.environ.get('OTP_SWEEP_INTERVAL', 300))
+
+
+class OTPStore(ABC):
+    """Common interface; `verify` marks the code as used so `is_verified` gates the reset"""
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._sweeper = None
+
+    @abstractmethod
+    def put(self, email, code):
+        """Store a fresh code for email, replacing any earlier one and its attempt count"""
+
+    @abstractmethod
+    def get(self, email):
+        """Return the pending (unexpired, unverified) code for email, if any"""
+
+    @abstractmethod
+    def verify(self, email, code):
+        """Check a guess; True marks the entry verified, False counts an attempt"""
+
+    @abstractmethod
+    def is_verified(self, email):
+        """Whether email has a verified, unexpired code"""
+
+    @abstractmethod
+    def discard(self, email):
+        """Drop email's entry, verified or not"""
+
+    @abstractmethod
+    def sweep(self):
+        """Delete expired entries and return how many were removed"""
+
+    def start_sweeper(self, interval=OTP_SWEEP_INTERVAL):
+        """Sweep expired entries from a daemon thread every `interval` seconds"""
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error("OTP sweep error: %s", e)
+
+        self._sweeper = threading.Thread(target=run, name='otp-sweeper', daemon=True)
+        self._sweeper.start()
+
+
+class MemoryOTPStore(OTPStore):
+    """Per-process store; only correct when a single worker serves the reset flow"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries = {}  # email -> {'code', 'verified', 'attempts', 'expires_at'}
+        self._lock = threading.Lock()
+
+    def _live(self, email):
+        entry = self._entries.get(email)
+        if entry and entry['expires_at'] <= time.time():
+            del self._entries[email]
+            return None
+        return entry
+
+    def put(self, email, code):
+        with self._lock:
+            self._entries[email] = {
+                'code': code,
+                'verified': False,
+                'attempts': 0,
+                'expires_at': time.time() + self.ttl,
+            }
+
+    def get(self, email):
+        with self._lock:
+            entry = self._live(email)
+            return entry['code'] if entry and not entry['verified'] else None
+
+    def verify(self, email, code):
+        with self._lock:
+            entry = self._live(email)
+            if not entry or entry['verified']:
+                return False
+            if entry['code'] == code:
+                entry['verified'] = True
+                # Give the user a fresh window to choose the new password
+                entry['expires_at'] = time.time() + self.ttl
+                return True
+            entry['attempts'] += 1
+            if entry['attempts'] >= self.max_attempts:
+                del self._entries[email]
+            return False
+
+    def is_verified(self, email):
+        with self._lock:
+            entry = self._live(email)
+            return bool(entry and entry['verified'])
+
+    def discard(self, email):
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [email for email, entry in self._entries.items() if entry['expires_at'] <= now]
+            for email in expired:
+                del self._entries[email]
+        return len(expired)
+
+
+class SQLOTPStore(OTPStore):
+    """Store backed by the password_reset_otps table, shared by every worker using the database"""
+
+    def __init__(self, engine, **kwargs):
+        super().__init__(**kwargs)
+        self.engine = engine
+
+    def ensure_schema(self):
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS password_reset_otps (
+                    email VARCHAR(120) PRIMARY KEY,
+                    code VARCHAR(16) NOT NULL,
+                    verified BOOLEAN NOT NULL DEFAULT FALSE,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    expires_at TIMESTAMP NOT NULL
+                )
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_password_reset_otps_expires_at
+                ON password_reset_otps (expires_at)
+            """))
+
+    def _expiry(self):
+        return datetime.utcnow() + timedelta(seconds=self.ttl)
+
+    def put(self, email, code):
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO password_reset_otps (email, code, verified, attempts, expires_at)
+                VALUES (:email, :code, FALSE, 0, :expires_at)
+                ON CONFLICT (email) DO UPDATE SET
+                    code = excluded.code,
+                    verified = FALSE,
+                    attempts = 0,
+                    expires_at = excluded.expires_at
+            """), {'email': email, 'code': code, 'expires_at': self._expiry()})
+
+    def get(self, email):
+        with self.engine.connect() as conn:
+            return conn.execute(text("""
+                SELECT code FROM password_reset_otps
+                WHERE email = :email AND verified = FALSE AND expires_at > :now
+            """), {'email': email, 'now': datetime.utcnow()}).scalar()
+
+    def verify(self, email, code):
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            matched = conn.execute(text("""
+                UPDATE password_reset_otps
+                SET verified = TRUE, expires_at = :expires_at
+                WHERE email = :email AND code = :code AND verified = FALSE AND expires_at > :now
+            """), {'email': email, 'code': code, 'now': now, 'expires_at': self._expiry()}).rowcount
+            if matched:
+                return True
+            conn.execute(text("""
+                UPDATE password_reset_otps SET attempts = attempts + 1
+                WHERE email = :email AND verified = FALSE
+            """), {'email': email})
+            conn.execute(text("""
+                DELETE FROM password_reset_otps
+                WHERE email = :email AND verified = FALSE AND (attempts >= :max_attempts OR expires_at <= :now)
+            """), {'email': email, 'max_attempts': self.max_attempts, 'now': now})
+            return False
+
+    def is_verified(self, email):
+        with self.engine.connect() as conn:
+            return conn.execute(text("""
+                SELECT 1 FROM password_reset_otps
+                WHERE email = :email AND verified = TRUE AND expires_at > :now
+            """), {'email': email, 'now': datetime.utcnow()}).first() is not None
+
+    def discard(self, email):
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM password_reset_otps WHERE email = :email"), {'email': email})
+
+    def sweep(self):
+        with self.engine.begin() as conn:
+            return conn.execute(text("DELETE FROM password_reset_otps WHERE expires_at <= :now"),
+                                {'now': datetime.utcnow()}).rowcount
+
+
+def create_otp_store(backend, engine=None):
+    """Build the store selected by OTP_STORE ('memory' or 'sql')"""
+    if backend == 'memory':
+        return MemoryOTPStore()
+    if backend == 'sql':
+        store = SQLOTPStore(engine)
+        store.ensure_schema()
+        return store
+    raise ValueError(f"Unknown OTP store backend: {backend}")
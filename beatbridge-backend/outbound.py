@@ -0,0 +1,161 @@
+"""
+Shared HTTP client for every outbound call (Last.fm, Google).
+
+Each host gets its own requests.Session with a keep-alive connection pool
+sized to this worker's concurrency, so repeat calls reuse TCP/TLS
+connections instead of opening new ones. Idempotent requests (GET/HEAD) are
+retried with exponential backoff on connection errors and 502/503/504. Each
+attempt's timeout comes from the host's default unless the caller gives one,
+and is clamped to the current request's latency budget (see resilience.py).
+Per-host request counts and connection reuse are kept for stats(), and each
+attempt's latency and outcome is reported to metrics.py.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from resilience import budget_timeout, budget_exhausted, remaining_budget
+from metrics import observe_outbound
+
+# Connections kept alive per host; should cover the threads that call out at once
+OUTBOUND_POOL_SIZE = int(os.environ.get('OUTBOUND_POOL_SIZE', 16))
+OUTBOUND_TIMEOUT = float(os.environ.get('OUTBOUND_TIMEOUT', 5))
+OUTBOUND_RETRIES = int(os.environ.get('OUTBOUND_RETRIES', 2))
+OUTBOUND_BACKOFF = float(os.environ.get('OUTBOUND_BACKOFF', 0.2))
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+
+class HostPool:
+    """Session, settings and counters for one (scheme, host)"""
+
+    def __init__(self, name, timeout, pool_size):
+        self.name = name
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+
+    def connection_counts(self):
+        """(connections opened, requests sent) across this host's urllib3 pools"""
+        opened = sent = 0
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return opened, sent
+
+
+class OutboundClient:
+    """requests-style get/post/request over pooled per-host sessions"""
+
+    def __init__(self, timeout=OUTBOUND_TIMEOUT, pool_size=OUTBOUND_POOL_SIZE,
+                 retries=OUTBOUND_RETRIES, backoff=OUTBOUND_BACKOFF):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self._host_timeouts = {}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def configure(self, host, timeout):
+        """Default timeout for calls to `host` (e.g. 'ws.audioscrobbler.com') that don't pass one"""
+        with self._lock:
+            self._host_timeouts[host] = timeout
+            for (scheme, netloc), pool in self._hosts.items():
+                if netloc == host:
+                    pool.timeout = timeout
+
+    def _host(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with self._lock:
+            pool = self._hosts.get(key)
+            if pool is None:
+                pool = HostPool(parts.netloc, self._host_timeouts.get(parts.netloc, self.timeout), self.pool_size)
+                self._hosts[key] = pool
+            return pool
+
+    def request(self, method, url, timeout=None, **kwargs):
+        method = method.upper()
+        host = self._host(url)
+        timeout = timeout if timeout is not None else host.timeout
+        attempts = 1 + (self.retries if method in IDEMPOTENT_METHODS else 0)
+        for attempt in range(attempts):
+            clamped = budget_timeout(timeout)
+            with self._lock:
+                host.requests += 1
+                if attempt:
+                    host.retries += 1
+            started = time.perf_counter()
+            try:
+                response = host.session.request(method, url, timeout=clamped, **kwargs)
+            except requests.Timeout as e:
+                observe_outbound(host.name, time.perf_counter() - started, 'timeout')
+                if clamped < timeout:
+                    # Cut short by the request's budget, not by the remote side
+                    self._count_error(host)
+                    raise budget_exhausted(f"Latency budget exhausted waiting for {urlsplit(url).netloc}: {str(e)}") from e
+                if not self._retry(host, attempt, attempts):
+                    raise
+            except requests.ConnectionError:
+                observe_outbound(host.name, time.perf_counter() - started, 'error')
+                if not self._retry(host, attempt, attempts):
+                    raise
+            else:
+                observe_outbound(host.name, time.perf_counter() - started, f"{response.status_code // 100}xx")
+                if response.status_code in RETRY_STATUSES and attempt + 1 < attempts \
+                        and self._backoff(attempt):
+                    response.close()
+                    continue
+                return response
+
+    def _count_error(self, host):
+        with self._lock:
+            host.errors += 1
+
+    def _retry(self, host, attempt, attempts):
+        """Count a failed attempt; True (after backing off) if another attempt should follow"""
+        self._count_error(host)
+        return attempt + 1 < attempts and self._backoff(attempt)
+
+    def _backoff(self, attempt):
+        """Sleep before the next attempt, unless that would run past the request's budget"""
+        delay = self.backoff * (2 ** attempt)
+        if delay >= remaining_budget(default=float('inf')):
+            return False
+        time.sleep(delay)
+        return True
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Per-host request, retry and error counts, connections opened, and the share of requests that reused one"""
+        with self._lock:
+            hosts = list(self._hosts.items())
+        stats = {}
+        for (scheme, netloc), host in hosts:
+            opened, sent = host.connection_counts()
+            stats[f"{scheme}://{netloc}"] = {
+                'requests': host.requests,
+                'retries': host.retries,
+                'errors': host.errors,
+                'connections': opened,
+                'reuse_ratio': round(1 - opened / sent, 3) if sent else 0.0,
+            }
+        return stats
+
+
+client = OutboundClient()
@@ -0,0 +1,221 @@
+"""
+Durable email outbox.
+
+Request handlers INSERT messages into email_outbox as part of their own
+transaction and return. A delivery worker thread in each process claims due
+rows in batches, sends each batch over a single Flask-Mail connection, retries
+failures with exponential backoff and dead-letters messages that keep failing.
+Once a row is sent or dead its body is cleared (messages carry OTPs and
+verification codes), and the worker deletes such rows after
+OUTBOX_RETENTION_DAYS.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask_mail import Message
+from sqlalchemy import (MetaData, Table, Column, Integer, String, Text, DateTime, Index,
+                        text, bindparam)
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 20))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BACKOFF_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_SECONDS', 30))
+# Sent and dead rows (already stripped of their bodies) are deleted once this old
+OUTBOX_RETENTION_DAYS = float(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
+OUTBOX_PURGE_INTERVAL = 3600  # Seconds between purges in each worker
+# A row stuck in 'sending' this long (e.g. its worker died mid-batch) is claimed again
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=5)
+
+metadata = MetaData()
+email_outbox = Table(
+    'email_outbox', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('sender', String(255)),
+    Column('recipients', Text, nullable=False),  # Comma-separated
+    Column('subject', String(255), nullable=False),
+    Column('body', Text),
+    Column('html', Text),
+    Column('status', String(16), nullable=False, default='pending'),  # pending, sending, sent or dead
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('next_attempt_at', DateTime, nullable=False),
+    Column('claimed_at', DateTime),
+    Column('last_error', Text),
+    Column('created_at', DateTime, nullable=False),
+    Column('sent_at', DateTime),
+    Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+)
+
+
+def ensure_schema(engine):
+    metadata.create_all(engine, checkfirst=True)
+
+
+def enqueue(session, msg):
+    """Add a Flask-Mail Message to the outbox; it is sent once the caller's transaction commits"""
+    now = datetime.utcnow()
+    session.execute(text("""
+        INSERT INTO email_outbox (sender, recipients, subject, body, html, status, attempts, next_attempt_at, created_at)
+        VALUES (:sender, :recipients, :subject, :body, :html, 'pending', 0, :now, :now)
+    """), {
+        'sender': msg.sender if isinstance(msg.sender, str) or msg.sender is None else msg.sender[1],
+        'recipients': ','.join(msg.recipients),
+        'subject': msg.subject,
+        'body': msg.body,
+        'html': msg.html,
+        'now': now,
+    })
+
+
+class OutboxWorker:
+    """Background thread that delivers pending outbox rows"""
+
+    def __init__(self, app, mail, engine, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, backoff_seconds=OUTBOX_BACKOFF_SECONDS):
+        self.app = app
+        self.mail = mail
+        self.engine = engine
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_purge = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def wake(self):
+        """Deliver now instead of at the next poll (call after committing new messages)"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                delivered = self.run_once()
+                if self._last_purge is None or time.monotonic() - self._last_purge >= OUTBOX_PURGE_INTERVAL:
+                    self._last_purge = time.monotonic()
+                    self.purge()
+            except Exception as e:
+                logger.error("Email outbox error: %s", e)
+                delivered = 0
+            # Keep draining while full batches come back; otherwise wait for a wakeup or the next poll
+            if delivered < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self):
+        """Claim and deliver one batch; returns the number of rows processed"""
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        sent, failed = [], {}
+        with self.app.app_context():
+            try:
+                with self.mail.connect() as connection:
+                    for row in rows:
+                        try:
+                            connection.send(self._message(row))
+                            sent.append(row.id)
+                        except Exception as e:
+                            failed[row.id] = (row, str(e))
+            except Exception as e:
+                # Couldn't connect (or the connection dropped): everything not yet sent is retried
+                for row in rows:
+                    if row.id not in sent and row.id not in failed:
+                        failed[row.id] = (row, str(e))
+
+        self._record(sent, list(failed.values()))
+        return len(rows)
+
+    def purge(self, retention_days=OUTBOX_RETENTION_DAYS):
+        """Delete sent and dead rows older than retention_days; returns how many were removed"""
+        with self.engine.begin() as conn:
+            removed = conn.execute(text("""
+                DELETE FROM email_outbox WHERE status IN ('sent', 'dead') AND created_at < :before
+            """), {'before': datetime.utcnow() - timedelta(days=retention_days)}).rowcount
+        if removed:
+            logger.info("Email outbox: purged %d delivered or dead messages", removed)
+        return removed
+
+    def _message(self, row):
+        return Message(row.subject, sender=row.sender, recipients=row.recipients.split(','),
+                       body=row.body, html=row.html)
+
+    def _claim(self):
+        now = datetime.utcnow()
+        params = {'now': now, 'stale_before': now - OUTBOX_CLAIM_TIMEOUT, 'limit': self.batch_size}
+        due = """
+            (status = 'pending' AND next_attempt_at <= :now)
+            OR (status = 'sending' AND claimed_at <= :stale_before)
+        """
+        with self.engine.begin() as conn:
+            if self.engine.dialect.name == 'postgresql':
+                # One statement; SKIP LOCKED lets every worker claim a disjoint batch
+                return conn.execute(text(f"""
+                    UPDATE email_outbox SET status = 'sending', claimed_at = :now
+                    WHERE id IN (
+                        SELECT id FROM email_outbox WHERE {due}
+                        ORDER BY id LIMIT :limit
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, sender, recipients, subject, body, html, attempts
+                """), params).fetchall()
+
+            candidates = conn.execute(text(f"""
+                SELECT id, sender, recipients, subject, body, html, attempts
+                FROM email_outbox WHERE {due} ORDER BY id LIMIT :limit
+            """), params).fetchall()
+            claimed = []
+            for row in candidates:
+                # Re-check the predicate so only one worker wins each row
+                updated = conn.execute(text(f"""
+                    UPDATE email_outbox SET status = 'sending', claimed_at = :now
+                    WHERE id = :id AND ({due})
+                """), dict(params, id=row.id)).rowcount
+                if updated:
+                    claimed.append(row)
+            return claimed
+
+    def _record(self, sent, failed):
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            if sent:
+                conn.execute(text("""
+                    UPDATE email_outbox
+                    SET status = 'sent', sent_at = :now, claimed_at = NULL, last_error = NULL, body = NULL, html = NULL
+                    WHERE id IN :ids
+                """).bindparams(bindparam('ids', expanding=True)), {'now': now, 'ids': sent})
+            for row, error in failed:
+                attempts = row.attempts + 1
+                dead = attempts >= self.max_attempts
+                if dead:
+                    logger.error("Email outbox: giving up on message %s to %s: %s", row.id, row.recipients, error)
+                conn.execute(text("""
+                    UPDATE email_outbox
+                    SET status = :status, attempts = :attempts, next_attempt_at = :next_attempt_at,
+                        claimed_at = NULL, last_error = :error,
+                        body = CASE WHEN :dead THEN NULL ELSE body END,
+                        html = CASE WHEN :dead THEN NULL ELSE html END
+                    WHERE id = :id
+                """), {
+                    'dead': dead,
+                    'id': row.id,
+                    'status': 'dead' if dead else 'pending',
+                    'attempts': attempts,
+                    'next_attempt_at': now + timedelta(seconds=self.backoff_seconds * 2 ** (attempts - 1)),
+                    'error': error[:1000],
+                })
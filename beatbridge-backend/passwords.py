@@ -0,0 +1,77 @@
+"""
+Password hashing on a bounded thread pool.
+
+Key stretching is deliberately slow, and on sync gunicorn workers a burst of
+logins would otherwise pin every worker. Hashes run on a small per-process pool
+(hashlib releases the GIL while stretching) with a hard cap on pending work;
+once the cap is reached callers get HashingPoolSaturated and should answer 503
+instead of queueing behind everyone else.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
+import metrics
+
+# Cost policy for new hashes, in werkzeug's method syntax (e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1').
+# Stored hashes made with different parameters are re-hashed at the user's next successful login.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', 2))
+# Hashes allowed to wait for a free pool thread before new ones are rejected
+HASH_POOL_MAX_QUEUE = int(os.environ.get('HASH_POOL_MAX_QUEUE', 8))
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool already has the maximum amount of pending work"""
+
+
+class HashingPool:
+    """Runs hash functions on a fixed set of threads, rejecting work beyond `workers + max_queue`"""
+
+    def __init__(self, workers, max_queue):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn on the pool and wait for its result"""
+        if not self._slots.acquire(blocking=False):
+            metrics.HASH_REJECTED.inc()
+            raise HashingPoolSaturated()
+        metrics.HASH_QUEUE_DEPTH.inc()
+
+        def timed():
+            started_at = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.HASH_LATENCY.observe(time.perf_counter() - started_at)
+                metrics.HASH_QUEUE_DEPTH.dec()
+                self._slots.release()
+
+        return self._executor.submit(timed).result()
+
+
+hashing_pool = HashingPool(HASH_POOL_WORKERS, HASH_POOL_MAX_QUEUE)
+
+
+def hash_password(password):
+    """Hash a password with the configured cost policy"""
+    return hashing_pool.run(generate_password_hash, password, method=PASSWORD_HASH_METHOD)
+
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash"""
+    return hashing_pool.run(check_password_hash, pwhash, password)
+
+
+@lru_cache(maxsize=None)
+def _policy_prefix(method):
+    # werkzeug fills in default parameters (e.g. the pbkdf2 iteration count), so hash once to learn them
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def needs_rehash(pwhash):
+    """True if a stored hash was made with parameters other than the current policy"""
+    return pwhash.split('$', 1)[0] != _policy_prefix(PASSWORD_HASH_METHOD)
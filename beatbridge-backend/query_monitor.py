@@ -0,0 +1,151 @@
+"""
+N+1 and slow-query detection for request handlers.
+
+Every statement run while handling a request is fingerprinted (literals and
+bind placeholders become "?", IN lists collapse) from metrics.py's statement
+hook, which times it once for both modules, and each fingerprint is
+counted. A fingerprint run more than QUERY_REPEAT_THRESHOLD
+times in one request is the signature of a query in a Python loop; it is
+logged once per request with its count. Statements slower than
+QUERY_SLOW_MS are logged with their fingerprint and bind shape (parameter
+names and types, never values), so this is safe to leave on in production.
+
+QUERY_MONITOR (or the app's QUERY_MONITOR config) picks the mode: "log"
+(the default), "raise" or "off". Raise mode is for tests only, so N+1
+regressions fail the suite: it raises RepeatedQueries from after_request,
+once the view has already run and committed, so the client gets an error
+for a change that was made.
+"""
+import logging
+import os
+import re
+import threading
+from collections import Counter as FingerprintCounts
+from functools import lru_cache
+from flask import current_app, g
+from prometheus_client import Counter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUERY_MONITOR = os.environ.get('QUERY_MONITOR', 'log').lower()
+# Runs of one statement shape per request above which it's reported as an N+1
+QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+QUERY_SLOW_MS = float(os.environ.get('QUERY_SLOW_MS', 250))
+
+REPEATED_QUERIES = Counter('db_repeated_queries_total', 'Statement shapes repeated past the threshold in a request',
+                           ['route'])
+SLOW_QUERIES = Counter('db_slow_queries_total', 'Statements slower than QUERY_SLOW_MS', ['route'])
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"%\(\w+\)s|%s|\?|(?<!:):\w+")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class RepeatedQueries(Exception):
+    """A request ran the same statement shape more often than QUERY_REPEAT_THRESHOLD (raise mode)"""
+
+
+@lru_cache(maxsize=1024)  # Compiled statements repeat, so most lookups skip the regexes
+def fingerprint(statement):
+    """The statement with literals and placeholders as "?", IN lists collapsed and whitespace squeezed"""
+    statement = _LITERALS.sub('?', statement)
+    statement = _PLACEHOLDERS.sub('?', statement)
+    statement = _IN_LISTS.sub('(?)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+def _type_name(value):
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def bind_shape(parameters, executemany=False):
+    """Parameter names and types, without values (pass compiled parameters for names on positional drivers)"""
+    if executemany and parameters:
+        return f"{len(parameters)} x {bind_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return {name: _type_name(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_type_name(value) for value in parameters]
+    return _type_name(parameters)
+
+
+class RequestQueryLog:
+    """Fingerprint counts and findings for one request (statements may run on several threads)"""
+
+    def __init__(self, route):
+        self.route = route
+        self.counts = FingerprintCounts()
+        self.repeated = []
+        self._lock = threading.Lock()
+
+    def record(self, statement):
+        """Count a statement; True the first time its fingerprint passes the threshold"""
+        shape = fingerprint(statement)
+        with self._lock:
+            self.counts[shape] += 1
+            if self.counts[shape] == QUERY_REPEAT_THRESHOLD + 1:
+                self.repeated.append(shape)
+                return True
+        return False
+
+
+def _mode():
+    try:
+        return current_app.config.get('QUERY_MONITOR', QUERY_MONITOR)
+    except RuntimeError:
+        return QUERY_MONITOR  # Outside the app context
+
+
+def _current_log():
+    try:
+        return g.get('query_log')
+    except RuntimeError:
+        return None  # Outside a request (background threads, CLI)
+
+
+def _statement_finished(statement, parameters, context, executemany, seconds):
+    if _mode() == 'off':
+        return
+    elapsed_ms = seconds * 1000
+    log = _current_log()
+    route = log.route if log is not None else 'background'
+    if elapsed_ms > QUERY_SLOW_MS:
+        SLOW_QUERIES.labels(route).inc()
+        compiled = getattr(context, 'compiled_parameters', None)
+        if compiled:
+            shape = bind_shape(compiled if executemany else compiled[0], executemany)
+        else:
+            shape = bind_shape(parameters, executemany)
+        logger.warning("Slow query (%.0f ms) in %s", elapsed_ms, route, extra={
+            'fingerprint': fingerprint(statement), 'bind_shape': shape, 'duration_ms': round(elapsed_ms, 1)})
+    if log is not None and log.record(statement):
+        REPEATED_QUERIES.labels(route).inc()
+        logger.warning("Repeated query in %s: the same statement ran more than %d times", route,
+                       QUERY_REPEAT_THRESHOLD, extra={'fingerprint': fingerprint(statement)})
+
+
+def _start_request():
+    if _mode() != 'off':
+        g.query_log = RequestQueryLog(metrics.route_label())
+
+
+def _finish_request(response):
+    log = g.get('query_log')
+    if log is not None and log.repeated and _mode() == 'raise':
+        counts = ', '.join(f"{log.counts[shape]}x {shape}" for shape in log.repeated)
+        raise RepeatedQueries(f"{log.route} repeated queries: {counts}")
+    return response
+
+
+def init_app(app):
+    """Watch the SQL each of `app`'s requests runs"""
+    if app.config.get('QUERY_MONITOR', QUERY_MONITOR) == 'raise' and not app.testing:
+        logger.warning("QUERY_MONITOR=raise is meant for tests: it fails responses after their changes are committed")
+    metrics.instrument_engines()
+    metrics.on_statement(_statement_finished)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
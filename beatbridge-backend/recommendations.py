@@ -0,0 +1,33 @@
+"""
+Spreading a batch of song recommendations across several genres.
+
+Each requested genre gets an even share of the batch; a genre whose pool
+runs short hands the rest of its share to genres that still have tracks,
+and no track URL is picked twice (the same track can chart in two genres).
+"""
+
+
+def genre_quotas(genres, count):
+    """Split `count` picks across genres as evenly as possible; earlier genres take the remainder"""
+    base, extra = divmod(count, len(genres))
+    return {genre: base + (1 if i < extra else 0) for i, genre in enumerate(genres)}
+
+
+def spread_picks(genres, pools, count, pick):
+    """
+    Up to `count` (genre, track) pairs drawn from `pools` (genre -> track list).
+    pick(genre, pool, wanted, exclude) returns up to `wanted` tracks from the
+    pool whose URLs aren't in `exclude`.
+    """
+    picks, seen = [], set()
+    quotas = genre_quotas(genres, count)
+    for fill_shortfall in (False, True):
+        for genre in genres:
+            wanted = count - len(picks) if fill_shortfall else quotas[genre]
+            if wanted <= 0 or not pools.get(genre):
+                continue
+            for track in pick(genre, pools[genre], wanted, seen):
+                if track['url'] not in seen:
+                    seen.add(track['url'])
+                    picks.append((genre, track))
+    return picks
@@ -0,0 +1,253 @@
+"""
+Latency budgets and circuit breakers for outbound calls.
+
+A request decorated with @latency_budget(seconds) gets a deadline that every
+outbound call made for it shares: each call's timeout is clamped to what is
+left, and once it's spent further calls fail fast with BudgetExhausted. A
+CircuitBreaker opens after consecutive failures (timeouts included) so that
+while a dependency is down callers fail fast with CircuitOpen instead of
+waiting on it; after reset_timeout one trial call is let through to probe it.
+
+Background jobs that call out without a request behind them (e.g. the track
+enrichment prefill) pace themselves with a TokenBucket instead.
+
+Both exceptions are requests.RequestException subclasses, so code that
+already handles a failed Last.fm call handles them too. Callers that can fall
+back (e.g. to a stale pool) mark the request degraded.
+"""
+import contextvars
+import logging
+import threading
+import time
+from functools import wraps
+import requests
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundSkipped(requests.RequestException):
+    """An outbound call was not made (or was cut short) by our own limits rather than by the remote side"""
+
+
+class BudgetExhausted(OutboundSkipped, requests.Timeout):
+    """The request's latency budget ran out"""
+
+
+class CircuitOpen(OutboundSkipped, requests.ConnectionError):
+    """The dependency's circuit breaker is open"""
+
+
+class LatencyBudget:
+    """A deadline shared by every outbound call made for one request"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.exhausted = False
+        self.degraded = False
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, default):
+        """`default` clamped to the time left; raises BudgetExhausted if none is"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            self.exhaust()
+            raise BudgetExhausted(f"Latency budget of {self.seconds}s exhausted")
+        return min(default, remaining)
+
+    def exhaust(self):
+        if not self.exhausted:
+            self.exhausted = True
+            metrics.budget_event('exhausted')
+        self.degrade()
+
+    def degrade(self):
+        if not self.degraded:
+            self.degraded = True
+            metrics.budget_event('degraded')
+
+
+_current_budget = contextvars.ContextVar('latency_budget', default=None)
+
+
+def current_budget():
+    """The running request's LatencyBudget, or None outside a budgeted request"""
+    return _current_budget.get()
+
+
+def budget_timeout(default):
+    """Timeout for an outbound call: `default`, clamped to the current request's budget if there is one"""
+    budget = current_budget()
+    return default if budget is None else budget.timeout(default)
+
+
+def remaining_budget(default=None):
+    """Seconds left in the current request's budget (`default` outside a budgeted request)"""
+    budget = current_budget()
+    return default if budget is None else budget.remaining()
+
+
+def budget_exhausted(message):
+    """BudgetExhausted for a wait our budget cut short, recording the overrun on the current request"""
+    budget = current_budget()
+    if budget is not None:
+        budget.exhaust()
+    return BudgetExhausted(message)
+
+
+def mark_degraded():
+    budget = current_budget()
+    if budget is not None:
+        budget.degrade()
+
+
+def is_degraded():
+    budget = current_budget()
+    return budget is not None and budget.degraded
+
+
+def latency_budget(seconds):
+    """Route decorator giving each request a shared outbound latency budget"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            metrics.budget_event('budgets')
+            token = _current_budget.set(LatencyBudget(seconds))
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _current_budget.reset(token)
+        return decorated_function
+    return decorator
+
+
+def in_current_context(fn):
+    """Wrap fn to run in the caller's context, so work handed to a thread pool shares the request's budget"""
+    context = contextvars.copy_context()
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures -> half-open after `reset_timeout` seconds"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = None
+        self._set_state('closed')
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self.trips = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set_state('half_open')
+            self._trial_running = False
+        return self._state
+
+    def _set_state(self, state):
+        if state != self._state:
+            self._state = state
+            metrics.breaker_state(self.name, state)
+
+    def allow(self):
+        """Whether a call may go out now (in half-open state, only one trial call at a time)"""
+        with self._lock:
+            state = self._current_state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            metrics.BREAKER_REJECTED.labels(self.name).inc()
+            return False
+
+    def check(self):
+        """Raise CircuitOpen unless a call may go out now"""
+        if not self.allow():
+            mark_degraded()
+            raise CircuitOpen(f"{self.name} circuit is open")
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._failures = 0
+            self._set_state('closed')
+            self._trial_running = False
+
+    def record_skipped(self):
+        """The allowed call never got an answer for reasons of our own (e.g. the budget ran out)"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._failures += 1
+            self._trial_running = False
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self.trips += 1
+                    metrics.BREAKER_TRIPS.labels(self.name).inc()
+                    logger.warning("Circuit breaker %s opened after %d consecutive failures", self.name, self._failures)
+                self._set_state('open')
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'successes': self.successes,
+                'failures': self.failures,
+            }
+
+
+class TokenBucket:
+    """
+    Blocking rate limiter: acquire() waits for a token. Tokens refill at `rate`
+    per second up to `burst`, so callers average `rate` calls per second
+    however many threads share the bucket.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available; returns the seconds waited"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            self._tokens -= 1  # Goes negative while callers are waiting, which queues the next ones behind them
+        if wait:
+            self._sleep(wait)
+        return wait
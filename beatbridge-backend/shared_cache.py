@@ -0,0 +1,142 @@
+"""
+Cache tier shared by every worker process on a host.
+
+Entries live in a SQLite file in WAL mode (readers never block the writer),
+so a Last.fm response fetched by one gunicorn worker is reused by the others
+instead of each worker spending its own share of the rate budget. It sits
+under the in-process caches: read_through() checks here first and writes
+whatever it loads back here.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+SHARED_CACHE_PURGE_EVERY = 200  # Writes between deletes of expired rows
+
+
+class SharedCache:
+    """JSON values keyed by (namespace, key) in a SQLite file, with expiry and cross-process fetch locks"""
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.owner = uuid.uuid4().hex  # Identifies this process's lock leases
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock_waits = 0
+        self._ensure_schema()
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork (SQLite connections can't cross one)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_locks (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, namespace, key, default=None):
+        row = self._connection().execute(
+            "SELECT value FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time())
+        ).fetchone()
+        if row is None:
+            self._count('misses')
+            return default
+        self._count('hits')
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), time.time() + ttl)
+        )
+        self._count('writes')
+        if self.writes % SHARED_CACHE_PURGE_EVERY == 0:
+            conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+
+    def acquire(self, name, lease):
+        """Take the named lock for `lease` seconds unless another live owner holds it"""
+        now = time.time()
+        cursor = self._connection().execute("""
+            INSERT INTO cache_locks (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE cache_locks.expires_at <= ? OR cache_locks.owner = excluded.owner
+        """, (name, self.owner, now + lease, now))
+        return cursor.rowcount == 1
+
+    def release(self, name):
+        self._connection().execute("DELETE FROM cache_locks WHERE name = ? AND owner = ?", (name, self.owner))
+
+    def read_through(self, namespace, key, loader, ttl, lease=10.0):
+        """
+        Return the shared value, or call loader(key) and store its result.
+        While one process loads a key, the others wait (up to `lease` seconds)
+        for its result rather than loading it too. Falsy results aren't stored.
+        """
+        value = self.get(namespace, key)
+        if value is not None:
+            return value
+
+        lock_name = f"{namespace}:{key}"
+        deadline = time.monotonic() + lease
+        while not self.acquire(lock_name, lease):
+            self._count('lock_waits')
+            if time.monotonic() >= deadline:
+                break  # The holder is stuck; load it ourselves
+            time.sleep(0.05)
+            value = self.get(namespace, key)
+            if value is not None:
+                return value
+
+        try:
+            # Another process may have finished just before we got the lock
+            value = self.get(namespace, key)
+            if value is None:
+                value = loader(key)
+                if value:
+                    self.set(namespace, key, value, ttl)
+            return value
+        finally:
+            self.release(lock_name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'lock_waits': self.lock_waits,
+            }
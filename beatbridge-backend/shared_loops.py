@@ -0,0 +1,48 @@
+"""
+Batched lookups behind the shared-loops endpoints.
+
+Sharing checks that every selected jam belongs to the sender with one query,
+and accepting a share loads every recipient title a copy could clash with in
+one query, so both cost the same however many loops a share holds. A copy
+keeps its original's title unless the recipient already has a jam by that
+name (or an earlier copy from the same share took it); then it gets the first
+free "Title 2", "Title 3", …
+"""
+from sqlalchemy import column, or_, select, table
+from usernames import escape_like
+
+JAM_SESSIONS = table('jam_sessions', column('id'), column('user_id'), column('title'))
+
+
+def owned_jam_ids(session, user_id, jam_ids, jams=JAM_SESSIONS):
+    """The subset of jam_ids that belong to user_id"""
+    if not jam_ids:
+        return set()
+    return set(session.execute(
+        select(jams.c.id).where(jams.c.id.in_(jam_ids), jams.c.user_id == user_id)
+    ).scalars())
+
+
+def taken_titles(session, user_id, titles, jams=JAM_SESSIONS):
+    """user_id's jam titles equal to one of titles, or one of them followed by a space"""
+    titles = sorted(set(titles))
+    if not titles:
+        return set()
+    clashes = [jams.c.title.in_(titles)]
+    clashes += [jams.c.title.like(escape_like(title) + ' %', escape='\\') for title in titles]
+    return set(session.execute(
+        select(jams.c.title).where(jams.c.user_id == user_id, or_(*clashes))
+    ).scalars())
+
+
+def copy_titles(titles, taken):
+    """A free title for each of titles, in order; the ones handed out are added to taken"""
+    free = []
+    for title in titles:
+        candidate, counter = title, 1
+        while candidate in taken:
+            counter += 1
+            candidate = f"{title} {counter}"
+        taken.add(candidate)
+        free.append(candidate)
+    return free
@@ -10,8 +10,23 @@ from flask_cors import CORS
 # Add the parent directory to PYTHONPATH
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Keep password hashing cheap in tests (the production default is pbkdf2:sha256)
+os.environ.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+# Don't prefetch Last.fm genre pools or track details when a test imports app.py
+os.environ.setdefault('GENRE_POOL_WARMUP', 'False')
+os.environ.setdefault('ENRICHMENT_PREFILL', 'False')
+
 # Import the app factory and models
 from app_factory import create_app, db, User
+import lastfm
+from resilience import CircuitBreaker
+
+@pytest.fixture(autouse=True)
+def lastfm_breaker(monkeypatch):
+    """Give each test a closed Last.fm circuit breaker, so failures in one test can't trip another"""
+    breaker = CircuitBreaker('lastfm', lastfm.LASTFM_BREAKER_THRESHOLD, lastfm.LASTFM_BREAKER_RESET)
+    monkeypatch.setattr(lastfm, 'breaker', breaker)
+    return breaker
 
 @pytest.fixture
 def test_app():
@@ -27,7 +42,9 @@ def test_app():
         'MAIL_USE_TLS': True,
         'MAIL_USERNAME': 'test@test.com',
         'MAIL_PASSWORD': 'test_password',
-        'LASTFM_API_KEY': 'test_api_key'
+        'LASTFM_API_KEY': 'test_api_key',
+        # Fail any request that runs one statement in a loop
+        'QUERY_MONITOR': 'raise'
     })
     
     return app
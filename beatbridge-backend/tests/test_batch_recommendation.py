@@ -0,0 +1,99 @@
+import time
+import pytest
+import lastfm
+from loadtest.stubs import LastFMStub
+from recommendations import genre_quotas, spread_picks
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = LastFMStub().start()
+    monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', stub.url)
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def auth_headers(test_client):
+    test_client.post('/api/register', json={
+        'username': 'batchuser',
+        'email': 'batch@example.com',
+        'password': 'TestPass123!',
+        'confirmation': 'TestPass123!'
+    })
+    response = test_client.post('/api/login', json={'username': 'batchuser', 'password': 'TestPass123!'})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+
+def first_tracks(genre, pool, wanted, exclude):
+    return [t for t in pool if t['url'] not in exclude][:wanted]
+
+
+@pytest.mark.usefixtures('test_db')
+class TestBatchRecommendation:
+    """
+    Test suite for multi-genre batch recommendations:
+    - Per-genre quotas and shortfall redistribution
+    - No duplicate tracks across genres
+    - Pools for every genre fetched concurrently
+    - Input validation
+    """
+
+    def test_quotas_split_evenly(self):
+        """Test that earlier genres take the remainder of an uneven split"""
+        assert genre_quotas(['rock', 'jazz', 'pop'], 7) == {'rock': 3, 'jazz': 2, 'pop': 2}
+        assert genre_quotas(['rock', 'jazz'], 1) == {'rock': 1, 'jazz': 0}
+
+    def test_shortfall_moves_to_other_genres(self):
+        """Test that a genre with too few tracks hands its quota to the others"""
+        pools = {
+            'rock': [{'url': f'rock/{i}'} for i in range(10)],
+            'jazz': [{'url': 'jazz/0'}],
+            'pop': [],
+        }
+        picks = spread_picks(['rock', 'jazz', 'pop'], pools, 6, first_tracks)
+        assert [genre for genre, _ in picks] == ['rock', 'rock', 'jazz', 'rock', 'rock', 'rock']
+
+    def test_track_in_two_genres_is_picked_once(self):
+        """Test that a URL charting in several genres appears only once in a batch"""
+        shared = {'url': 'shared'}
+        pools = {'rock': [shared, {'url': 'rock/1'}], 'indie': [shared, {'url': 'indie/1'}]}
+        picks = spread_picks(['rock', 'indie'], pools, 4, first_tracks)
+        assert sorted(track['url'] for _, track in picks) == ['indie/1', 'rock/1', 'shared']
+
+    def test_batch_spans_genres(self, test_client, auth_headers, stub):
+        """Test that the endpoint returns `count` distinct tracks spread across the genres"""
+        response = test_client.post('/api/recommend-songs', headers=auth_headers,
+                                    json={'genres': ['rock', 'jazz', 'pop'], 'count': 8})
+        assert response.status_code == 200
+        data = response.get_json()
+        urls = [item['recommendation']['url'] for item in data['recommendations']]
+        assert len(urls) == len(set(urls)) == 8
+        assert data['genre_counts'] == {'rock': 3, 'jazz': 3, 'pop': 2}
+
+    def test_pools_are_fetched_concurrently(self, test_client, auth_headers, stub):
+        """Test that a batch over several genres costs about one pool fetch of latency"""
+        stub.latency = 0.3
+        started = time.monotonic()
+        response = test_client.post('/api/recommend-songs', headers=auth_headers,
+                                    json={'genres': ['rock', 'jazz', 'pop', 'metal'], 'count': 4})
+        assert response.status_code == 200
+        assert time.monotonic() - started < 4 * 0.3
+        assert stub.calls['tag.gettoptracks'] == 4 * lastfm.MAX_PAGES
+
+    @pytest.mark.parametrize('payload', [
+        {'genres': []},
+        {'genres': 'rock'},
+        {'genres': ['rock'], 'count': 0},
+        {'genres': ['rock'], 'count': 21},
+        {'genres': ['rock'], 'count': 'five'},
+    ])
+    def test_invalid_requests(self, test_client, auth_headers, payload):
+        """Test that bad genre lists and counts are rejected"""
+        response = test_client.post('/api/recommend-songs', headers=auth_headers, json=payload)
+        assert response.status_code == 400
+
+    def test_requires_authentication(self, test_client):
+        """Test that the batch endpoint requires a token"""
+        response = test_client.post('/api/recommend-songs', json={'genres': ['rock']})
+        assert response.status_code == 401
@@ -0,0 +1,153 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from cache import TTLCache, CacheRegistry, RefreshingCache
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestCache:
+    """
+    Test suite for the in-process caches:
+    - TTL expiry and LRU eviction
+    - Hit/miss/eviction counters
+    - Atomic updates under concurrency
+    - Namespaces with their own limits
+    - Stale-while-revalidate refreshes
+    """
+
+    def test_entries_expire(self):
+        """Test that entries are dropped once their TTL has passed"""
+        cache = TTLCache(ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=-1)
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.stats()['expirations'] == 1
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Test that the size limit evicts the entry read or written longest ago"""
+        cache = TTLCache(ttl=60, max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert len(cache) == 2
+
+        stats = cache.stats()
+        assert stats['evictions'] == 1
+        assert stats['hits'] == 3
+        assert stats['misses'] == 1
+
+    def test_update_is_atomic(self):
+        """Test that concurrent read-modify-write updates don't lose increments"""
+        cache = TTLCache(ttl=60)
+
+        def add_one(value):
+            time.sleep(0)  # Yield mid-update; a separate get/set would lose increments here
+            return (value or 0) + 1
+
+        def increment():
+            for _ in range(500):
+                cache.update('count', add_one)
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert cache.get('count') == 4000
+
+    def test_namespaces_have_their_own_limits(self):
+        """Test that each namespace keeps its own TTL, size limit and counters"""
+        registry = CacheRegistry()
+        pools = registry.namespace('pools', ttl=3600, max_size=1)
+        recent = registry.namespace('recent', ttl=60, max_size=10)
+        assert registry.namespace('pools', ttl=1) is pools
+
+        pools.set('rock', [1])
+        pools.set('jazz', [2])
+        recent.set(('user', 'rock'), {'url'})
+        assert pools.get('rock') is None
+        assert recent.get(('user', 'rock')) == {'url'}
+
+        stats = registry.stats()
+        assert stats['pools']['evictions'] == 1
+        assert stats['pools']['ttl'] == 3600
+        assert stats['recent']['size'] == 1
+
+    def test_stale_value_is_served_during_single_refresh(self):
+        """Test that expired values are returned at once while one background load replaces them"""
+        release = threading.Event()
+        loads = []
+
+        def loader(key):
+            loads.append(key)
+            if len(loads) > 1:
+                release.wait(5)
+            return f'{key}-v{len(loads)}'
+
+        cache = RefreshingCache(loader, ttl=-1, stale_ttl=60, cache=TTLCache(60),
+                                executor=ThreadPoolExecutor(max_workers=2))
+        assert cache.get('rock') == 'rock-v1'
+
+        # Expired: every caller gets the stale value, and only one refresh starts
+        for _ in range(5):
+            assert cache.get('rock') == 'rock-v1'
+        wait_for(lambda: len(loads) == 2)
+        assert cache.get('rock') == 'rock-v1'
+        assert cache.stats()['inflight'] == 1
+
+        release.set()
+        wait_for(lambda: not cache.stats()['inflight'])
+        assert cache.get('rock') == 'rock-v2'
+        assert len(loads) == 2
+
+    def test_cold_callers_share_one_load(self):
+        """Test that concurrent misses wait on a single load"""
+        calls = []
+
+        def loader(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return [key]
+
+        cache = RefreshingCache(loader, ttl=60, stale_ttl=60, cache=TTLCache(120),
+                                executor=ThreadPoolExecutor(max_workers=4))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('jazz'))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [['jazz']] * 5
+        assert calls == ['jazz']
+
+    def test_failed_refresh_keeps_stale_value(self):
+        """Test that a failing refresh keeps the old value and backs off"""
+        responses = [['v1'], ConnectionError('down')]
+
+        def loader(key):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        cache = RefreshingCache(loader, ttl=-1, stale_ttl=60, cache=TTLCache(60), retry_after=60,
+                                executor=ThreadPoolExecutor(max_workers=1))
+        assert cache.get('pop') == ['v1']
+        with pytest.raises(ConnectionError):
+            cache._load_async('pop').result()
+        assert cache.get('pop') == ['v1']
+        # Backing off: no new load was started
+        assert cache.stats()['inflight'] == 0
+        assert cache.stats()['refresh_failures'] == 1
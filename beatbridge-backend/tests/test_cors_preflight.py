@@ -0,0 +1,83 @@
+import pytest
+from flask import Flask, jsonify
+from werkzeug.test import Client
+from cors_preflight import CORSPolicy, CORSMiddleware
+
+ORIGINS = ['http://localhost:3000', 'https://beatbridge2.netlify.app']
+PATTERNS = [r"https://[a-z0-9-]+--beatbridge2\.netlify\.app"]
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def client(calls):
+    app = Flask(__name__)
+
+    @app.before_request
+    def count():
+        calls.append(1)
+
+    @app.route('/api/user', methods=['GET', 'POST', 'OPTIONS'])
+    def user():
+        return jsonify({'ok': True})
+
+    app.wsgi_app = CORSMiddleware(app.wsgi_app, CORSPolicy(ORIGINS, PATTERNS, max_age=600))
+    return Client(app)
+
+
+def preflight(client, origin):
+    return client.options('/api/user', headers={
+        'Origin': origin,
+        'Access-Control-Request-Method': 'POST',
+        'Access-Control-Request-Headers': 'Authorization',
+    })
+
+
+class TestCORSPreflight:
+    """
+    Test suite for the CORS middleware:
+    - Preflights are answered without reaching Flask and are cacheable
+    - Exact and pattern-matched origins are allowed, others aren't
+    - Regular responses carry the origin's headers and Vary: Origin
+    """
+
+    def test_preflight_short_circuits(self, client, calls):
+        """Test that an allowed origin's preflight gets a 204 with max-age and never reaches the app"""
+        response = preflight(client, 'http://localhost:3000')
+        assert response.status_code == 204
+        assert response.headers['Access-Control-Allow-Origin'] == 'http://localhost:3000'
+        assert response.headers['Access-Control-Allow-Credentials'] == 'true'
+        assert 'Authorization' in response.headers['Access-Control-Allow-Headers']
+        assert response.headers['Access-Control-Max-Age'] == '600'
+        assert calls == []
+
+    def test_preview_deploys_match_patterns(self, client):
+        """Test that preview URLs are allowed by pattern while look-alikes aren't"""
+        response = preflight(client, 'https://deploy-preview-42--beatbridge2.netlify.app')
+        assert response.headers['Access-Control-Allow-Origin'] == 'https://deploy-preview-42--beatbridge2.netlify.app'
+        for origin in ['https://evil.example', 'https://x--beatbridge2.netlify.app.evil.example']:
+            response = preflight(client, origin)
+            assert response.status_code == 204
+            assert 'Access-Control-Allow-Origin' not in response.headers
+            assert 'Access-Control-Max-Age' not in response.headers
+
+    def test_responses_get_cors_headers(self, client, calls):
+        """Test that regular requests reach the app and come back with the origin's headers"""
+        response = client.get('/api/user', headers={'Origin': 'https://beatbridge2.netlify.app'})
+        assert response.status_code == 200
+        assert response.headers['Access-Control-Allow-Origin'] == 'https://beatbridge2.netlify.app'
+        assert response.headers['Vary'] == 'Origin'
+        assert calls == [1]
+
+        response = client.get('/api/user', headers={'Origin': 'https://evil.example'})
+        assert 'Access-Control-Allow-Origin' not in response.headers
+        assert 'Access-Control-Allow-Credentials' not in response.headers
+
+    def test_origin_headers_are_built_once(self):
+        """Test that each origin's headers are prebuilt and reused"""
+        policy = CORSPolicy(ORIGINS, PATTERNS)
+        assert policy.headers('http://localhost:3000') is policy.headers('http://localhost:3000')
+        assert policy.headers('https://evil.example') is None
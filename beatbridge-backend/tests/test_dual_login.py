@@ -65,4 +65,36 @@ class TestDualLogin:
         assert response.status_code == 400
         data = json.loads(response.data)
         assert 'error' in data
-        assert data['error'] == 'New password is required' 
\ No newline at end of file
+        assert data['error'] == 'New password is required' 
+
+    def test_set_password_revokes_existing_tokens(self, test_client):
+        """Test that setting a password revokes old tokens and returns a fresh one"""
+        test_client.post('/api/register',
+                        json={
+                            'username': 'testuser',
+                            'email': 'test@example.com',
+                            'password': 'TestPass123!',
+                            'confirmation': 'TestPass123!'
+                        })
+
+        login_response = test_client.post('/api/login',
+                                        json={
+                                            'username': 'testuser',
+                                            'password': 'TestPass123!'
+                                        })
+        old_token = json.loads(login_response.data)['access_token']
+
+        response = test_client.post('/api/set-password',
+                                  json={'new_password': 'NewPassword123!'},
+                                  headers={'Authorization': f'Bearer {old_token}'})
+        assert response.status_code == 200
+        new_token = json.loads(response.data)['token']
+
+        # The token issued before the password change is no longer accepted
+        response = test_client.get('/api/favorites', headers={'Authorization': f'Bearer {old_token}'})
+        assert response.status_code == 401
+        assert json.loads(response.data)['error'] == 'Token has been revoked'
+
+        # The refreshed token works
+        response = test_client.get('/api/favorites', headers={'Authorization': f'Bearer {new_token}'})
+        assert response.status_code == 200
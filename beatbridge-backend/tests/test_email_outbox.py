@@ -0,0 +1,149 @@
+import pytest
+from datetime import datetime, timedelta
+from flask import Flask
+from flask_mail import Mail, Message
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from loadtest.stubs import SMTPSink
+import outbox
+
+
+@pytest.fixture
+def sink():
+    sink = SMTPSink().start()
+    yield sink
+    sink.stop()
+
+
+def make_worker(tmp_path, port, **kwargs):
+    """Outbox worker on a sqlite file, mailing to localhost:port"""
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False,
+                      MAIL_USERNAME='sender@test.com', MAIL_PASSWORD='secret')
+    engine = create_engine(f"sqlite:///{tmp_path / 'outbox.db'}")
+    outbox.ensure_schema(engine)
+    return outbox.OutboxWorker(app, Mail(app), engine, **kwargs)
+
+
+def queue(engine, count):
+    with Session(engine) as session:
+        for i in range(count):
+            outbox.enqueue(session, Message(f'Message {i}', sender='sender@test.com',
+                                            recipients=[f'user{i}@test.com'], body=f'Your code is: 10000{i}'))
+        session.commit()
+
+
+def statuses(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT status, attempts, last_error FROM email_outbox ORDER BY id")).fetchall()
+
+
+class TestEmailOutbox:
+    """
+    Test suite for the email outbox:
+    - Batched delivery over one SMTP connection
+    - Retry with backoff
+    - Dead-lettering
+    - Reclaiming rows from a dead worker
+    - Clearing delivered bodies and purging old rows
+    """
+
+    def test_batch_is_sent_over_one_connection(self, tmp_path, sink):
+        """Test that queued messages are delivered in a batch over a single SMTP connection"""
+        worker = make_worker(tmp_path, sink.port, batch_size=10)
+        queue(worker.engine, 3)
+        assert sink.messages == []
+
+        assert worker.run_once() == 3
+        assert sink.connections == 1
+        assert sorted(m['to'][0] for m in sink.messages) == ['user0@test.com', 'user1@test.com', 'user2@test.com']
+        assert sink.find_code('user1@test.com', timeout=0.1) == '100001'
+        assert [row.status for row in statuses(worker.engine)] == ['sent'] * 3
+
+        # Nothing is sent twice
+        assert worker.run_once() == 0
+        assert len(sink.messages) == 3
+
+    def test_failed_delivery_is_retried_with_backoff(self, tmp_path, sink):
+        """Test that a failed send is rescheduled and goes out on a later attempt"""
+        port = sink.port
+        sink.stop()
+        worker = make_worker(tmp_path, port, backoff_seconds=60)
+        queue(worker.engine, 1)
+
+        assert worker.run_once() == 1
+        row = statuses(worker.engine)[0]
+        assert row.status == 'pending'
+        assert row.attempts == 1
+        assert row.last_error
+        # Not due again until the backoff has passed
+        assert worker.run_once() == 0
+
+        with worker.engine.begin() as conn:
+            conn.execute(text("UPDATE email_outbox SET next_attempt_at = created_at"))
+        retry_sink = SMTPSink(port=port).start()
+        try:
+            assert worker.run_once() == 1
+            assert len(retry_sink.messages) == 1
+            assert statuses(worker.engine)[0].status == 'sent'
+        finally:
+            retry_sink.stop()
+
+    def test_message_is_dead_lettered_after_max_attempts(self, tmp_path, sink):
+        """Test that a message stops being retried once it reaches the attempt limit"""
+        port = sink.port
+        sink.stop()
+        worker = make_worker(tmp_path, port, max_attempts=2, backoff_seconds=0)
+        queue(worker.engine, 1)
+
+        assert worker.run_once() == 1
+        assert worker.run_once() == 1
+        row = statuses(worker.engine)[0]
+        assert row.status == 'dead'
+        assert row.attempts == 2
+        assert worker.run_once() == 0
+
+    def test_stale_claims_are_reclaimed(self, tmp_path, sink):
+        """Test that rows left 'sending' by a crashed worker are picked up again"""
+        worker = make_worker(tmp_path, sink.port)
+        queue(worker.engine, 1)
+        with worker.engine.begin() as conn:
+            conn.execute(text("UPDATE email_outbox SET status = 'sending', claimed_at = created_at"))
+        assert worker.run_once() == 0
+
+        with worker.engine.begin() as conn:
+            conn.execute(text("UPDATE email_outbox SET claimed_at = :old"),
+                         {'old': datetime.utcnow() - 2 * outbox.OUTBOX_CLAIM_TIMEOUT})
+        assert worker.run_once() == 1
+        assert len(sink.messages) == 1
+
+    def test_sent_bodies_are_cleared_and_old_rows_purged(self, tmp_path, sink):
+        """Test that codes don't outlive delivery and finished rows are deleted after the retention period"""
+        worker = make_worker(tmp_path, sink.port)
+        queue(worker.engine, 2)
+        assert worker.run_once() == 2
+        with worker.engine.begin() as conn:
+            conn.execute(text("UPDATE email_outbox SET status = 'dead' WHERE id = 2"))
+        queue(worker.engine, 1)
+        with worker.engine.connect() as conn:
+            rows = conn.execute(text("SELECT status, body, html FROM email_outbox ORDER BY id")).fetchall()
+        assert (rows[0].status, rows[0].body, rows[0].html) == ('sent', None, None)
+        assert rows[2].status == 'pending' and rows[2].body
+
+        assert worker.purge() == 0
+        with worker.engine.begin() as conn:
+            conn.execute(text("UPDATE email_outbox SET created_at = :old"),
+                         {'old': datetime.utcnow() - timedelta(days=outbox.OUTBOX_RETENTION_DAYS + 1)})
+        assert worker.purge() == 2
+        assert [row.status for row in statuses(worker.engine)] == ['pending']
+
+    def test_dead_letter_body_is_cleared(self, tmp_path, sink):
+        """Test that a message given up on no longer holds its body"""
+        port = sink.port
+        sink.stop()
+        worker = make_worker(tmp_path, port, max_attempts=1)
+        queue(worker.engine, 1)
+        assert worker.run_once() == 1
+        with worker.engine.connect() as conn:
+            row = conn.execute(text("SELECT status, body FROM email_outbox")).first()
+        assert (row.status, row.body) == ('dead', None)
@@ -0,0 +1,73 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import fanout
+from resilience import BudgetExhausted, budget_timeout, latency_budget
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+def slow(seconds):
+    def call(item):
+        time.sleep(seconds[item])
+        return item
+    return call
+
+
+class TestFanout:
+    """
+    Test suite for concurrent fan-out from sync views:
+    - Independent calls overlap, so the slowest bounds the wait
+    - The first acceptable result wins, with later items as fallbacks
+    - Blocking calls share the request's latency budget
+    """
+
+    def test_calls_overlap(self, executor):
+        """Test that three 0.2s calls finish together in about 0.2s, in item order"""
+        started = time.monotonic()
+        results = fanout.run(fanout.gather_in_threads(executor, slow({'a': 0.2, 'b': 0.2, 'c': 0.2}), ['a', 'b', 'c']))
+        assert results == ['a', 'b', 'c']
+        assert time.monotonic() - started < 0.35
+
+    def test_first_result_prefers_earlier_items(self, executor):
+        """Test that an accepted first item wins without waiting on slower fallbacks"""
+        started = time.monotonic()
+        assert fanout.run(fanout.first_result(executor, slow({'a': 0.05, 'b': 0.5}), ['a', 'b'],
+                                              lambda result: True)) == ('a', 'a')
+        assert time.monotonic() - started < 0.3
+
+    def test_first_result_falls_back_concurrently(self, executor):
+        """Test that a rejected first item costs the slowest call, not a second round trip"""
+        started = time.monotonic()
+        result = fanout.run(fanout.first_result(executor, slow({'a': 0.2, 'b': 0.2}), ['a', 'b'],
+                                                lambda result: result == 'b'))
+        assert result == ('b', 'b')
+        assert time.monotonic() - started < 0.35
+
+        assert fanout.run(fanout.first_result(executor, slow({'a': 0, 'b': 0}), ['a', 'b'],
+                                              lambda result: False)) == ('a', 'a')
+
+    def test_exceptions_propagate(self, executor):
+        """Test that a failing call raises from the sync caller, or is returned when asked"""
+        def fail(item):
+            raise ValueError(item)
+
+        with pytest.raises(ValueError):
+            fanout.run(fanout.gather_in_threads(executor, fail, ['a']))
+        results = fanout.run(fanout.gather_in_threads(executor, fail, ['a'], return_exceptions=True))
+        assert isinstance(results[0], ValueError)
+
+    def test_budget_is_shared_with_threads(self, executor):
+        """Test that calls fanned out from a budgeted request see its deadline"""
+        @latency_budget(0.1)
+        def request():
+            time.sleep(0.15)
+            return fanout.run(fanout.gather_in_threads(executor, budget_timeout, [5], return_exceptions=True))
+
+        assert isinstance(request()[0], BudgetExhausted)
+        assert fanout.run(fanout.gather_in_threads(executor, budget_timeout, [5])) == [5]
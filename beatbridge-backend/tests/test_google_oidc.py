@@ -0,0 +1,143 @@
+import time
+import pytest
+import rsa
+from google.auth import crypt, jwt as google_jwt
+import google_oidc
+from google_oidc import GoogleOIDC, OIDCUnavailable, cache_lifetime
+
+
+class FakeResponse:
+    def __init__(self, payload, headers):
+        self.payload = payload
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """Serves fixed documents per URL and records every request"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.requests = []
+
+    def get(self, url, timeout=None):
+        self.requests.append(url)
+        payload, headers = self.documents[url]
+        if isinstance(payload, Exception):
+            raise payload
+        return FakeResponse(payload, headers)
+
+
+def make_key(key_id):
+    public_key, private_key = rsa.newkeys(512)
+    signer = crypt.RSASigner.from_string(private_key.save_pkcs1().decode(), key_id=key_id)
+    return signer, public_key.save_pkcs1().decode()
+
+
+def make_token(signer, **claims):
+    now = int(time.time())
+    payload = {'iss': 'https://accounts.google.com', 'aud': 'client-id', 'sub': '123',
+               'email': 'test@example.com', 'iat': now, 'exp': now + 300}
+    payload.update(claims)
+    return google_jwt.encode(signer, payload).decode()
+
+
+@pytest.fixture
+def oidc():
+    session = FakeSession({
+        'https://discovery': ({'token_endpoint': 'https://token'}, {'Cache-Control': 'public, max-age=3600'}),
+        'https://certs': ({}, {'Cache-Control': 'public, max-age=20000'}),
+    })
+    oidc = GoogleOIDC('client-id', 'secret', session=session,
+                      discovery_url='https://discovery', certs_url='https://certs')
+    yield oidc
+    for document in (oidc.discovery, oidc.certs):
+        if document._timer:
+            document._timer.cancel()
+
+
+class TestGoogleOIDC:
+    """
+    Test suite for the cached Google OIDC client:
+    - Cache lifetimes from HTTP headers
+    - Serving discovery and certs from cache
+    - Key rotation and stale fallback
+    - ID token verification
+    - Certificate outages reported as OIDCUnavailable
+    """
+
+    def test_cache_lifetime_from_headers(self):
+        """Test max-age, Age, Expires and no-store handling"""
+        assert cache_lifetime({'Cache-Control': 'public, max-age=19845, must-revalidate'}) == 19845
+        assert cache_lifetime({'Cache-Control': 'max-age=600', 'Age': '100'}) == 500
+        assert cache_lifetime({'Cache-Control': 'no-store'}) == 0
+        assert cache_lifetime({'Date': 'Mon, 01 Jan 2024 00:00:00 GMT',
+                               'Expires': 'Mon, 01 Jan 2024 01:00:00 GMT'}) == 3600
+        assert cache_lifetime({}, default=42) == 42
+
+    def test_discovery_is_fetched_once(self, oidc):
+        """Test that repeated sign-ins reuse the cached discovery document"""
+        for _ in range(5):
+            assert oidc.provider_config()['token_endpoint'] == 'https://token'
+        assert oidc.session.requests == ['https://discovery']
+
+    def test_background_refresh_is_scheduled_before_expiry(self, oidc):
+        """Test that a refresh is scheduled at a fraction of the cache lifetime"""
+        oidc.provider_config()
+        assert oidc.discovery._timer.interval == pytest.approx(3600 * google_oidc.OIDC_REFRESH_AT)
+
+    def test_verify_id_token(self, oidc):
+        """Test that valid tokens verify from cached certs and bad ones are rejected"""
+        signer, cert = make_key('key-1')
+        oidc.session.documents['https://certs'] = ({'key-1': cert}, {'Cache-Control': 'max-age=20000'})
+
+        for _ in range(3):
+            assert oidc.verify_id_token(make_token(signer))['email'] == 'test@example.com'
+        assert oidc.session.requests == ['https://certs']
+
+        with pytest.raises(ValueError):
+            oidc.verify_id_token(make_token(signer, aud='someone-else'))
+        with pytest.raises(ValueError):
+            oidc.verify_id_token(make_token(signer, iss='https://evil.example'))
+        with pytest.raises(ValueError):
+            oidc.verify_id_token(make_token(signer, exp=int(time.time()) - 3600))
+
+    def test_unknown_key_id_refetches_certs(self, oidc):
+        """Test that a token signed with a rotated-in key triggers a cert refresh"""
+        old_signer, old_cert = make_key('old')
+        new_signer, new_cert = make_key('new')
+        oidc.session.documents['https://certs'] = ({'old': old_cert}, {'Cache-Control': 'max-age=20000'})
+        oidc.verify_id_token(make_token(old_signer))
+
+        oidc.session.documents['https://certs'] = ({'old': old_cert, 'new': new_cert},
+                                                   {'Cache-Control': 'max-age=20000'})
+        oidc.certs._fetched_at -= google_oidc.OIDC_MIN_MAX_AGE
+        assert oidc.verify_id_token(make_token(new_signer))['sub'] == '123'
+        assert oidc.session.requests == ['https://certs', 'https://certs']
+
+    def test_stale_copy_is_served_when_refresh_fails(self, oidc):
+        """Test that an expired document is still served if Google can't be reached"""
+        oidc.provider_config()
+        oidc.discovery._expires_at = 0
+        oidc.session.documents['https://discovery'] = (ConnectionError('unreachable'), {})
+        assert oidc.provider_config()['token_endpoint'] == 'https://token'
+
+    def test_certs_outage_is_a_value_error(self, oidc):
+        """Test that failing to fetch or refresh certs raises OIDCUnavailable, not a network error"""
+        signer, cert = make_key('key-1')
+        oidc.session.documents['https://certs'] = (ConnectionError('unreachable'), {})
+        with pytest.raises(OIDCUnavailable):
+            oidc.verify_id_token(make_token(signer))
+
+        rotated_signer, _ = make_key('key-2')
+        oidc.session.documents['https://certs'] = ({'key-1': cert}, {'Cache-Control': 'max-age=20000'})
+        oidc.verify_id_token(make_token(signer))
+        oidc.session.documents['https://certs'] = (ConnectionError('unreachable'), {})
+        oidc.certs._fetched_at -= google_oidc.OIDC_MIN_MAX_AGE
+        with pytest.raises(OIDCUnavailable):
+            oidc.verify_id_token(make_token(rotated_signer))
@@ -0,0 +1,94 @@
+import pytest
+from flask import Flask, jsonify
+from http_cache import cache_policy, apply_policy
+
+
+@pytest.fixture
+def auth_headers(test_client):
+    test_client.post('/api/register', json={
+        'username': 'cacheuser',
+        'email': 'cache@example.com',
+        'password': 'TestPass123!',
+        'confirmation': 'TestPass123!'
+    })
+    response = test_client.post('/api/login', json={'username': 'cacheuser', 'password': 'TestPass123!'})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+
+@pytest.fixture
+def jam_id(test_client, auth_headers):
+    response = test_client.post('/api/jam-sessions', headers=auth_headers, json={
+        'title': 'Cached Jam',
+        'pattern_json': [[1, 0, 1, 0]],
+        'is_public': True,
+        'bpm': 120
+    })
+    return response.get_json()['jam_id']
+
+
+@pytest.mark.usefixtures('test_db')
+class TestHttpCache:
+    """
+    Test suite for per-route HTTP caching:
+    - Routes without a policy stay no-store
+    - Declared policies set Cache-Control and a strong ETag
+    - If-None-Match is answered with 304, before the view runs when the route has a version
+    - Changing the resource changes its ETag
+    """
+
+    def test_routes_without_policy_are_not_cached(self, test_client):
+        """Test that undeclared routes and error responses keep no-store"""
+        response = test_client.get('/api/favorites')
+        assert response.headers['Cache-Control'] == 'no-cache, no-store, must-revalidate'
+        assert 'ETag' not in response.headers
+
+        response = test_client.get('/api/jam-sessions/999')
+        assert response.status_code == 404
+        assert response.headers['Cache-Control'] == 'no-cache, no-store, must-revalidate'
+
+    def test_genres_are_publicly_cacheable(self, test_client):
+        """Test that the static genre list gets a long max-age and revalidates by body hash"""
+        response = test_client.get('/api/genres')
+        assert response.headers['Cache-Control'] == 'public, max-age=86400'
+        etag = response.headers['ETag']
+        assert not etag.startswith('W/')
+
+        response = test_client.get('/api/genres', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+
+    def test_jam_session_revalidates_until_updated(self, test_client, auth_headers, jam_id):
+        """Test that a jam session answers 304 until it's edited, then serves the new version"""
+        response = test_client.get(f'/api/jam-sessions/{jam_id}')
+        assert response.headers['Cache-Control'] == 'public, no-cache'
+        etag = response.headers['ETag']
+        assert test_client.get(f'/api/jam-sessions/{jam_id}', headers={'If-None-Match': etag}).status_code == 304
+
+        test_client.put(f'/api/jam-sessions/{jam_id}', headers=auth_headers, json={
+            'title': 'Edited Jam',
+            'pattern_json': [[1, 1, 1, 1]]
+        })
+        response = test_client.get(f'/api/jam-sessions/{jam_id}', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.get_json()['title'] == 'Edited Jam'
+        assert response.headers['ETag'] != etag
+
+    def test_version_check_skips_the_view(self):
+        """Test that a matching version answers 304 without running the view"""
+        app = Flask(__name__)
+        app.after_request(apply_policy)
+        calls = []
+
+        @app.route('/items/<int:item_id>')
+        @cache_policy(max_age=60, immutable=True, version=lambda item_id: f"v{item_id}")
+        def item(item_id):
+            calls.append(item_id)
+            return jsonify({'id': item_id})
+
+        client = app.test_client()
+        response = client.get('/items/1')
+        assert response.headers['Cache-Control'] == 'private, max-age=60, immutable'
+        response = client.get('/items/1', headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+        assert calls == [1]
@@ -0,0 +1,70 @@
+import time
+import pytest
+import requests
+import lastfm
+from loadtest.stubs import LastFMStub
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = LastFMStub(tracks_per_genre=140).start()
+    monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', stub.url)
+    yield stub
+    stub.stop()
+
+
+class TestGenrePool:
+    """
+    Test suite for building Last.fm genre pools:
+    - Every page is fetched
+    - Pages are fetched concurrently
+    - Tracks are deduplicated by URL
+    - Partial and total failures
+    """
+
+    def test_pool_contains_all_pages(self, stub):
+        """Test that the pool holds the tracks from every page in chart order"""
+        pool = lastfm.fetch_genre_pool('rock')
+        assert len(pool) == 140
+        assert pool[0]['name'] == 'rock track 0'
+        assert pool[-1]['name'] == 'rock track 139'
+        assert stub.calls == {'tag.gettoptracks': lastfm.MAX_PAGES}
+
+    def test_pages_are_fetched_concurrently(self, stub):
+        """Test that a cold pool costs about one request's latency, not one per page"""
+        stub.latency = 0.3
+        started = time.perf_counter()
+        lastfm.fetch_genre_pool('jazz')
+        assert time.perf_counter() - started < 0.3 * lastfm.MAX_PAGES - 0.2
+
+    def test_duplicate_tracks_are_dropped(self, stub, monkeypatch):
+        """Test that a track appearing on several pages is kept once"""
+        respond = stub.respond
+
+        def overlapping(params):
+            data = respond(params)
+            # Every page repeats the first track of the chart
+            data['tracks']['track'].append(stub._track(params['tag'], 0))
+            return data
+
+        monkeypatch.setattr(stub, 'respond', overlapping)
+        pool = lastfm.fetch_genre_pool('pop')
+        urls = [track['url'] for track in pool]
+        assert len(urls) == len(set(urls)) == 140
+
+    def test_failed_pages_are_skipped(self, stub, monkeypatch):
+        """Test that one failing page still yields the others, and all failing raises"""
+        fetch = lastfm.fetch_genre_tracks
+
+        def flaky(genre, page=1):
+            if page == 2:
+                raise requests.ConnectionError('page 2 unavailable')
+            return fetch(genre, page)
+
+        monkeypatch.setattr(lastfm, 'fetch_genre_tracks', flaky)
+        assert len(lastfm.fetch_genre_pool('metal')) == 90
+
+        monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', 'http://127.0.0.1:9/2.0/')
+        monkeypatch.setattr(lastfm, 'fetch_genre_tracks', fetch)
+        with pytest.raises(requests.RequestException):
+            lastfm.fetch_genre_pool('metal')
@@ -0,0 +1,82 @@
+import io
+import json
+import logging
+import logging.handlers
+import queue
+from log_config import JsonFormatter, DebugSampler, NonBlockingQueueHandler, set_levels, truncate
+
+
+def make_record(level=logging.INFO, msg='hello %s', args=('world',), **extra):
+    record = logging.LogRecord('app.requests', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestLogConfig:
+    """
+    Test suite for structured logging:
+    - JSON records with extra fields and tracebacks
+    - Payload truncation
+    - Sampling of DEBUG records
+    - Queue handoff that never blocks the caller
+    - Per-logger level overrides
+    """
+
+    def test_records_are_json(self):
+        """Test that a record becomes one JSON object with its extra fields"""
+        entry = json.loads(JsonFormatter().format(make_record(origin='http://localhost:3000', status=200)))
+        assert entry['message'] == 'hello world'
+        assert entry['level'] == 'INFO'
+        assert entry['logger'] == 'app.requests'
+        assert entry['origin'] == 'http://localhost:3000'
+        assert entry['status'] == 200
+
+    def test_payloads_are_truncated(self):
+        """Test that large extra fields are cut to the payload limit"""
+        pattern = [[1, 0] * 50] * 20
+        entry = json.loads(JsonFormatter(payload_limit=50).format(make_record(pattern_json=pattern)))
+        assert entry['pattern_json'].startswith('[[1, 0, 1, 0')
+        assert entry['pattern_json'].endswith('more chars)')
+        assert len(entry['pattern_json']) < 80
+        assert truncate('short') == 'short'
+
+    def test_debug_records_are_sampled(self):
+        """Test that only the sampled share of DEBUG records passes, and everything else always does"""
+        sampler = DebugSampler(rate=0.1)
+        kept = sum(sampler.filter(make_record(logging.DEBUG)) for _ in range(2000))
+        assert 100 < kept < 300
+        assert all(sampler.filter(make_record(logging.INFO)) for _ in range(100))
+        assert DebugSampler(rate=1).filter(make_record(logging.DEBUG))
+
+    def test_queue_handoff_drops_instead_of_blocking(self):
+        """Test that records reach the listener and a full queue drops records rather than waiting"""
+        stream = io.StringIO()
+        output = logging.StreamHandler(stream)
+        output.setFormatter(JsonFormatter())
+        handler = NonBlockingQueueHandler(queue.Queue(2))
+        logger = logging.getLogger('test_log_config.queue')
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            try:
+                raise ValueError('boom')
+            except ValueError:
+                logger.exception('failed %s', 'once')
+            for _ in range(3):
+                logger.error('more')
+            assert handler.dropped == 2
+
+            listener = logging.handlers.QueueListener(handler.queue, output)
+            listener.start()
+            listener.stop()
+        finally:
+            logger.removeHandler(handler)
+        entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert [e['message'] for e in entries] == ['failed once', 'more']
+        assert 'ValueError: boom' in entries[0]['exception']
+
+    def test_per_logger_levels(self):
+        """Test that LOG_LEVELS-style overrides set each named logger's level"""
+        set_levels('test_log_config.a=DEBUG, test_log_config.b=warning')
+        assert logging.getLogger('test_log_config.a').level == logging.DEBUG
+        assert logging.getLogger('test_log_config.b').level == logging.WARNING
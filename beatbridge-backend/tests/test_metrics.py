@@ -0,0 +1,197 @@
+import logging
+import os
+import queue
+import subprocess
+import sys
+import pytest
+import log_config
+import metrics
+import outbound
+from prometheus_client.parser import text_string_to_metric_families
+from cache import caches
+from loadtest.stubs import LastFMStub
+from outbound import OutboundClient
+from passwords import hash_password
+from resilience import CircuitBreaker, CircuitOpen, latency_budget, budget_exhausted, mark_degraded
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def scrape(test_client):
+    response = test_client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    return response.get_data(as_text=True)
+
+
+def sample_value(text, name, **labels):
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name == name and all(sample.labels.get(k) == v for k, v in labels.items()):
+                return sample.value
+    return 0.0
+
+
+def has_sample(text, name, **labels):
+    return any(sample.name == name and all(sample.labels.get(k) == v for k, v in labels.items())
+               for family in text_string_to_metric_families(text) for sample in family.samples)
+
+
+@pytest.mark.usefixtures('test_db')
+class TestMetrics:
+    """
+    Test suite for Prometheus metrics:
+    - Request counts by route and status, and latency histograms
+    - SQL statements and time per request
+    - Outbound call latency by host and outcome
+    - Password hash latency and queue depth
+    - Circuit breaker state and latency budget overruns
+    - Cache, outbound client and log queue stats copied from stats()
+    - Aggregation across worker processes
+    """
+
+    def test_requests_are_counted_by_route(self, test_client):
+        """Test that requests are labelled with their URL rule, not the raw path"""
+        before = scrape(test_client)
+        test_client.get('/api/genres')
+        test_client.get('/api/jam-sessions/41')
+        test_client.get('/api/jam-sessions/42')
+        after = scrape(test_client)
+
+        route = '/api/jam-sessions/<int:jam_id>'
+        assert sample_value(after, 'http_requests_total', route='/api/genres', status='200') \
+            - sample_value(before, 'http_requests_total', route='/api/genres', status='200') == 1
+        assert sample_value(after, 'http_requests_total', route=route, status='404') \
+            - sample_value(before, 'http_requests_total', route=route, status='404') == 2
+        assert sample_value(after, 'http_request_duration_seconds_count', method='GET', route=route) \
+            - sample_value(before, 'http_request_duration_seconds_count', method='GET', route=route) == 2
+
+    def test_sql_is_counted_per_request(self, test_client):
+        """Test that statements run for a request land in its route's query histogram"""
+        route = '/api/jam-sessions/<int:jam_id>'
+        before = scrape(test_client)
+        test_client.get('/api/jam-sessions/7')
+        after = scrape(test_client)
+        queries = sample_value(after, 'db_queries_per_request_sum', route=route) \
+            - sample_value(before, 'db_queries_per_request_sum', route=route)
+        assert queries >= 1
+        assert sample_value(after, 'db_time_per_request_seconds_sum', route=route) \
+            > sample_value(before, 'db_time_per_request_seconds_sum', route=route)
+        # /api/genres never touches the database
+        assert sample_value(after, 'db_queries_per_request_sum', route='/api/genres') == 0
+
+    def test_outbound_latency_by_host(self, test_client):
+        """Test that each outbound attempt is recorded with its host and outcome"""
+        stub = LastFMStub().start()
+        client = OutboundClient(timeout=2, retries=0)
+        try:
+            client.get(stub.url, params={'method': 'track.getInfo', 'track': 't'})
+        finally:
+            stub.stop()
+        host = stub.url.split('/')[2]
+        text = scrape(test_client)
+        assert sample_value(text, 'outbound_request_duration_seconds_count', host=host, outcome='2xx') == 1
+
+    def test_password_hashing(self, test_client):
+        """Test that each hash is timed and the pool's queue depth is exported"""
+        before = scrape(test_client)
+        hash_password('correct horse')
+        after = scrape(test_client)
+        assert sample_value(after, 'password_hash_duration_seconds_count') \
+            - sample_value(before, 'password_hash_duration_seconds_count') == 1
+        assert has_sample(after, 'password_hash_queue_depth')
+        assert sample_value(after, 'password_hash_queue_depth') == 0
+        assert has_sample(after, 'password_hash_rejected_total')
+
+    def test_breaker_state_and_budgets(self, test_client):
+        """Test that breaker transitions, fail-fast calls and budget overruns are exported"""
+        breaker = CircuitBreaker('metrics-test', failure_threshold=1, reset_timeout=60)
+        assert sample_value(scrape(test_client), 'circuit_breaker_state', breaker='metrics-test') == 0
+        breaker.record_failure()
+        with pytest.raises(CircuitOpen):
+            breaker.check()
+
+        @latency_budget(5)
+        def overrun():
+            mark_degraded()
+            budget_exhausted('spent')
+
+        before = scrape(test_client)
+        overrun()
+        after = scrape(test_client)
+        assert sample_value(after, 'circuit_breaker_state', breaker='metrics-test') == 2
+        assert sample_value(after, 'circuit_breaker_trips_total', breaker='metrics-test') == 1
+        assert sample_value(after, 'circuit_breaker_rejected_total', breaker='metrics-test') == 1
+        for event in ('budgets', 'exhausted', 'degraded'):
+            assert sample_value(after, 'latency_budget_events_total', event=event) \
+                - sample_value(before, 'latency_budget_events_total', event=event) == 1
+
+    def test_cache_stats(self, test_client):
+        """Test that cache hits, misses and evictions are exported per namespace"""
+        cache = caches.namespace('metrics-test', ttl=60, max_size=1)
+        cache.get('a')
+        cache.set('a', 1)
+        cache.get('a')
+        cache.set('b', 2)
+        text = scrape(test_client)
+        for event in ('hits', 'misses', 'evictions'):
+            assert sample_value(text, 'cache_events_total', namespace='metrics-test', event=event) == 1
+        assert sample_value(text, 'cache_entries', namespace='metrics-test') == 1
+        # Published counts only move by what's new since the last copy
+        cache.get('b')
+        assert sample_value(scrape(test_client), 'cache_events_total', namespace='metrics-test', event='hits') == 2
+
+    def test_outbound_client_stats(self, test_client):
+        """Test that the shared client's request counts and connection reuse are exported per host"""
+        stub = LastFMStub().start()
+        try:
+            for _ in range(2):
+                outbound.client.get(stub.url, params={'method': 'track.getInfo', 'track': 't'})
+        finally:
+            stub.stop()
+        host = stub.url.split('/')[2]
+        text = scrape(test_client)
+        assert sample_value(text, 'outbound_requests_total', host=host, kind='requests') == 2
+        assert sample_value(text, 'outbound_connections_total', host=host) == 1
+        assert sample_value(text, 'outbound_connection_reuse_ratio', host=host) == 0.5
+
+    def test_dropped_log_records(self, test_client, monkeypatch):
+        """Test that records dropped by a full log queue are exported"""
+        handler = log_config.NonBlockingQueueHandler(queue.Queue(1))
+        monkeypatch.setattr(log_config, '_handler', handler)
+        before = scrape(test_client)
+        for _ in range(3):
+            handler.handle(logging.makeLogRecord({'msg': 'flood'}))
+        after = scrape(test_client)
+        assert sample_value(after, 'log_records_dropped_total') - sample_value(before, 'log_records_dropped_total') == 2
+
+    def test_metrics_token(self, test_client, monkeypatch):
+        """Test that a configured METRICS_TOKEN is required to scrape"""
+        monkeypatch.setattr(metrics, 'METRICS_TOKEN', 'secret')
+        assert test_client.get('/metrics').status_code == 401
+        assert test_client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+    def test_workers_are_aggregated(self, tmp_path):
+        """Test that counters from separate processes are summed when a multiprocess dir is set"""
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+        worker = "import metrics; metrics.REQUESTS.labels('GET', '/api/genres', '200').inc(3)"
+        for _ in range(2):
+            subprocess.run([sys.executable, '-c', worker], cwd=BACKEND_DIR, env=env, check=True)
+        scraper = ("import metrics; from prometheus_client import generate_latest; "
+                   "print(generate_latest(metrics.registry()).decode())")
+        text = subprocess.run([sys.executable, '-c', scraper], cwd=BACKEND_DIR, env=env, check=True,
+                              capture_output=True, text=True).stdout
+        assert sample_value(text, 'http_requests_total', route='/api/genres', status='200') == 6
+
+    def test_published_stats_are_aggregated(self, tmp_path):
+        """Test that stats() counts copied in separate processes are summed"""
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+        worker = ("import metrics; from cache import caches; "
+                  "caches.namespace('workers', ttl=60).get('a'); metrics.publish_stats()")
+        for _ in range(2):
+            subprocess.run([sys.executable, '-c', worker], cwd=BACKEND_DIR, env=env, check=True)
+        scraper = ("import metrics; from prometheus_client import generate_latest; "
+                   "print(generate_latest(metrics.registry()).decode())")
+        text = subprocess.run([sys.executable, '-c', scraper], cwd=BACKEND_DIR, env=env, check=True,
+                              capture_output=True, text=True).stdout
+        assert sample_value(text, 'cache_events_total', namespace='workers', event='misses') == 2
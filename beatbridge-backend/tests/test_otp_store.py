@@ -0,0 +1,81 @@
+import pytest
+from sqlalchemy import create_engine
+from otp_store import MemoryOTPStore, SQLOTPStore
+
+
+@pytest.fixture(params=['memory', 'sql'])
+def store(request, tmp_path):
+    """Both OTP store backends with a short TTL and attempt limit"""
+    if request.param == 'memory':
+        return MemoryOTPStore(ttl=60, max_attempts=3)
+    engine = create_engine(f"sqlite:///{tmp_path / 'otps.db'}")
+    store = SQLOTPStore(engine, ttl=60, max_attempts=3)
+    store.ensure_schema()
+    return store
+
+
+class TestOTPStore:
+    """
+    Test suite for the password-reset OTP stores:
+    - Verification and the verified flag
+    - Expiry and sweeping
+    - Attempt limits
+    - Sharing codes across store instances
+    """
+
+    def test_verify_success(self, store):
+        """Test that the right code verifies once and gates the reset"""
+        store.put('test@example.com', '123456')
+        assert store.get('test@example.com') == '123456'
+        assert not store.is_verified('test@example.com')
+
+        assert store.verify('test@example.com', '123456')
+        assert store.is_verified('test@example.com')
+        # A verified entry can't be verified again or read back as a pending code
+        assert not store.verify('test@example.com', '123456')
+        assert store.get('test@example.com') is None
+
+        store.discard('test@example.com')
+        assert not store.is_verified('test@example.com')
+
+    def test_expired_codes_are_rejected_and_swept(self, store):
+        """Test that codes stop working after the TTL and are removed by a sweep"""
+        store.ttl = -1
+        store.put('test@example.com', '123456')
+        assert store.get('test@example.com') is None
+        assert not store.verify('test@example.com', '123456')
+
+        store.put('other@example.com', '654321')
+        assert store.sweep() >= 1
+        assert store.get('other@example.com') is None
+
+    def test_attempt_limit_discards_code(self, store):
+        """Test that too many wrong guesses invalidate the code"""
+        store.put('test@example.com', '123456')
+        assert not store.verify('test@example.com', '000000')
+        assert not store.verify('test@example.com', '111111')
+        assert store.get('test@example.com') == '123456'
+        assert not store.verify('test@example.com', '222222')
+
+        # The right code no longer works once the limit was reached
+        assert store.get('test@example.com') is None
+        assert not store.verify('test@example.com', '123456')
+
+    def test_new_code_resets_attempts(self, store):
+        """Test that requesting a new code replaces the old one and its attempt count"""
+        store.put('test@example.com', '123456')
+        assert not store.verify('test@example.com', '000000')
+        store.put('test@example.com', '654321')
+        assert not store.verify('test@example.com', '123456')
+        assert store.verify('test@example.com', '654321')
+
+    def test_sql_store_is_shared_between_instances(self, tmp_path):
+        """Test that a code written by one worker's store verifies through another"""
+        path = tmp_path / 'shared.db'
+        first = SQLOTPStore(create_engine(f"sqlite:///{path}"))
+        first.ensure_schema()
+        second = SQLOTPStore(create_engine(f"sqlite:///{path}"))
+
+        first.put('test@example.com', '123456')
+        assert second.verify('test@example.com', '123456')
+        assert first.is_verified('test@example.com')
@@ -0,0 +1,127 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from loadtest.stubs import LastFMStub
+from outbound import OutboundClient
+from resilience import BudgetExhausted, latency_budget
+
+
+class FlakyServer:
+    """Answers with the given status codes in turn (200 once they run out), counting requests"""
+
+    def __init__(self, statuses=(), delay=0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def respond(self):
+                server.requests.append(self.command)
+                time.sleep(server.delay)
+                status = server.statuses.pop(0) if server.statuses else 200
+                self.send_response(status)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            do_GET = do_POST = respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.handle_error = lambda request, client_address: None  # Clients that timed out hang up early
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def client():
+    return OutboundClient(timeout=2, pool_size=4, retries=2, backoff=0.01)
+
+
+class TestOutboundClient:
+    """
+    Test suite for the shared outbound HTTP client:
+    - Keep-alive connection reuse per host
+    - Retries with backoff for idempotent requests only
+    - Per-host default timeouts and the request latency budget
+    """
+
+    def test_connections_are_reused(self, client):
+        """Test that repeat calls to a host share one keep-alive connection"""
+        stub = LastFMStub().start()
+        try:
+            for _ in range(10):
+                assert client.get(stub.url, params={'method': 'track.getInfo', 'track': 't'}).status_code == 200
+            stats = client.stats()[stub.url.rsplit('/', 2)[0]]
+        finally:
+            stub.stop()
+        assert stats['requests'] == 10
+        assert stats['connections'] == 1
+        assert stats['reuse_ratio'] == 0.9
+
+    def test_get_is_retried_on_unavailable(self, client):
+        """Test that a GET answered with 503 is retried and the final answer returned"""
+        server = FlakyServer([503, 502])
+        try:
+            assert client.get(server.url).status_code == 200
+        finally:
+            server.stop()
+        assert server.requests == ['GET'] * 3
+        assert list(client.stats().values())[0]['retries'] == 2
+
+    def test_post_is_not_retried(self, client):
+        """Test that non-idempotent requests are sent once"""
+        server = FlakyServer([503])
+        try:
+            assert client.post(server.url, data={'code': 'abc'}).status_code == 503
+        finally:
+            server.stop()
+        assert server.requests == ['POST']
+
+    def test_connection_errors_are_retried_then_raised(self, client):
+        """Test that an unreachable host is tried 1 + retries times"""
+        with pytest.raises(requests.ConnectionError):
+            client.get('http://127.0.0.1:9/')
+        stats = client.stats()['http://127.0.0.1:9']
+        assert stats['requests'] == 3
+        assert stats['errors'] == 3
+
+    def test_host_default_timeout(self, client):
+        """Test that a host's configured timeout applies when the caller gives none"""
+        server = FlakyServer(delay=0.3)
+        client.configure(server.url.split('/')[2], timeout=0.1)
+        try:
+            with pytest.raises(requests.Timeout):
+                client.post(server.url)
+            assert client.post(server.url, timeout=2).status_code == 200
+        finally:
+            server.stop()
+
+    def test_budget_cuts_calls_short(self, client):
+        """Test that a slow host can't hold a request past its latency budget, retries included"""
+        server = FlakyServer(delay=0.5)
+
+        @latency_budget(0.2)
+        def call():
+            return client.get(server.url)
+
+        started = time.monotonic()
+        try:
+            with pytest.raises(BudgetExhausted):
+                call()
+            assert time.monotonic() - started < 0.45
+        finally:
+            server.stop()
@@ -0,0 +1,97 @@
+import pytest
+import json
+import threading
+from prometheus_client import REGISTRY
+from werkzeug.security import generate_password_hash
+import passwords
+from passwords import HashingPool, HashingPoolSaturated, hash_password, needs_rehash
+from app_factory import User, db
+
+
+def hash_metric(name):
+    return REGISTRY.get_sample_value(name) or 0.0
+
+@pytest.mark.usefixtures('test_db')
+class TestPasswordHashing:
+    """
+    Test suite for the password hashing pool:
+    - Bounded queue and fast rejection
+    - Cost policy and rehash-on-login
+    - 503 responses when the pool is saturated
+    """
+
+    def test_pool_rejects_work_beyond_queue_limit(self):
+        """Test that a full pool raises instead of queueing more work"""
+        pool = HashingPool(workers=1, max_queue=0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash():
+            started.set()
+            release.wait(5)
+            return 'done'
+
+        rejected = hash_metric('password_hash_rejected_total')
+        hashed = hash_metric('password_hash_duration_seconds_count')
+        results = []
+        worker = threading.Thread(target=lambda: results.append(pool.run(slow_hash)))
+        worker.start()
+        started.wait(5)
+
+        assert hash_metric('password_hash_queue_depth') == 1
+        with pytest.raises(HashingPoolSaturated):
+            pool.run(slow_hash)
+
+        release.set()
+        worker.join(5)
+        assert results == ['done']
+        assert hash_metric('password_hash_queue_depth') == 0
+        assert hash_metric('password_hash_duration_seconds_count') == hashed + 1
+        assert hash_metric('password_hash_rejected_total') == rejected + 1
+
+    def test_needs_rehash_follows_policy(self):
+        """Test that only hashes made with other parameters are flagged as stale"""
+        assert not needs_rehash(hash_password('TestPass123!'))
+        assert needs_rehash(generate_password_hash('TestPass123!', method='pbkdf2:sha256:1000'))
+
+    def test_login_rehashes_stale_hash(self, test_client):
+        """Test that a successful login upgrades a hash made under an older policy"""
+        test_client.post('/api/register',
+                        json={
+                            'username': 'testuser',
+                            'email': 'test@example.com',
+                            'password': 'TestPass123!',
+                            'confirmation': 'TestPass123!'
+                        })
+        user = User.query.filter_by(username='testuser').first()
+        user.password_hash = generate_password_hash('TestPass123!', method='pbkdf2:sha256:1000')
+        db.session.commit()
+
+        response = test_client.post('/api/login',
+                                  json={
+                                      'username': 'testuser',
+                                      'password': 'TestPass123!'
+                                  })
+        assert response.status_code == 200
+
+        user = User.query.filter_by(username='testuser').first()
+        assert not needs_rehash(user.password_hash)
+        assert user.check_password('TestPass123!')
+
+    def test_register_returns_503_when_pool_saturated(self, test_client, monkeypatch):
+        """Test that registration sheds load with a 503 when no hashing capacity is left"""
+        def saturated(*args, **kwargs):
+            raise HashingPoolSaturated()
+        monkeypatch.setattr(passwords.hashing_pool, 'run', saturated)
+
+        response = test_client.post('/api/register',
+                                  json={
+                                      'username': 'testuser',
+                                      'email': 'test@example.com',
+                                      'password': 'TestPass123!',
+                                      'confirmation': 'TestPass123!'
+                                  })
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        data = json.loads(response.data)
+        assert 'error' in data
@@ -1,6 +1,9 @@
 import pytest
 import json
+from sqlalchemy import create_engine
+import app_factory
 from app_factory import User
+from otp_store import SQLOTPStore
 
 @pytest.mark.usefixtures('test_db')
 class TestPasswordReset:
@@ -85,6 +88,19 @@ class TestPasswordReset:
         assert 'error' in data
         assert data['error'] == 'Invalid OTP'
 
+    def test_verify_otp_sent_as_number(self, test_client, tmp_path, monkeypatch):
+        """Test that an OTP sent as a JSON number is checked against the SQL store like a string"""
+        store = SQLOTPStore(create_engine(f"sqlite:///{tmp_path / 'otps.db'}"))
+        store.ensure_schema()
+        monkeypatch.setattr(app_factory, 'user_otps', store)
+        store.put('test@example.com', '123456')
+
+        response = test_client.post('/api/verify-otp', json={'email': 'test@example.com', 'otp': 654321})
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'Invalid OTP'
+        response = test_client.post('/api/verify-otp', json={'email': 'test@example.com', 'otp': 123456})
+        assert response.status_code == 200
+
     def test_reset_password_success(self, test_client):
         """Test successful password reset after OTP verification"""
         # First register a user
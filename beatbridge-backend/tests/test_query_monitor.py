@@ -0,0 +1,110 @@
+import logging
+import pytest
+from flask import Flask, jsonify
+from sqlalchemy import create_engine, text
+import metrics
+import query_monitor
+from query_monitor import RepeatedQueries, fingerprint, bind_shape
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'queries.sqlite3'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE jams (id INTEGER PRIMARY KEY, title TEXT)"))
+        conn.execute(text("INSERT INTO jams (id, title) VALUES (1, 'a'), (2, 'b'), (3, 'c')"))
+    return engine
+
+
+@pytest.fixture
+def app(engine):
+    app = Flask(__name__)
+    app.config.update({'TESTING': True, 'QUERY_MONITOR': 'raise'})
+    query_monitor.init_app(app)
+
+    @app.route('/loop/<int:times>')
+    def loop(times):
+        with engine.connect() as conn:
+            for jam_id in range(times):
+                conn.execute(text("SELECT title FROM jams WHERE id = :jam_id"), {'jam_id': jam_id}).first()
+        return jsonify({'ok': True})
+
+    @app.route('/batch')
+    def batch():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT title FROM jams WHERE id IN (1, 2, 3)")).fetchall()
+        return jsonify({'ok': True})
+
+    return app
+
+
+class TestQueryMonitor:
+    """
+    Test suite for the N+1 and slow-query detector:
+    - Statement fingerprints ignore literals, placeholders and IN list lengths
+    - Bind shapes carry names and types, never values
+    - Repeats past the threshold raise in raise mode and are logged in log mode
+    - Slow statements are logged with their shape
+    - Statements are timed once, by the metrics module's hook
+    - Raise mode outside tests is warned about
+    """
+
+    def test_fingerprints(self):
+        """Test that statements differing only in values share a fingerprint"""
+        assert fingerprint("SELECT * FROM jams WHERE id = 1 AND title = 'x'") \
+            == fingerprint("SELECT *\n  FROM jams WHERE id = 42 AND title = 'it''s'") \
+            == 'SELECT * FROM jams WHERE id = ? AND title = ?'
+        assert fingerprint("SELECT id FROM jams WHERE id IN (%(id_1)s, %(id_2)s)") \
+            == fingerprint("SELECT id FROM jams WHERE id IN (?, ?, ?)") \
+            == 'SELECT id FROM jams WHERE id IN (?)'
+        assert fingerprint("SELECT :jam_id::int") == 'SELECT ?::int'
+
+    def test_bind_shape_hides_values(self):
+        """Test that bind shapes keep parameter names and types only"""
+        assert bind_shape({'jam_ids': [1, 2, 3], 'title': 'secret'}) == {'jam_ids': 'list[3]', 'title': 'str'}
+        assert bind_shape([{'title': 'a'}, {'title': 'b'}], executemany=True) == "2 x {'title': 'str'}"
+
+    def test_loop_under_threshold_passes(self, app):
+        """Test that a few repeats and one batched query are fine"""
+        client = app.test_client()
+        assert client.get(f'/loop/{query_monitor.QUERY_REPEAT_THRESHOLD}').status_code == 200
+        assert client.get('/batch').status_code == 200
+
+    def test_query_in_loop_raises(self, app):
+        """Test that raise mode fails a request that runs one statement in a loop"""
+        with pytest.raises(RepeatedQueries) as error:
+            app.test_client().get('/loop/10')
+        assert '10x SELECT title FROM jams WHERE id = ?' in str(error.value)
+        assert '/loop/<int:times>' in str(error.value)
+
+    def test_log_mode_warns_once(self, app, caplog):
+        """Test that log mode serves the request and logs the repeat once"""
+        app.config['QUERY_MONITOR'] = 'log'
+        with caplog.at_level(logging.WARNING, logger='query_monitor'):
+            assert app.test_client().get('/loop/20').status_code == 200
+        repeats = [r for r in caplog.records if r.getMessage().startswith('Repeated query')]
+        assert len(repeats) == 1
+        assert repeats[0].fingerprint == 'SELECT title FROM jams WHERE id = ?'
+
+    def test_slow_queries_are_logged(self, app, caplog, monkeypatch):
+        """Test that statements over the slow threshold are logged with their bind shape"""
+        monkeypatch.setattr(query_monitor, 'QUERY_SLOW_MS', 0)
+        with caplog.at_level(logging.WARNING, logger='query_monitor'):
+            app.test_client().get('/loop/1')
+        slow = [r for r in caplog.records if r.getMessage().startswith('Slow query')]
+        assert slow[0].bind_shape == {'jam_id': 'int'}
+        assert 'loop' in slow[0].getMessage()
+
+    def test_uses_the_shared_statement_hook(self, app):
+        """Test that the monitor registers one metrics statement hook however many apps it watches"""
+        query_monitor.init_app(Flask(__name__))
+        assert metrics._statement_hooks.count(query_monitor._statement_finished) == 1
+        assert not hasattr(query_monitor, '_before_cursor_execute')
+
+    def test_raise_mode_outside_tests_warns(self, caplog):
+        """Test that raise mode on a non-testing app logs that it is meant for tests"""
+        app = Flask(__name__)
+        app.config['QUERY_MONITOR'] = 'raise'
+        with caplog.at_level(logging.WARNING, logger='query_monitor'):
+            query_monitor.init_app(app)
+        assert any('meant for tests' in r.getMessage() for r in caplog.records)
@@ -0,0 +1,156 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+from sqlalchemy import create_engine
+import lastfm
+from cache import TTLCache, RefreshingCache
+from enrichment import EnrichmentCache
+from lastfm import fetch_track_info
+from loadtest.stubs import LastFMStub
+from resilience import (CircuitOpen, BudgetExhausted, TokenBucket, latency_budget, current_budget,
+                        budget_timeout, in_current_context, is_degraded)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = LastFMStub().start()
+    monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', stub.url)
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def breaker(lastfm_breaker):
+    # A low threshold and a short reset keep these tests quick
+    lastfm_breaker.failure_threshold = 3
+    lastfm_breaker.reset_timeout = 0.2
+    return lastfm_breaker
+
+
+def budgeted(seconds, fn, *args):
+    """Run fn inside a request with a latency budget, returning (result or exception, degraded)"""
+    @latency_budget(seconds)
+    def run():
+        try:
+            return fn(*args), is_degraded()
+        except Exception as e:
+            return e, is_degraded()
+    return run()
+
+
+class TestResilience:
+    """
+    Test suite for Last.fm latency budgets and the circuit breaker:
+    - Timeouts are clamped to the request's remaining budget
+    - Budget overruns fail fast and don't count against Last.fm
+    - Consecutive failures open the breaker; a trial call closes it again
+    - Open-breaker and budget failures aren't cached as enrichment errors
+    - Token buckets pace callers to their rate after the burst
+    """
+
+    def test_budget_clamps_timeouts(self):
+        """Test that each call gets at most the time left and none once it's spent"""
+        assert budget_timeout(5) == 5  # No budget outside a request
+
+        def calls():
+            first = budget_timeout(5)
+            time.sleep(0.25)
+            with pytest.raises(BudgetExhausted):
+                budget_timeout(5)
+            return first, current_budget().exhausted
+
+        (first, exhausted), degraded = budgeted(0.2, calls)
+        assert first <= 0.2
+        assert exhausted and degraded
+
+    def test_budget_is_shared_with_pool_threads(self):
+        """Test that work handed to a thread pool sees the request's budget"""
+        executor = ThreadPoolExecutor(max_workers=2)
+        (timeouts, _) = budgeted(0.5, lambda: list(executor.map(in_current_context(budget_timeout), [5, 5])))
+        assert all(t <= 0.5 for t in timeouts)
+        assert executor.submit(budget_timeout, 5).result() == 5
+
+    def test_slow_lastfm_exhausts_budget_without_tripping(self, stub, breaker):
+        """Test that a call cut short by the budget raises BudgetExhausted and leaves the breaker closed"""
+        stub.latency = 0.5
+        started = time.monotonic()
+        result, degraded = budgeted(0.2, fetch_track_info, 'rock artist 1', 'rock track 1')
+        assert isinstance(result, BudgetExhausted)
+        assert degraded
+        assert time.monotonic() - started < 0.45
+        assert breaker.stats()['failures'] == 0
+        assert breaker.state == 'closed'
+
+    def test_consecutive_failures_open_the_breaker(self, breaker, monkeypatch):
+        """Test that the breaker opens after the threshold and then fails fast without calling out"""
+        monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', 'http://127.0.0.1:9/2.0/')
+        for _ in range(3):
+            with pytest.raises(requests.ConnectionError) as error:
+                fetch_track_info('rock artist 1', 'rock track 1')
+            assert not isinstance(error.value, CircuitOpen)
+        assert breaker.state == 'open'
+
+        result, degraded = budgeted(1.0, fetch_track_info, 'rock artist 1', 'rock track 1')
+        assert isinstance(result, CircuitOpen)
+        assert degraded
+        assert breaker.stats()['rejected'] == 1
+        assert breaker.stats()['trips'] == 1
+
+    def test_trial_call_closes_the_breaker(self, stub, breaker):
+        """Test that after reset_timeout one trial call is allowed and a success closes the breaker"""
+        for _ in range(3):
+            breaker.record_failure()
+        assert not breaker.allow()
+        time.sleep(0.25)
+        assert breaker.state == 'half_open'
+        assert fetch_track_info('rock artist 1', 'rock track 1')['name'] == 'rock track 1'
+        assert breaker.state == 'closed'
+
+    def test_failed_trial_reopens_the_breaker(self, breaker):
+        """Test that a failing trial call opens the breaker again and only one trial runs at a time"""
+        for _ in range(3):
+            breaker.record_failure()
+        time.sleep(0.25)
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == 'open'
+        assert breaker.stats()['trips'] == 2
+
+    def test_open_breaker_is_not_cached_as_enrichment_error(self, stub, breaker, tmp_path):
+        """Test that lookups skipped by the breaker leave nothing cached, so the next lookup calls Last.fm"""
+        cache = EnrichmentCache(create_engine(f"sqlite:///{tmp_path / 'enrichment.sqlite3'}"), fetch_track_info)
+        cache.ensure_schema()
+        for _ in range(3):
+            breaker.record_failure()
+        assert cache.lookup('rock artist 1', 'rock track 1') is None
+        assert 'track.getInfo' not in stub.calls
+
+        time.sleep(0.25)
+        assert cache.lookup('rock artist 1', 'rock track 1')['name'] == 'rock track 1'
+        assert stub.calls['track.getInfo'] == 1
+
+    def test_token_bucket_paces_calls(self):
+        """Test that calls beyond the burst wait for tokens, and idle time refills the bucket up to the burst"""
+        now = [0.0]
+        def sleep(seconds):
+            now[0] += seconds
+        bucket = TokenBucket(rate=4, burst=2, clock=lambda: now[0], sleep=sleep)
+        assert [bucket.acquire() for _ in range(4)] == [0, 0, 0.25, 0.25]
+        assert now[0] == 0.5
+        now[0] += 10
+        assert [bucket.acquire() for _ in range(3)] == [0, 0, 0.25]
+
+    def test_cold_pool_wait_is_bounded(self):
+        """Test that waiting on a cold key gives up after the timeout while the load carries on"""
+        def slow_loader(key):
+            time.sleep(0.3)
+            return [key]
+
+        pools = RefreshingCache(slow_loader, ttl=60, stale_ttl=60, cache=TTLCache(120, max_size=10),
+                                executor=ThreadPoolExecutor(max_workers=1))
+        with pytest.raises(TimeoutError):
+            pools.get('rock', timeout=0.05)
+        time.sleep(0.4)
+        assert pools.get('rock', timeout=0.05) == ['rock']
@@ -0,0 +1,72 @@
+import threading
+import time
+import pytest
+from shared_cache import SharedCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'shared.sqlite3')
+
+
+class TestSharedCache:
+    """
+    Test suite for the cross-worker cache tier:
+    - Values written by one worker are read by another
+    - Expiry
+    - Read-through loads each key once across workers
+    - Lock leases
+    """
+
+    def test_value_is_shared_between_instances(self, path):
+        """Test that a value set through one worker's cache is visible to another's"""
+        first, second = SharedCache(path), SharedCache(path)
+        first.set('genre_pools', 'rock', [{'url': 'u1'}], ttl=60)
+        assert second.get('genre_pools', 'rock') == [{'url': 'u1'}]
+        assert second.get('genre_pools', 'jazz') is None
+        assert second.stats()['hits'] == 1
+        assert second.stats()['misses'] == 1
+
+    def test_expired_values_are_ignored(self, path):
+        """Test that entries past their TTL are treated as missing"""
+        cache = SharedCache(path)
+        cache.set('genre_pools', 'rock', ['old'], ttl=-1)
+        assert cache.get('genre_pools', 'rock') is None
+
+    def test_read_through_loads_once_across_workers(self, path):
+        """Test that concurrent workers wait for one load instead of each calling the loader"""
+        calls = []
+
+        def loader(key):
+            calls.append(key)
+            time.sleep(0.3)
+            return [key]
+
+        results = []
+        workers = [SharedCache(path) for _ in range(4)]
+        threads = [threading.Thread(target=lambda cache=cache: results.append(
+            cache.read_through('genre_pools', 'jazz', loader, ttl=60))) for cache in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == ['jazz']
+        assert results == [['jazz']] * 4
+        assert sum(cache.stats()['lock_waits'] for cache in workers) > 0
+
+    def test_empty_results_are_not_stored(self, path):
+        """Test that a falsy load is returned but not written through"""
+        cache = SharedCache(path)
+        assert cache.read_through('genre_pools', 'nothing', lambda key: [], ttl=60) == []
+        assert cache.get('genre_pools', 'nothing') is None
+
+    def test_lock_lease(self, path):
+        """Test that a held lock blocks other owners until released or expired"""
+        first, second = SharedCache(path), SharedCache(path)
+        assert first.acquire('genre_pools:rock', lease=60)
+        assert not second.acquire('genre_pools:rock', lease=60)
+        first.release('genre_pools:rock')
+        assert second.acquire('genre_pools:rock', lease=-1)
+        # An expired lease can be taken over
+        assert first.acquire('genre_pools:rock', lease=60)
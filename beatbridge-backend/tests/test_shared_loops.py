@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import event, insert
+from app_factory import JamSession, User, db
+from shared_loops import owned_jam_ids, taken_titles, copy_titles
+
+JAMS = JamSession.__table__
+
+
+def add_user(username):
+    user = User(username=username, email=f'{username}@example.com', is_verified=True)
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def add_jams(user_id, *titles):
+    db.session.execute(insert(JAMS), [{'user_id': user_id, 'title': title, 'pattern_json': '{}'} for title in titles])
+    db.session.commit()
+    return [jam.id for jam in JamSession.query.filter_by(user_id=user_id).order_by(JamSession.id)]
+
+
+def counted(fn, *args, **kwargs):
+    """Run fn and return (its result, number of SQL statements it issued)"""
+    statements = []
+    listener = lambda *a: statements.append(1)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        return fn(*args, **kwargs), len(statements)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+@pytest.mark.usefixtures('test_db')
+class TestSharedLoops:
+    """
+    Test suite for the shared-loops lookups:
+    - Ownership of the jams being shared
+    - Recipient titles that clash with copies, with LIKE wildcards escaped
+    - Numbered titles for copies, including duplicates within one share
+    - One query per lookup however many loops a share holds
+    """
+
+    def test_owned_jam_ids(self):
+        """Test that only the user's own jams come back"""
+        sender, other = add_user('sender'), add_user('other')
+        mine = add_jams(sender, 'Groove', 'Fill')
+        theirs = add_jams(other, 'Solo')
+        assert owned_jam_ids(db.session, sender, mine + theirs, jams=JAMS) == set(mine)
+        assert owned_jam_ids(db.session, sender, [], jams=JAMS) == set()
+
+    def test_taken_titles(self):
+        """Test that exact and numbered titles clash, and other titles and users don't"""
+        recipient, other = add_user('recipient'), add_user('other')
+        add_jams(recipient, 'Title', 'Title 2', 'Titles', '100% Beat', '100 Beat 2')
+        add_jams(other, 'Title 3')
+        assert taken_titles(db.session, recipient, ['Title', 'Title'], jams=JAMS) == {'Title', 'Title 2'}
+        assert taken_titles(db.session, recipient, ['100% Beat'], jams=JAMS) == {'100% Beat'}
+        assert taken_titles(db.session, recipient, [], jams=JAMS) == set()
+
+    def test_copy_titles(self):
+        """Test that copies skip taken titles and don't reuse one handed out earlier in the share"""
+        taken = {'Title', 'Title 2'}
+        assert copy_titles(['Title', 'Fresh', 'Title', 'Fresh'], taken) == ['Title 3', 'Fresh', 'Title 4', 'Fresh 2']
+        assert {'Title 3', 'Title 4', 'Fresh', 'Fresh 2'} <= taken
+        assert copy_titles([], set()) == []
+
+    def test_one_query_per_lookup(self):
+        """Test that a large share is checked and named with one statement each"""
+        sender, recipient = add_user('sender'), add_user('recipient')
+        titles = [f'Loop {n}' for n in range(25)]
+        jam_ids = add_jams(sender, *titles)
+        add_jams(recipient, 'Loop 1', 'Loop 1 2')
+
+        owned, statements = counted(owned_jam_ids, db.session, sender, jam_ids, jams=JAMS)
+        assert owned == set(jam_ids) and statements == 1
+        taken, statements = counted(taken_titles, db.session, recipient, titles, jams=JAMS)
+        assert statements == 1
+        assert copy_titles(titles, taken)[:3] == ['Loop 0', 'Loop 1 3', 'Loop 2']
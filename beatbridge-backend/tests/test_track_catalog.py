@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import create_engine, select, func
+import catalog
+import lastfm
+from catalog import ingest_genre, purge_untagged, catalog_pool, tracks, track_tags
+from enrichment import EnrichmentCache
+from lastfm import fetch_track_info
+from loadtest.stubs import LastFMStub
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = LastFMStub(tracks_per_genre=120).start()
+    monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', stub.url)
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.sqlite3'}")
+    catalog.ensure_schema(engine)
+    return engine
+
+
+@pytest.fixture
+def enrichment(engine):
+    cache = EnrichmentCache(engine, fetch_track_info, prefill_rate=1000)
+    cache.ensure_schema()
+    return cache
+
+
+def count(engine, table):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+
+class TestTrackCatalog:
+    """
+    Test suite for the offline track catalog:
+    - Ingestion walks every chart page and stores track details
+    - Re-ingesting replaces a genre's chart without duplicating tracks
+    - Pools are served from the database in chart order
+    - Tracks that left every chart are purged
+    """
+
+    def test_ingest_fetches_every_page_and_details(self, stub, engine, enrichment):
+        """Test that ingestion reads totalPages and stores each track with its getInfo details"""
+        stub.unknown_tracks.add('rock track 3')
+        assert ingest_genre(engine, 'rock', enrichment) == 120
+        assert stub.calls['tag.gettoptracks'] == 3
+        assert stub.calls['track.getInfo'] == 120
+
+        pool = catalog_pool(engine, 'rock', limit=500)
+        assert [t['name'] for t in pool[:3]] == ['rock track 0', 'rock track 1', 'rock track 2']
+        assert pool[0]['album']['title'] == 'Stub Album'
+        assert pool[0]['url'] == 'http://lastfm.example/rock/0'
+        # A track Last.fm has no details for is still in the catalog, with its chart entry only
+        assert 'album' not in pool[3]
+        with engine.connect() as conn:
+            row = conn.execute(select(tracks).where(tracks.c.url == 'http://lastfm.example/rock/0')).first()
+        assert row.listeners == 12345
+        assert row.duration == 215000
+        assert row.album == 'Stub Album'
+
+    def test_max_pages_limits_the_chart(self, stub, engine, enrichment):
+        """Test that ingestion stops at max_pages"""
+        assert ingest_genre(engine, 'rock', enrichment, max_pages=2) == 100
+        assert stub.calls['tag.gettoptracks'] == 2
+
+    def test_reingest_replaces_the_chart(self, stub, engine, enrichment):
+        """Test that a second run updates ranks without new rows or repeat getInfo calls"""
+        ingest_genre(engine, 'rock', enrichment)
+        stub.tracks_per_genre = 60
+        assert ingest_genre(engine, 'rock', enrichment) == 60
+        assert stub.calls['track.getInfo'] == 120
+        assert count(engine, tracks) == 120
+        assert count(engine, track_tags) == 60
+        assert len(catalog_pool(engine, 'Rock', limit=500)) == 60
+
+        assert purge_untagged(engine) == 60
+        assert count(engine, tracks) == 60
+
+    def test_track_in_several_genres_is_stored_once(self, stub, engine, enrichment, monkeypatch):
+        """Test that tracks are shared between genres through track_tags"""
+        monkeypatch.setattr(stub, '_track', lambda genre, i: {
+            'name': f"shared track {i}", 'artist': {'name': 'shared artist'}, 'url': f"http://lastfm.example/shared/{i}"})
+        ingest_genre(engine, 'rock', enrichment, max_pages=1)
+        ingest_genre(engine, 'indie', enrichment, max_pages=1)
+        assert count(engine, tracks) == 50
+        assert count(engine, track_tags) == 100
+        assert len(catalog_pool(engine, 'indie', limit=10)) == 10
+
+    def test_unknown_genre_has_an_empty_pool(self, engine):
+        """Test that a genre that was never ingested yields no tracks"""
+        assert catalog_pool(engine, 'polka', limit=10) == []
@@ -0,0 +1,97 @@
+from functools import partial
+import pytest
+from sqlalchemy import create_engine, select
+import lastfm
+from enrichment import EnrichmentCache, track_enrichment, track_key
+from lastfm import fetch_track_info
+from loadtest.stubs import LastFMStub
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = LastFMStub().start()
+    monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', stub.url)
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'enrichment.sqlite3'}")
+    cache = EnrichmentCache(engine, fetch_track_info, prefill_fetch_info=partial(fetch_track_info, use_breaker=False),
+                            prefill_rate=1000)
+    cache.ensure_schema()
+    return cache
+
+
+def stored_status(cache, artist, name):
+    key = track_key(artist, name)
+    with cache.engine.connect() as conn:
+        return conn.execute(select(track_enrichment.c.status).where(
+            track_enrichment.c.artist_key == key[0], track_enrichment.c.track_key == key[1])).scalar()
+
+
+class TestTrackEnrichment:
+    """
+    Test suite for the track.getInfo cache:
+    - Details are fetched once and then served from the table
+    - Lookups match on normalized artist and track names
+    - Unknown tracks and failed lookups are cached as negative entries
+    - Prefill skips tracks that are already cached
+    - Prefill stops at a failed lookup without caching it or feeding the breaker
+    """
+
+    def test_details_are_fetched_once(self, stub, cache):
+        """Test that a second lookup is served without calling Last.fm"""
+        first = cache.lookup('rock artist 1', 'rock track 1')
+        second = cache.lookup('rock artist 1', 'rock track 1')
+        assert first == second
+        assert first['album']['title'] == 'Stub Album'
+        assert stub.calls['track.getInfo'] == 1
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_lookup_uses_normalized_names(self, stub, cache):
+        """Test that case and whitespace differences hit the same entry"""
+        cache.lookup('Rock Artist 1', 'Rock  Track 1')
+        assert cache.lookup(' rock artist 1', 'rock track 1 ') is not None
+        assert stub.calls['track.getInfo'] == 1
+
+    def test_unknown_track_is_negatively_cached(self, stub, cache):
+        """Test that a "Track not found" answer is stored and not asked again"""
+        stub.unknown_tracks.add('missing track')
+        assert cache.lookup('rock artist 1', 'missing track') is None
+        assert cache.lookup('rock artist 1', 'missing track') is None
+        assert stub.calls['track.getInfo'] == 1
+        assert stored_status(cache, 'rock artist 1', 'missing track') == 'not_found'
+        assert cache.stats()['negative_hits'] == 1
+
+    def test_failed_lookup_is_cached_as_error(self, cache, monkeypatch):
+        """Test that an unreachable Last.fm leaves a short-lived error entry instead of raising"""
+        monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', 'http://127.0.0.1:9/2.0/')
+        assert cache.lookup('rock artist 1', 'rock track 1') is None
+        assert stored_status(cache, 'rock artist 1', 'rock track 1') == 'error'
+        assert cache.lookup('rock artist 1', 'rock track 1') is None
+        assert cache.stats()['negative_hits'] == 1
+
+    def test_prefill_skips_cached_tracks(self, stub, cache):
+        """Test that prefill only fetches tracks missing from the table"""
+        pool = [stub._track('rock', i) for i in range(30)]
+        cache.lookup(pool[0]['artist']['name'], pool[0]['name'])
+        cache.prefill_async(pool).result(timeout=10)
+        assert stub.calls['track.getInfo'] == 30
+        assert cache.stats()['prefilled'] == 29
+
+        for track in pool:
+            assert cache.lookup(track['artist']['name'], track['name']) is not None
+        assert stub.calls['track.getInfo'] == 30
+
+    def test_prefill_failure_is_not_cached(self, cache, monkeypatch):
+        """Test that a failing prefill stops, leaves the track uncached and doesn't count against the breaker"""
+        monkeypatch.setattr(lastfm, 'LASTFM_BASE_URL', 'http://127.0.0.1:9/2.0/')
+        failures = lastfm.breaker.stats()['failures']
+        tracks = [{'name': f'rock track {i}', 'artist': {'name': 'rock artist 1'}} for i in range(3)]
+        assert cache.prefill(tracks) is False
+        assert stored_status(cache, 'rock artist 1', 'rock track 0') is None
+        assert cache.stats()['prefilled'] == 0
+        assert lastfm.breaker.stats()['failures'] == failures
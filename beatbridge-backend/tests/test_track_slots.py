@@ -0,0 +1,72 @@
+from track_slots import SlotPool, set_bits
+
+
+def tracks(*names):
+    return [{'url': f'http://lastfm.example/{name}', 'name': name} for name in names]
+
+
+def urls(pool, mask):
+    return {pool.tracks[slot]['name'] for slot in set_bits(mask)}
+
+
+class TestTrackSlots:
+    """
+    Test suite for slot-bitset recent-track history:
+    - Slot layout and URL masks
+    - Sampling only from set bits
+    - Slots kept by tracks that survive a refresh
+    - History carried across one or several refreshes
+    """
+
+    def test_slots_and_masks(self):
+        """Test that every track gets a slot and masks map back to the same tracks"""
+        pool = SlotPool(tracks('a', 'b', 'c'))
+        assert pool.size == 3
+        assert pool.full == 0b111
+        assert urls(pool, pool.mask(['http://lastfm.example/c', 'http://elsewhere'])) == {'c'}
+        assert set_bits(0b10110) == [1, 2, 4]
+        assert set_bits(0) == []
+        assert set_bits(1 << 5000 | 1) == [0, 5000]
+
+    def test_sample_only_picks_set_bits(self):
+        """Test that sampling never returns a slot outside the mask"""
+        pool = SlotPool(tracks(*'abcdefgh'))
+        mask = pool.mask([f'http://lastfm.example/{name}' for name in 'bdf'])
+        for _ in range(20):
+            assert set(pool.sample(mask, 2)) <= set(set_bits(mask))
+        assert sorted(pool.sample(mask, 10)) == set_bits(mask)
+
+    def test_refresh_keeps_slots_and_reuses_freed_ones(self):
+        """Test that surviving tracks keep their slot and new tracks fill departed tracks' slots"""
+        old = SlotPool(tracks('a', 'b', 'c'))
+        new = SlotPool(tracks('d', 'c', 'a', 'e'), previous=old)
+        assert new.slots['http://lastfm.example/a'] == old.slots['http://lastfm.example/a']
+        assert new.slots['http://lastfm.example/c'] == old.slots['http://lastfm.example/c']
+        assert new.slots['http://lastfm.example/d'] == old.slots['http://lastfm.example/b']
+        assert new.size == 4
+        assert len(new.tracks) == 4
+
+    def test_history_survives_refresh(self):
+        """Test that recent bits of surviving tracks carry over and departed tracks' bits are dropped"""
+        old = SlotPool(tracks('a', 'b', 'c'))
+        entry = (old.version, old.mask(['http://lastfm.example/a', 'http://lastfm.example/b']))
+        new = SlotPool(tracks('a', 'c', 'd'), previous=old)
+        assert urls(new, new.carry(entry)) == {'a'}
+        assert new.carry((new.version, 0b1)) == 0b1
+
+    def test_history_survives_several_refreshes(self):
+        """Test that an entry recorded several pool versions ago is remapped correctly"""
+        first = SlotPool(tracks('a', 'b', 'c'))
+        entry = (first.version, first.mask(['http://lastfm.example/a', 'http://lastfm.example/c']))
+        second = SlotPool(tracks('a', 'b', 'd'), previous=first)
+        third = SlotPool(tracks('a', 'b', 'd', 'c'), previous=second)
+        # c left and came back in another slot, so only a is still known to be recent
+        assert urls(third, third.carry(entry)) == {'a'}
+
+    def test_history_from_an_unrelated_layout_is_dropped(self):
+        """Test that an entry from a layout that was rebuilt from scratch is ignored"""
+        old = SlotPool(tracks('a', 'b'))
+        entry = (old.version, old.full)
+        rebuilt = SlotPool(tracks('b', 'a'))
+        assert rebuilt.carry(entry) == 0
+        assert rebuilt.carry(None) == 0
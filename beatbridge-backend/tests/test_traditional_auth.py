@@ -32,6 +32,21 @@ class TestTraditionalAuthentication:
         assert 'error' in data
         assert data['error'] == 'Passwords do not match'
 
+    @pytest.mark.parametrize('second, expected_error', [
+        ({'username': 'testuser', 'email': 'other@example.com'}, 'Username already exists'),
+        ({'username': 'TestUser', 'email': 'other@example.com'}, 'Username already exists'),
+        ({'username': 'otheruser', 'email': 'Test@Example.com'}, 'Email already exists'),
+    ])
+    def test_registration_duplicate(self, test_client, second, expected_error):
+        """Test that taken usernames and emails (in any case) are rejected by the unique indexes"""
+        first = {'username': 'testuser', 'email': 'test@example.com'}
+        for account in (first, second):
+            response = test_client.post('/api/register',
+                                      json=dict(account, password='TestPass123!', confirmation='TestPass123!'))
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == expected_error
+        assert User.query.count() == 1
+
     def test_login_success(self, test_client):
         """Test successful login with valid username and password"""
         # First register a user
@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import event, insert
+from app_factory import User, db
+from usernames import next_free_username, escape_like
+
+
+def add_users(*usernames):
+    db.session.execute(insert(User.__table__), [
+        {'username': name, 'email': f'{name}@example.com', 'hash': 'x', 'is_verified': True}
+        for name in usernames
+    ])
+    db.session.commit()
+
+
+def allocate(base):
+    """Run the allocator and return (username, number of SQL statements it issued)"""
+    statements = []
+    listener = lambda *args: statements.append(1)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        return next_free_username(db.session, User.username, base), len(statements)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+@pytest.mark.usefixtures('test_db')
+class TestUsernameAllocation:
+    """
+    Test suite for unique username allocation:
+    - Free names and the smallest free suffix
+    - LIKE escaping, unrelated names and case
+    - Constant query count with many collisions
+    - Google sign-up with a taken name
+    """
+
+    def test_free_name_is_used_as_is(self):
+        """Test that an unused name is returned unchanged"""
+        assert allocate('ShermanTan')[0] == 'ShermanTan'
+
+    def test_smallest_free_suffix_is_chosen(self):
+        """Test that gaps in the numbered names are filled first"""
+        add_users('ShermanTan', 'ShermanTan1', 'ShermanTan3')
+        assert allocate('ShermanTan')[0] == 'ShermanTan2'
+
+    def test_similar_names_do_not_count_as_taken(self):
+        """Test that names sharing the prefix but not the pattern are ignored"""
+        add_users('ShermanTan', 'ShermanTanner', 'ShermanTan01')
+        assert allocate('ShermanTan')[0] == 'ShermanTan1'
+
+    def test_names_are_compared_case_insensitively(self):
+        """Test that names differing only by case count as taken"""
+        add_users('shermantan', 'SHERMANTAN1')
+        assert allocate('ShermanTan')[0] == 'ShermanTan2'
+
+    def test_wildcards_are_escaped(self):
+        """Test that % and _ in the base name match literally"""
+        add_users('a_b', 'axb1')
+        assert escape_like('50%_off') == '50\\%\\_off'
+        assert allocate('a_b')[0] == 'a_b1'
+
+    def test_query_count_is_constant_with_10k_collisions(self):
+        """Test that 10k colliding names are resolved with a single query"""
+        add_users('popular', *[f'popular{i}' for i in range(1, 10000)])
+        username, queries = allocate('popular')
+        assert username == 'popular10000'
+        assert queries == 1
+
+    def test_google_sign_up_takes_next_free_name(self, test_client):
+        """Test that a Google sign-up whose name is taken gets the next suffix"""
+        add_users('testuser', 'testuser1')
+        response = test_client.get('/api/google-login/callback?code=test_code')
+        assert response.status_code == 302
+        assert 'google-auth-success' in response.location
+        assert User.query.filter_by(google_id='google_user_123').first().username == 'testuser2'
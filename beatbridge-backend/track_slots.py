@@ -0,0 +1,95 @@
+"""
+Integer slots for the tracks in a genre pool, so "recently recommended"
+history can be kept as a bitset instead of a set of track URLs.
+
+Every track in a pool gets a slot; a user's recent history for the genre is
+an int with one bit per slot, and picking fresh tracks is a few whole-int
+bit operations. When the pool is refreshed, tracks that are still in it keep
+their slots, and slots freed by tracks that left are handed to new ones.
+Each slot remembers the pool version it was last assigned in, so a bitset
+recorded against any earlier version is carried over by clearing the bits of
+slots reassigned since then.
+"""
+import itertools
+import random
+
+_versions = itertools.count(1)
+
+
+def set_bits(mask):
+    """Slot numbers of the bits set in mask, lowest first (one step per set bit, not per slot)"""
+    slots = []
+    while mask:
+        lowest = mask & -mask
+        slots.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return slots
+
+
+class SlotPool:
+    """A genre pool's tracks laid out by slot (None marks a slot freed by a departed track)"""
+
+    def __init__(self, tracks, previous=None):
+        self.source = tracks  # The pool list this was built from, to tell when it has been replaced
+        self.version = next(_versions)
+        if previous is None:
+            self.base_version = self.version  # Bitsets older than this were recorded against other slots
+            self.tracks = []
+            self.assigned_at = []
+        else:
+            self.base_version = previous.base_version
+            self.tracks = [None] * len(previous.tracks)
+            self.assigned_at = list(previous.assigned_at)
+
+        placed, arrivals = set(), []
+        for track in tracks:
+            url = track['url']
+            if url in placed:
+                continue
+            placed.add(url)
+            slot = previous.slots.get(url) if previous is not None else None
+            if slot is None:
+                arrivals.append(track)
+            else:
+                self.tracks[slot] = track
+        free = [slot for slot, track in enumerate(self.tracks) if track is None]
+        for slot in free:
+            self.assigned_at[slot] = self.version  # The departed track's bits no longer apply
+        for track, slot in itertools.zip_longest(arrivals, free):
+            if track is None:
+                break
+            if slot is None:
+                self.tracks.append(track)
+                self.assigned_at.append(self.version)
+            else:
+                self.tracks[slot] = track
+
+        self.slots = {track['url']: slot for slot, track in enumerate(self.tracks) if track is not None}
+        self.size = len(self.slots)
+        self.full = sum(1 << slot for slot in self.slots.values())
+
+    def mask(self, urls):
+        """Bitset of the given track URLs that are in this pool"""
+        mask = 0
+        for url in urls:
+            slot = self.slots.get(url)
+            if slot is not None:
+                mask |= 1 << slot
+        return mask
+
+    def carry(self, entry):
+        """A (version, bits) history entry as bits over this pool's slots (0 if it can't be carried)"""
+        if entry is None:
+            return 0
+        version, bits = entry
+        if version == self.version:
+            return bits
+        if version < self.base_version:
+            return 0
+        reassigned = sum(1 << slot for slot, assigned in enumerate(self.assigned_at) if assigned > version)
+        return bits & self.full & ~reassigned
+
+    def sample(self, mask, count):
+        """Up to `count` random slots from those set in mask"""
+        slots = set_bits(mask)
+        return random.sample(slots, min(count, len(slots)))
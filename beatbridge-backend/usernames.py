@@ -0,0 +1,47 @@
+"""
+Unique username allocation.
+
+Finds the first free name among "base", "base1", "base2", … with a single
+prefix query (served by the text_pattern_ops index on lower(users.username))
+instead of probing each candidate in turn. Names compare case-insensitively,
+matching the unique index on lower(username).
+"""
+from sqlalchemy import select, func
+
+# How many times a sign-up retries with a freshly allocated name after losing a race for it
+USERNAME_ALLOCATION_ATTEMPTS = 3
+
+
+def escape_like(value, escape='\\'):
+    """Escape LIKE wildcards so value matches literally"""
+    return (value.replace(escape, escape * 2)
+                 .replace('%', escape + '%')
+                 .replace('_', escape + '_'))
+
+
+def taken_suffixes(base, names):
+    """Suffix numbers already used for base (0 for base itself) among names, ignoring case"""
+    base = base.lower()
+    suffixes = set()
+    for name in names:
+        name = name.lower()
+        if not name.startswith(base):
+            continue
+        rest = name[len(base):]
+        if rest == '':
+            suffixes.add(0)
+        elif rest.isdigit() and rest.isascii() and not rest.startswith('0'):
+            suffixes.add(int(rest))
+    return suffixes
+
+
+def next_free_username(session, column, base):
+    """Smallest free name among base, base1, base2, … for the given username column"""
+    names = session.execute(
+        select(column).where(func.lower(column).like(escape_like(base.lower()) + '%', escape='\\'))
+    ).scalars()
+    suffixes = taken_suffixes(base, names)
+    suffix = 0
+    while suffix in suffixes:
+        suffix += 1
+    return f"{base}{suffix}" if suffix else base
@@ -190,6 +190,10 @@ const Profile = () => {
       });
       const data = await updateResponse.json();
       if (updateResponse.ok) {
+        if (data.token) {
+          // Email/password changes revoke the old token, so keep the refreshed one
+          localStorage.setItem('token', data.token);
+        }
         alert('Profile changes saved!');
         setForm(prev => ({ ...prev, password: '', confirmPassword: '' }));
         setSelectedProfilePic(null);